@@ -0,0 +1,209 @@
+"""Precomputed sales rollups.
+
+Each bill is added to three small tables inside the transaction that creates
+it:
+  sales_hourly / sales_daily - revenue and bill count per bucket and payment method
+  product_sales_daily        - units and revenue per day and product
+
+The writes are ``INSERT ... ON CONFLICT DO UPDATE SET x = x + excluded.x``
+upserts, executed once per table however many bills or lines there are, so
+concurrent terminals add to the same bucket without a read-modify-write.
+Reports read only from these tables, so their cost depends on the date range
+and not on how many bills exist.
+
+Buckets are computed in the shop's local time: ANALYTICS_UTC_OFFSET
+(e.g. "+05:30", default "+00:00") is applied to the UTC bill timestamps.
+
+Rebuild the rollups from existing bills (safe to re-run):
+
+    python analytics.py backfill
+"""
+import argparse
+import datetime
+import os
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func
+
+import models
+
+
+def _parse_offset(raw: str) -> datetime.timedelta:
+    sign = -1 if raw.startswith("-") else 1
+    hours, _, minutes = raw.lstrip("+-").partition(":")
+    return sign * datetime.timedelta(hours=int(hours or 0), minutes=int(minutes or 0))
+
+
+try:
+    UTC_OFFSET = _parse_offset(os.getenv("ANALYTICS_UTC_OFFSET", "+00:00"))
+except ValueError:
+    print("Warning: invalid ANALYTICS_UTC_OFFSET; using +00:00")
+    UTC_OFFSET = datetime.timedelta(0)
+
+
+def local_hour(created_at: datetime.datetime) -> datetime.datetime:
+    return (created_at + UTC_OFFSET).replace(minute=0, second=0, microsecond=0)
+
+
+def _upsert(db, model, rows: List[dict], keys: Tuple[str, ...], counters: Tuple[str, ...]):
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError(f"Sales rollups need INSERT ... ON CONFLICT; unsupported database {dialect!r}")
+    stmt = insert(model)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={col: getattr(model, col) + getattr(stmt.excluded, col) for col in counters},
+    )
+    # Fixed key order so two transactions touching the same buckets can't deadlock
+    db.execute(stmt, sorted(rows, key=lambda r: tuple(r[k] for k in keys)))
+
+
+def record_bills(db, bills: Iterable[dict]):
+    """Add ``bills`` (billing.insert_bills output) to the rollups, in the caller's transaction."""
+    hourly: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0])
+    daily: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0])
+    products: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0])
+    for bill in bills:
+        hour = local_hour(bill["created_at"])
+        method = bill["payment_method"] or "cash"
+        for bucket in (hourly[(hour, method)], daily[(hour.date(), method)]):
+            bucket[0] += 1
+            bucket[1] += bill["total_amount"] or 0.0
+        for item in bill["items"]:
+            line = products[(hour.date(), item["product_id"])]
+            line[0] += item["quantity"]
+            line[1] += (item["price"] or 0.0) * item["quantity"]
+
+    _upsert(
+        db, models.SalesHourly,
+        [{"hour": h, "payment_method": m, "bill_count": c, "revenue": r} for (h, m), (c, r) in hourly.items()],
+        ("hour", "payment_method"), ("bill_count", "revenue"),
+    )
+    _upsert(
+        db, models.SalesDaily,
+        [{"day": d, "payment_method": m, "bill_count": c, "revenue": r} for (d, m), (c, r) in daily.items()],
+        ("day", "payment_method"), ("bill_count", "revenue"),
+    )
+    _upsert(
+        db, models.ProductSalesDaily,
+        [{"day": d, "product_id": p, "units": u, "revenue": r} for (d, p), (u, r) in products.items()],
+        ("day", "product_id"), ("units", "revenue"),
+    )
+
+
+def _bill_dicts(bills: Iterable["models.Bill"]):
+    for bill in bills:
+        yield {
+            "created_at": bill.created_at,
+            "payment_method": bill.payment_method,
+            "total_amount": bill.total_amount,
+            "items": [{"product_id": i.product_id, "quantity": i.quantity, "price": i.price} for i in bill.items],
+        }
+
+
+def backfill(db, batch_size: int = 1000) -> int:
+    """Recompute every rollup from the bills table in one transaction. Returns the number of bills read."""
+    from sqlalchemy.orm import selectinload
+
+    for model in (models.SalesHourly, models.SalesDaily, models.ProductSalesDaily):
+        db.execute(delete(model))
+    total, last_id = 0, 0
+    while True:
+        # Keyset over the primary key so each batch is an index range scan
+        batch = (
+            db.query(models.Bill)
+            .options(selectinload(models.Bill.items))
+            .filter(models.Bill.id > last_id, models.Bill.created_at.isnot(None))
+            .order_by(models.Bill.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        record_bills(db, _bill_dicts(batch))
+        total += len(batch)
+        last_id = batch[-1].id
+        db.expunge_all()
+    db.commit()
+    return total
+
+
+def _day_range(query, column, start: Optional[datetime.date], end: Optional[datetime.date]):
+    if start is not None:
+        query = query.filter(column >= start)
+    if end is not None:
+        query = query.filter(column <= end)
+    return query
+
+
+def revenue(db, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None,
+            granularity: str = "day") -> List[dict]:
+    """Revenue and bill count per day (or hour), with the payment-method split."""
+    if granularity == "hour":
+        model, column = models.SalesHourly, models.SalesHourly.hour
+        start = datetime.datetime.combine(start, datetime.time()) if start else None
+        end = datetime.datetime.combine(end, datetime.time.max) if end else None
+    else:
+        model, column = models.SalesDaily, models.SalesDaily.day
+    rows = _day_range(db.query(column, model.payment_method, model.bill_count, model.revenue), column, start, end)
+    series: Dict[object, dict] = {}
+    for bucket, method, count, amount in rows.order_by(column).all():
+        entry = series.setdefault(bucket, {"bucket": bucket, "revenue": 0.0, "bill_count": 0, "payment_methods": {}})
+        entry["revenue"] += amount
+        entry["bill_count"] += count
+        entry["payment_methods"][method] = {"revenue": amount, "bill_count": count}
+    return list(series.values())
+
+
+def top_products(db, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None,
+                 limit: int = 10, by: str = "revenue") -> List[dict]:
+    rollup = models.ProductSalesDaily
+    units, amount = func.sum(rollup.units).label("units"), func.sum(rollup.revenue).label("revenue")
+    query = _day_range(
+        db.query(rollup.product_id, models.Product.name, units, amount)
+        .outerjoin(models.Product, models.Product.id == rollup.product_id),
+        rollup.day, start, end,
+    )
+    rows = (
+        query.group_by(rollup.product_id, models.Product.name)
+        .order_by((units if by == "units" else amount).desc(), rollup.product_id)
+        .limit(limit)
+        .all()
+    )
+    return [{"product_id": pid, "name": name, "units": u, "revenue": r} for pid, name, u, r in rows]
+
+
+def category_breakdown(db, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> List[dict]:
+    """Sales per product category (the product's current category)."""
+    rollup = models.ProductSalesDaily
+    units, amount = func.sum(rollup.units).label("units"), func.sum(rollup.revenue).label("revenue")
+    query = _day_range(
+        db.query(models.Product.category, units, amount)
+        .outerjoin(models.Product, models.Product.id == rollup.product_id),
+        rollup.day, start, end,
+    )
+    rows = query.group_by(models.Product.category).order_by(amount.desc()).all()
+    return [{"category": category, "units": u, "revenue": r} for category, u, r in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sales rollup maintenance")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    from database import SessionLocal, engine
+
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        print(f"Rebuilt sales rollups from {backfill(db, args.batch_size)} bills")
+    finally:
+        db.close()
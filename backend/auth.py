@@ -1,3 +1,7 @@
+import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -12,7 +16,25 @@ SECRET_KEY = "SECRET_KEY_GOES_HERE" # In production, use env variable
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 300
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Resolved users are cached per process so authenticated requests skip the users query.
+# Password changes and deactivation drop the entry here; other worker processes
+# see them within AUTH_USER_CACHE_TTL seconds.
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+AUTH_USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "1024"))
+# Trust the id and role in the token without any lookup: deactivation then only
+# takes effect when the user's tokens expire
+AUTH_STATELESS = os.getenv("AUTH_STATELESS", "0").lower() in ("1", "true", "yes")
+
+# Cost of new hashes; hashes at any other cost are flagged for a re-hash on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def verify_password(plain_password, hashed_password):
@@ -31,7 +53,50 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+def token_claims(user) -> dict:
+    """What a token carries about its user: enough to authorize without a lookup."""
+    return {"sub": user.username, "uid": user.id, "role": user.role}
+
+
+class UserCache:
+    """Small TTL + LRU map of user id -> schemas.User."""
+
+    def __init__(self, ttl: float = AUTH_USER_CACHE_TTL, max_entries: int = AUTH_USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._users: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[schemas.User]:
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self._users[user_id]
+                return None
+            self._users.move_to_end(user_id)
+            return user
+
+    def put(self, user: schemas.User):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._users[user.id] = (user, time.monotonic() + self.ttl)
+            self._users.move_to_end(user.id)
+            while len(self._users) > self.max_entries:
+                self._users.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+user_cache = UserCache()
+
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)) -> schemas.User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -42,10 +107,22 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = schemas.TokenData(username=username)
+        token_data = schemas.TokenData(username=username, user_id=payload.get("uid"), role=payload.get("role"))
     except JWTError:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == token_data.username).first()
-    if user is None:
+
+    if token_data.user_id is not None:
+        if AUTH_STATELESS and token_data.role:
+            return schemas.User(id=token_data.user_id, username=token_data.username, role=token_data.role, is_active=True)
+        user = user_cache.get(token_data.user_id)
+        if user is not None:
+            return user
+        db_user = db.get(models.User, token_data.user_id)
+    else:
+        # Tokens issued before they carried the user id
+        db_user = db.query(models.User).filter(models.User.username == token_data.username).first()
+    if db_user is None or db_user.is_active is False or db_user.username != token_data.username:
         raise credentials_exception
+    user = schemas.User(id=db_user.id, username=db_user.username, role=db_user.role or "staff", is_active=True)
+    user_cache.put(user)
     return user
@@ -0,0 +1,192 @@
+"""Offline accuracy/latency benchmark for the /recognize/ pipeline.
+
+Renders synthetic product labels (name + category text with random rotation,
+blur and noise), pushes them through the same OCR + matching code the API
+uses, and reports latency percentiles and throughput per worker count plus
+top-1/top-5 match accuracy split by which preprocessing pass produced the text.
+
+Runs on a CPU-only box with Tesseract installed; no server or network needed.
+
+    python bench_ocr.py                          # labels from the Product table
+    python bench_ocr.py --catalog products.csv   # labels from a fixture CSV (name,category,...)
+    python bench_ocr.py --samples 200 --workers 1,2,4 --json bench.json
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+import ocr
+import search_index
+
+FONT_CANDIDATES = [
+    "DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/Library/Fonts/Arial Bold.ttf",
+    r"C:\Windows\Fonts\arialbd.ttf",
+]
+
+
+def load_catalog(path: Optional[str]) -> List[Tuple[int, str, Optional[str]]]:
+    """(id, name, category) rows from a CSV fixture, or from the products table."""
+    if path:
+        rows = []
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for idx, row in enumerate(csv.DictReader(f), start=1):
+                name = (row.get("name") or row.get("Name") or "").strip()
+                if name:
+                    category = (row.get("category") or row.get("Category") or "").strip() or None
+                    rows.append((idx, name, category))
+        return rows
+    import database
+    import models
+    db = database.SessionLocal()
+    try:
+        return db.query(models.Product.id, models.Product.name, models.Product.category).all()
+    finally:
+        db.close()
+
+
+def _font(size: int):
+    for candidate in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except Exception:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1
+        return ImageFont.load_default()
+
+
+def render_label(name: str, category: Optional[str], rng: random.Random) -> bytes:
+    """A phone-photo-like JPEG of a product label."""
+    width, height = rng.choice([(1600, 1200), (2400, 1800), (4032, 3024)])
+    background = tuple(rng.randint(200, 255) for _ in range(3))
+    img = Image.new("RGB", (width, height), background)
+    draw = ImageDraw.Draw(img)
+    ink = tuple(rng.randint(0, 70) for _ in range(3))
+    title = _font(max(24, height // rng.randint(8, 14)))
+    draw.text((width // 12, height // 3), name, fill=ink, font=title)
+    if category:
+        draw.text((width // 12, height // 3 + int(title.size * 1.6)), category, fill=ink, font=_font(max(16, title.size // 2)))
+
+    img = img.rotate(rng.uniform(-8, 8), expand=True, fillcolor=background)
+    radius = rng.choice([0, 0, 0.8, 1.5, 2.5])
+    if radius:
+        img = img.filter(ImageFilter.GaussianBlur(radius))
+    noise = rng.choice([0, 8, 16, 24])
+    if noise:
+        grain = Image.effect_noise(img.size, noise).convert("RGB")
+        img = Image.blend(img, grain, 0.15)
+
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=rng.choice([70, 85, 92]))
+    return buf.getvalue()
+
+
+def _warm(_):
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def _bench_one(contents: bytes) -> Tuple[dict, float]:
+    start = time.perf_counter()
+    result = ocr.extract_text(contents)
+    return result, time.perf_counter() - start
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def run(samples: List[Tuple[int, bytes]], workers: int, index: search_index.ProductIndex) -> dict:
+    latencies: List[float] = []
+    passes = {"primary": {"n": 0, "top1": 0, "top5": 0}, "fallback": {"n": 0, "top1": 0, "top5": 0}}
+    with ProcessPoolExecutor(max_workers=workers, initializer=ocr._init_worker) as pool:
+        # Start the workers first so process spawn and model loading aren't counted as scan latency
+        list(pool.map(_warm, range(workers * 2)))
+        started = time.perf_counter()
+        for (expected_id, _), (result, elapsed) in zip(samples, pool.map(_bench_one, [c for _, c in samples])):
+            match_start = time.perf_counter()
+            tokens = search_index.extract_tokens(result["text"])
+            ranked, _ = index.match(tokens, result["text"])
+            latencies.append(elapsed + time.perf_counter() - match_start)
+            ids = [pid for pid, _ in ranked]
+            bucket = passes["fallback" if result["debug"].get("used_fallback") else "primary"]
+            bucket["n"] += 1
+            bucket["top1"] += int(ids[:1] == [expected_id])
+            bucket["top5"] += int(expected_id in ids[:5])
+    wall = time.perf_counter() - started
+
+    total = sum(b["n"] for b in passes.values()) or 1
+    return {
+        "workers": workers,
+        "samples": len(samples),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "throughput_per_s": round(len(samples) / wall, 2) if wall else None,
+        "top1": round(sum(b["top1"] for b in passes.values()) / total, 3),
+        "top5": round(sum(b["top5"] for b in passes.values()) / total, 3),
+        "by_pass": {
+            name: {
+                "n": b["n"],
+                "top1": round(b["top1"] / b["n"], 3) if b["n"] else None,
+                "top5": round(b["top5"] / b["n"], 3) if b["n"] else None,
+            }
+            for name, b in passes.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--catalog", help="CSV fixture with name[,category] columns; defaults to the products table")
+    parser.add_argument("--samples", type=int, default=50, help="number of synthetic labels")
+    parser.add_argument("--workers", default="1,2", help="comma-separated worker counts to compare")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    args = parser.parse_args()
+
+    if not ocr.available():
+        raise SystemExit("OCR not available. Install pillow+pytesseract and the Tesseract binary.")
+
+    catalog = load_catalog(args.catalog)
+    if not catalog:
+        raise SystemExit("Catalog is empty; pass --catalog or add products first.")
+    index = search_index.ProductIndex()
+    index.build(catalog)
+
+    rng = random.Random(args.seed)
+    picks = [rng.choice(catalog) for _ in range(args.samples)]
+    samples = [(pid, render_label(name, category, rng)) for pid, name, category in picks]
+
+    results = [run(samples, int(w), index) for w in args.workers.split(",") if w.strip()]
+
+    print(f"catalog={len(catalog)} samples={len(samples)} engine={os.getenv('OCR_ENGINE', 'auto')}")
+    print(f"{'workers':>7} {'p50 ms':>8} {'p95 ms':>8} {'scans/s':>8} {'top1':>6} {'top5':>6}  primary(n/top1/top5)  fallback(n/top1/top5)")
+    for r in results:
+        p, fb = r["by_pass"]["primary"], r["by_pass"]["fallback"]
+        print(
+            f"{r['workers']:>7} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['throughput_per_s']:>8} {r['top1']:>6} {r['top5']:>6}"
+            f"  {p['n']}/{p['top1']}/{p['top5']}  {fb['n']}/{fb['top1']}/{fb['top5']}"
+        )
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"catalog": len(catalog), "seed": args.seed, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
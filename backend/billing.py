@@ -0,0 +1,130 @@
+"""Set-based bill insertion shared by POST /bills/ and POST /bills/sync.
+
+Bills and their items are written with one multi-row INSERT each, whatever the
+number of bills or lines, and the API response is built from the rows in
+memory rather than re-read through the ORM.
+"""
+import base64
+import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import selectinload
+
+import database
+import models
+import product_codes
+import schemas
+
+
+class BillDraft:
+    """A bill ready to insert: lines are ``(product_id, quantity)``."""
+
+    def __init__(self, lines, payment_method: str = "cash", created_at: Optional[datetime.datetime] = None,
+                 idempotency_key: Optional[str] = None):
+        self.lines = list(lines)
+        self.payment_method = payment_method
+        if created_at is not None and created_at.tzinfo is not None:
+            # Columns are naive UTC
+            created_at = created_at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        self.created_at = created_at or datetime.datetime.utcnow()
+        self.idempotency_key = idempotency_key
+
+
+def quantities_for(drafts: List[BillDraft]) -> Dict[int, int]:
+    """Units sold per product across ``drafts``."""
+    totals: Dict[int, int] = {}
+    for draft in drafts:
+        for product_id, quantity in draft.lines:
+            totals[product_id] = totals.get(product_id, 0) + quantity
+    return totals
+
+
+def insert_bills(db, drafts: List[BillDraft], products: Dict[int, "models.Product"],
+                 new_stock: Optional[Dict[int, int]] = None) -> List[dict]:
+    """Insert ``drafts`` (prices taken from ``products``) and return schemas.Bill-shaped dicts.
+
+    Runs inside the caller's transaction; does not commit.
+    """
+    if not drafts:
+        return []
+    new_stock = new_stock or {}
+    bill_rows = [
+        {
+            "created_at": draft.created_at,
+            "total_amount": sum(products[pid].price * qty for pid, qty in draft.lines),
+            "payment_method": draft.payment_method,
+            "idempotency_key": draft.idempotency_key,
+        }
+        for draft in drafts
+    ]
+    bill_ids = database.insert_returning_ids(db, models.Bill, bill_rows)
+
+    # Rows from reserve_stock don't carry codes; one query instead of one per product
+    codes = product_codes.codes_of(db, products)
+    item_rows = [
+        {"bill_id": bill_id, "product_id": pid, "quantity": qty, "price": products[pid].price}
+        for bill_id, draft in zip(bill_ids, drafts)
+        for pid, qty in draft.lines
+    ]
+    item_ids = database.insert_returning_ids(db, models.BillItem, item_rows) if item_rows else []
+
+    items_by_bill: Dict[int, List[dict]] = {bill_id: [] for bill_id in bill_ids}
+    for item_id, row in zip(item_ids, item_rows):
+        items_by_bill[row["bill_id"]].append({
+            "id": item_id,
+            "product_id": row["product_id"],
+            "quantity": row["quantity"],
+            "price": row["price"],
+            "product": schemas.product_dict(
+                products[row["product_id"]], new_stock.get(row["product_id"]), codes[row["product_id"]]
+            ),
+        })
+    return [
+        {"id": bill_id, **row, "items": items_by_bill[bill_id]}
+        for bill_id, row in zip(bill_ids, bill_rows)
+    ]
+
+
+def encode_cursor(bill: "models.Bill") -> str:
+    raw = f"{bill.created_at.isoformat()}|{bill.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    """Inverse of encode_cursor; raises ValueError on anything malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, bill_id = raw.rsplit("|", 1)
+        return datetime.datetime.fromisoformat(created_at), int(bill_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def bill_history(db, limit: int, cursor: Optional[str] = None, start: Optional[datetime.datetime] = None,
+                 end: Optional[datetime.datetime] = None, payment_method: Optional[str] = None, skip: int = 0):
+    """One page of bills, newest first, with items, products and product codes loaded up front.
+
+    Returns ``(bills, next_cursor)``. Paging seeks on (created_at, id) through
+    ix_bills_created_at_id instead of OFFSET, so every page costs the same no
+    matter how deep it is, and the whole page takes four queries (bills, items,
+    products, codes; tests/test_bills.py holds it to that). ``skip`` is
+    a plain OFFSET, kept for clients that still page the old way.
+    """
+    Bill = models.Bill
+    query = db.query(Bill).options(
+        selectinload(Bill.items).selectinload(models.BillItem.product).selectinload(models.Product.code_rows)
+    )
+    if cursor:
+        created_at, bill_id = decode_cursor(cursor)
+        query = query.filter(or_(Bill.created_at < created_at, and_(Bill.created_at == created_at, Bill.id < bill_id)))
+    if start is not None:
+        query = query.filter(Bill.created_at >= start)
+    if end is not None:
+        query = query.filter(Bill.created_at < end)
+    if payment_method:
+        query = query.filter(Bill.payment_method == payment_method)
+    # One extra row tells whether another page exists without a COUNT
+    bills = query.order_by(Bill.created_at.desc(), Bill.id.desc()).offset(skip).limit(limit + 1).all()
+    next_cursor = encode_cursor(bills[limit - 1]) if len(bills) > limit else None
+    return bills[:limit], next_cursor
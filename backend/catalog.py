@@ -0,0 +1,130 @@
+"""Catalog change versions for delta sync.
+
+Every catalog write stamps the touched products with a new value of one
+global counter (catalog_state.version), and deletes leave a tombstone at
+their version. A terminal that last synced at version V asks for everything
+stamped after V and gets the changed rows plus the tombstones.
+
+The counter is bumped with ``UPDATE ... RETURNING`` as the last statement
+before commit. On PostgreSQL that row lock is held until commit, so versions
+become visible in increasing order and a reader can never see version V+1
+while V is still uncommitted (which a plain sequence would allow). Taking it
+last, after any product row locks, keeps the lock order the same everywhere
+and the hold time short.
+"""
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, insert, or_, select, update
+from sqlalchemy.orm import selectinload
+
+import models
+
+CHANGES_PAGE_MAX = 1000
+
+
+def ensure_state(db):
+    if db.get(models.CatalogState, 1) is None:
+        db.add(models.CatalogState(id=1, version=0))
+        db.commit()
+
+
+def current_version(db) -> int:
+    return db.scalar(select(models.CatalogState.version).where(models.CatalogState.id == 1)) or 0
+
+
+def bump(db) -> int:
+    """Claim the next version in the caller's transaction. Call it right before commit."""
+    state = models.CatalogState.__table__
+    version = db.scalar(update(state).where(state.c.id == 1).values(version=state.c.version + 1).returning(state.c.version))
+    if version is None:
+        db.execute(insert(state).values(id=1, version=1))
+        version = 1
+    return version
+
+
+def touch(db, product_ids: Iterable[int]) -> Optional[int]:
+    """Stamp ``product_ids`` as changed. Returns the new version (None if there was nothing to stamp)."""
+    ids = sorted(set(product_ids))
+    if not ids:
+        return None
+    version = bump(db)
+    products = models.Product.__table__
+    db.execute(update(products).where(products.c.id.in_(ids)).values(version=version))
+    return version
+
+
+def tombstone(db, kind: str, key) -> int:
+    """Record that a product (kind="product", key=id) or a category (kind="category", key=name) is gone."""
+    version = bump(db)
+    values = {"kind": kind, "key": str(key), "version": version}
+    existing = db.query(models.CatalogTombstone).filter_by(kind=kind, key=str(key)).first()
+    if existing is not None:
+        existing.version = version
+    else:
+        db.execute(insert(models.CatalogTombstone).values(**values))
+    return version
+
+
+def etag(version: int, *parts) -> str:
+    return '"' + "-".join(str(p) for p in (version, *parts)) + '"'
+
+
+def etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or tag in candidates
+
+
+def parse_cursor(cursor: str) -> Tuple[int, int, int]:
+    """``upto.version.id`` as handed out in a changes page."""
+    try:
+        upto, version, product_id = (int(part) for part in cursor.split("."))
+        return upto, version, product_id
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def changes(db, since: Optional[int], limit: int, cursor: Optional[str] = None) -> dict:
+    """Products stamped after ``since`` (all products when None) in (version, id) order, plus tombstones.
+
+    A page that fills ``limit`` carries a ``cursor``; pass it back with the same
+    ``since`` to continue. Once ``has_more`` is false, store ``version`` and
+    use it as the next ``since``. Tombstones come with the first page.
+    """
+    Product = models.Product
+    if cursor:
+        upto, after_version, after_id = parse_cursor(cursor)
+    else:
+        upto, after_version, after_id = current_version(db), None, None
+
+    query = db.query(Product).options(selectinload(Product.code_rows)).filter(Product.version <= upto)
+    if since is not None:
+        query = query.filter(Product.version > since)
+    if after_version is not None:
+        query = query.filter(or_(Product.version > after_version, and_(Product.version == after_version, Product.id > after_id)))
+    rows: List[models.Product] = query.order_by(Product.version, Product.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    deleted_products: List[int] = []
+    deleted_categories: List[str] = []
+    if cursor is None and since is not None:
+        for kind, key in (
+            db.query(models.CatalogTombstone.kind, models.CatalogTombstone.key)
+            .filter(models.CatalogTombstone.version > since, models.CatalogTombstone.version <= upto)
+            .order_by(models.CatalogTombstone.version)
+        ):
+            if kind == "product":
+                deleted_products.append(int(key))
+            else:
+                deleted_categories.append(key)
+
+    return {
+        "version": upto,
+        "products": rows,
+        "deleted_products": deleted_products,
+        "deleted_categories": deleted_categories,
+        "has_more": has_more,
+        "cursor": f"{upto}.{rows[-1].version or 0}.{rows[-1].id}" if has_more else None,
+    }
@@ -0,0 +1,110 @@
+"""Categories as a table, with per-category product counts and stock value.
+
+``Product.category`` keeps the category name (what the API and the search
+indexes use), and ``Product.category_id`` points at the categories row; every
+write path sets both through ``ensure``. Each category row carries
+``product_count`` and ``stock_value`` (sum of price * stock), recomputed by
+``refresh_stats`` for exactly the categories a transaction touched, so
+GET /categories reads a handful of rows instead of the catalog. Checkouts
+only move stock, so ``record_sale`` subtracts what was sold from stock_value
+rather than re-summing every product in the category on each bill.
+
+``backfill`` creates rows for category names that predate the table and links
+products to them; it runs at startup and is a no-op once everything is linked.
+"""
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import bindparam, func, select, update
+
+import models
+
+
+def ensure(db, names: Iterable[Optional[str]]) -> Dict[str, int]:
+    """Category ids for ``names``, creating missing categories (safe against concurrent creators)."""
+    wanted = {name for name in names if name}
+    if not wanted:
+        return {}
+    found = dict(db.execute(select(models.Category.name, models.Category.id).where(models.Category.name.in_(wanted))).all())
+    missing = wanted - set(found)
+    if missing:
+        dialect = db.get_bind().dialect.name
+        rows = [{"name": name} for name in sorted(missing)]
+        if dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            db.execute(insert(models.Category).on_conflict_do_nothing(index_elements=["name"]), rows)
+        else:
+            db.execute(models.Category.__table__.insert(), rows)
+        found.update(db.execute(select(models.Category.name, models.Category.id).where(models.Category.name.in_(missing))).all())
+    return found
+
+
+def ensure_one(db, name: Optional[str]) -> Optional[int]:
+    return ensure(db, [name]).get(name) if name else None
+
+
+def refresh_stats(db, category_ids: Iterable[Optional[int]]):
+    """Recompute product_count / stock_value for ``category_ids`` from their products (index on category_id)."""
+    ids = sorted({cid for cid in category_ids if cid is not None})
+    if not ids:
+        return
+    products = models.Product.__table__
+    in_category = products.c.category_id == models.Category.__table__.c.id
+    db.execute(
+        update(models.Category.__table__)
+        .where(models.Category.__table__.c.id.in_(ids))
+        .values(
+            product_count=select(func.count()).where(in_category).scalar_subquery(),
+            stock_value=select(func.coalesce(func.sum(products.c.price * products.c.stock), 0.0)).where(in_category).scalar_subquery(),
+        )
+    )
+
+
+def record_sale(db, products: Dict[int, "models.Product"], removed: Dict[int, Optional[int]]):
+    """Take the sold stock (``removed``: product_id -> units, as from inventory.reserve_stock) out of stock_value.
+
+    Categories with a sale of unknown size are recomputed with ``refresh_stats`` instead.
+    """
+    deltas: Dict[int, float] = {}
+    unknown = set()
+    for product_id, units in removed.items():
+        product = products[product_id]
+        if product.category_id is None:
+            continue
+        if units is None:
+            unknown.add(product.category_id)
+        else:
+            deltas[product.category_id] = deltas.get(product.category_id, 0.0) - (product.price or 0.0) * units
+    rows = [{"cid": cid, "delta": delta} for cid, delta in sorted(deltas.items()) if cid not in unknown and delta]
+    if rows:
+        categories = models.Category.__table__
+        # In id order, like the product rows before them, so concurrent checkouts lock in the same order
+        db.execute(
+            update(categories)
+            .where(categories.c.id == bindparam("cid"))
+            .values(stock_value=categories.c.stock_value + bindparam("delta")),
+            rows,
+        )
+    refresh_stats(db, unknown)
+
+
+def backfill(db):
+    """Link products whose category name has no category_id yet; refresh stats for what changed."""
+    products = models.Product.__table__
+    pending = [name for (name,) in db.execute(
+        select(products.c.category).where(products.c.category.isnot(None), products.c.category_id.is_(None)).distinct()
+    )]
+    if not pending:
+        return 0
+    ids = ensure(db, pending)
+    for name, category_id in ids.items():
+        db.execute(
+            update(products)
+            .where(products.c.category == name, products.c.category_id.is_(None))
+            .values(category_id=category_id)
+        )
+    refresh_stats(db, ids.values())
+    db.commit()
+    return len(ids)
@@ -1,4 +1,6 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import create_engine, event, insert
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -36,9 +38,41 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+def insert_returning_ids(db, model, rows):
+    """Insert ``rows`` with one multi-row INSERT ... RETURNING; ids come back in the order of ``rows``."""
+    if db.get_bind().dialect.name == "sqlite":
+        # SQLAlchemy has no sentinel to sort by on SQLite and would fall back to one INSERT per
+        # row. A single statement gets its rowids in VALUES order under the database write lock,
+        # so sorting the returned ids pairs them back up.
+        return sorted(db.scalars(insert(model).returning(model.id), rows).all())
+    # Elsewhere (PostgreSQL) SQLAlchemy sorts the RETURNING rows into parameter order itself
+    return db.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows).all()
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+# Per-request SQL statement counter, used for debug headers like X-Query-Count
+_query_count: ContextVar = ContextVar("query_count", default=None)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _query_count.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+@contextmanager
+def count_queries():
+    """Count statements executed in this context; read the total from the yielded list's [0]."""
+    counter = [0]
+    token = _query_count.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_count.reset(token)
@@ -0,0 +1,142 @@
+"""Terminal (device) registration for /token, and write-behind last_login.
+
+A login from a known device is one lookup on the unique (user_id, device_id)
+index and no write at all: its last_login goes into an in-process buffer
+that a background thread flushes every LAST_LOGIN_FLUSH_INTERVAL seconds as
+one executemany UPDATE. So 50 terminals signing in at shift start don't
+queue up behind each other's commits (on SQLite, the database-wide write lock).
+
+A new device is registered by a single ``INSERT ... SELECT ... WHERE
+(device count) < limit ON CONFLICT DO NOTHING``, and two logins racing on the
+same new device end up with one row. Under READ COMMITTED (PostgreSQL) two
+such statements for different new devices could both count the same
+committed rows and both insert, so the user's row is locked with
+``SELECT ... FOR UPDATE`` first; concurrent registrations for one user then
+count one after another. SQLite's database-wide write lock already
+serializes the statement (and has no FOR UPDATE).
+
+last_login may lag by up to the flush interval, and a crash loses at most
+that much of it. LAST_LOGIN_FLUSH_INTERVAL=0 writes it on every login again.
+"""
+import datetime
+import logging
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, func, insert, literal, select, true, update
+from sqlalchemy.exc import IntegrityError
+
+import database
+import models
+
+logger = logging.getLogger("dbiller")
+
+DEVICE_LIMIT = int(os.getenv("DEVICE_LIMIT", "2"))  # devices per user; -1 = unlimited
+LAST_LOGIN_FLUSH_INTERVAL = float(os.getenv("LAST_LOGIN_FLUSH_INTERVAL", "10"))
+
+
+def _insert_ignoring_duplicates(db, columns, row):
+    table = models.UserDevice.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(table).from_select(columns, row)  # a duplicate raises IntegrityError instead
+    return dialect_insert(table).from_select(columns, row).on_conflict_do_nothing(index_elements=["user_id", "device_id"])
+
+
+def register(db, user_id: int, device_id: str, limit: int = DEVICE_LIMIT) -> bool:
+    """Make sure ``device_id`` is registered for the user; False if it is new and the limit is reached. Commits."""
+    devices = models.UserDevice.__table__
+    known = and_(devices.c.user_id == user_id, devices.c.device_id == device_id)
+    if db.scalar(select(devices.c.id).where(known)) is not None:
+        last_logins.touch(user_id, device_id)
+        return True
+
+    room = true() if limit == -1 else (
+        select(func.count()).select_from(devices).where(devices.c.user_id == user_id).scalar_subquery() < limit
+    )
+    row = select(literal(user_id), literal(device_id), literal(datetime.datetime.utcnow())).where(room)
+    columns = [devices.c.user_id, devices.c.device_id, devices.c.last_login]
+    try:
+        if limit != -1:
+            # Held until the commit below; ignored by dialects without FOR UPDATE
+            db.execute(select(models.User.id).where(models.User.id == user_id).with_for_update())
+        inserted = db.execute(_insert_ignoring_duplicates(db, columns, row)).rowcount
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        inserted = 0
+    # Nothing inserted: either a concurrent login registered it first, or the limit is reached
+    return bool(inserted) or db.scalar(select(devices.c.id).where(known)) is not None
+
+
+class LastLoginBuffer:
+    """Latest login time per (user_id, device_id), flushed in batches."""
+
+    def __init__(self, interval: float = LAST_LOGIN_FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending: Dict[Tuple[int, str], datetime.datetime] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+
+    def touch(self, user_id: int, device_id: str, when: Optional[datetime.datetime] = None):
+        with self._lock:
+            self._pending[(user_id, device_id)] = when or datetime.datetime.utcnow()
+        if self.interval <= 0:
+            self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        devices = models.UserDevice.__table__
+        stmt = (
+            update(devices)
+            .where(devices.c.user_id == bindparam("uid"), devices.c.device_id == bindparam("dev"))
+            .values(last_login=bindparam("ts"))
+        )
+        rows = [{"uid": uid, "dev": dev, "ts": ts} for (uid, dev), ts in sorted(pending.items())]
+        db = database.SessionLocal()
+        try:
+            db.execute(stmt, rows)
+            db.commit()
+            self.flushes += 1
+        except Exception:
+            db.rollback()
+            logger.exception("last_login flush failed; will retry")
+            with self._lock:
+                for key, ts in pending.items():
+                    if key not in self._pending or self._pending[key] < ts:
+                        self._pending[key] = ts
+            return 0
+        finally:
+            db.close()
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="last-login-flush", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the flusher and write out whatever is buffered."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+
+last_logins = LastLoginBuffer()
@@ -0,0 +1,139 @@
+"""Streaming CSV / NDJSON exports of bills and products.
+
+Rows are fetched with ``yield_per`` (a server-side cursor on PostgreSQL),
+encoded as they arrive and sent out in ~64 KB chunks, optionally gzipped on
+the fly. Memory use stays flat however many rows there are, and the header
+(CSV) goes out before the first query finishes. Each export opens its own
+session, because the response body is produced after the request's
+dependency-managed session is gone.
+"""
+import csv
+import datetime
+import io
+import json
+import zlib
+from typing import Iterator, Optional
+
+from sqlalchemy import select
+
+import database
+import models
+
+EXPORT_BATCH = 1000
+CHUNK_BYTES = 64 * 1024
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+BILL_COLUMNS = [
+    "bill_id", "created_at", "payment_method", "total_amount",
+    "item_id", "product_id", "product_name", "quantity", "price", "line_total",
+]
+PRODUCT_COLUMNS = ["id", "name", "category", "price", "stock", "image_url"]
+
+
+def _bill_query(start: Optional[datetime.datetime], end: Optional[datetime.datetime]):
+    bills, items, products = models.Bill.__table__, models.BillItem.__table__, models.Product.__table__
+    query = (
+        select(
+            bills.c.id, bills.c.created_at, bills.c.payment_method, bills.c.total_amount,
+            items.c.id, items.c.product_id, products.c.name, items.c.quantity, items.c.price,
+        )
+        .select_from(bills.outerjoin(items, items.c.bill_id == bills.c.id).outerjoin(products, products.c.id == items.c.product_id))
+        .order_by(bills.c.id, items.c.id)
+    )
+    if start is not None:
+        query = query.where(bills.c.created_at >= start)
+    if end is not None:
+        query = query.where(bills.c.created_at < end)
+    return query
+
+
+def _rows(query) -> Iterator[tuple]:
+    db = database.SessionLocal()
+    try:
+        for row in db.execute(query.execution_options(yield_per=EXPORT_BATCH)):
+            yield tuple(row)
+    finally:
+        db.close()
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else value
+
+
+def _bill_csv(rows) -> Iterator[list]:
+    yield BILL_COLUMNS
+    for bill_id, created_at, method, total, item_id, product_id, name, quantity, price in rows:
+        line_total = quantity * price if quantity is not None and price is not None else None
+        yield [bill_id, _iso(created_at), method, total, item_id, product_id, name, quantity, price, line_total]
+
+
+def _bill_ndjson(rows) -> Iterator[dict]:
+    # Rows arrive ordered by bill, so each bill is complete once the next one starts
+    current = None
+    for bill_id, created_at, method, total, item_id, product_id, name, quantity, price in rows:
+        if current is None or current["id"] != bill_id:
+            if current is not None:
+                yield current
+            current = {"id": bill_id, "created_at": _iso(created_at), "payment_method": method, "total_amount": total, "items": []}
+        if item_id is not None:
+            current["items"].append({"id": item_id, "product_id": product_id, "product_name": name, "quantity": quantity, "price": price})
+    if current is not None:
+        yield current
+
+
+def _encode(records, fmt: str) -> Iterator[str]:
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for record in records:
+            writer.writerow(record)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    else:
+        for record in records:
+            yield json.dumps(record, separators=(",", ":")) + "\n"
+
+
+def _chunked(pieces: Iterator[str], compress: bool) -> Iterator[bytes]:
+    gz = zlib.compressobj(wbits=31) if compress else None  # wbits=31: gzip container
+    pending, size, first = [], 0, True
+    for piece in pieces:
+        pending.append(piece.encode("utf-8"))
+        size += len(pending[-1])
+        # Flush the first record straight away so the client sees bytes immediately
+        if first or size >= CHUNK_BYTES:
+            data = b"".join(pending)
+            pending, size, first = [], 0, False
+            if gz is not None:
+                data = gz.compress(data) + gz.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+    data = b"".join(pending)
+    if gz is not None:
+        data = gz.compress(data) + gz.flush()
+    if data:
+        yield data
+
+
+def export_bills(fmt: str, start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None,
+                 compress: bool = False) -> Iterator[bytes]:
+    """One CSV line per bill item, or one NDJSON object per bill with its items nested."""
+    rows = _rows(_bill_query(start, end))
+    records = _bill_csv(rows) if fmt == "csv" else _bill_ndjson(rows)
+    return _chunked(_encode(records, fmt), compress)
+
+
+def export_products(fmt: str, compress: bool = False) -> Iterator[bytes]:
+    products = models.Product.__table__
+    rows = _rows(select(*(products.c[col] for col in PRODUCT_COLUMNS)).order_by(products.c.id))
+    if fmt == "csv":
+        records = (r for part in ([PRODUCT_COLUMNS], rows) for r in part)
+    else:
+        records = (dict(zip(PRODUCT_COLUMNS, row)) for row in rows)
+    return _chunked(_encode(records, fmt), compress)
+
+
+def filename(kind: str, fmt: str, compress: bool) -> str:
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    return f"{kind}-{stamp}.{fmt}" + (".gz" if compress else "")
@@ -1,18 +1,84 @@
-import uuid
+"""License key management.
+
+    python generate_license.py                                  # one key, printed
+    python generate_license.py generate -n 10000 --batch acme --csv acme.csv
+    python generate_license.py export --batch acme --status unused --csv unused.csv
+    python generate_license.py stats [--batch acme]
+    python generate_license.py revoke --batch acme              # every unused key of the batch
+    python generate_license.py revoke KEY [KEY ...] [--file keys.txt]
+"""
+import argparse
+import sys
+
 from database import SessionLocal, engine
+import licenses
 import models
 
-# Ensure tables exist
-models.Base.metadata.create_all(bind=engine)
 
-def generate_key():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="License key management")
+    commands = parser.add_subparsers(dest="command")
+
+    generate = commands.add_parser("generate", help="issue new keys")
+    generate.add_argument("-n", "--count", type=int, default=1)
+    generate.add_argument("--batch", help="label stored with the keys, e.g. the reseller")
+    generate.add_argument("--csv", help="also write the new keys to this CSV file")
+
+    export = commands.add_parser("export", help="write keys to CSV")
+    export.add_argument("--csv", help="output file (default: stdout)")
+    export.add_argument("--batch")
+    export.add_argument("--status", choices=licenses.STATUSES, default="all")
+
+    stats = commands.add_parser("stats", help="used/unused/revoked counts")
+    stats.add_argument("--batch")
+
+    revoke = commands.add_parser("revoke", help="revoke unused keys")
+    revoke.add_argument("keys", nargs="*")
+    revoke.add_argument("--file", help="file with one key per line (a CSV export works too)")
+    revoke.add_argument("--batch", help="revoke every unused key of this batch")
+
+    args = parser.parse_args(argv)
+
+    # Ensure tables exist
+    models.Base.metadata.create_all(bind=engine)
+    licenses.ensure_schema(engine)
     db = SessionLocal()
-    key = str(uuid.uuid4())
-    license_obj = models.License(key=key)
-    db.add(license_obj)
-    db.commit()
-    print(f"Generated License Key: {key}")
-    db.close()
+    try:
+        if args.command in (None, "generate"):
+            count, batch = (args.count, args.batch) if args.command else (1, None)
+            if count < 1:
+                parser.error("--count must be at least 1")
+            keys = licenses.generate(db, count, batch)
+            if args.command is None:
+                print(f"Generated License Key: {keys[0]}")
+            elif args.csv:
+                with open(args.csv, "w", newline="", encoding="utf-8") as out:
+                    licenses.export_keys(out, keys, batch)
+                print(f"Generated {len(keys)} license keys -> {args.csv}")
+            else:
+                print("\n".join(keys))
+        elif args.command == "export":
+            if args.csv:
+                with open(args.csv, "w", newline="", encoding="utf-8") as out:
+                    written = licenses.export(db, out, args.batch, args.status)
+                print(f"Exported {written} license keys -> {args.csv}")
+            else:
+                licenses.export(db, sys.stdout, args.batch, args.status)
+        elif args.command == "stats":
+            counts = licenses.counts(db, args.batch)
+            print(" ".join(f"{name}={counts[name]}" for name in ("total", "unused", "used", "revoked")))
+        elif args.command == "revoke":
+            keys = list(args.keys)
+            if args.file:
+                with open(args.file, encoding="utf-8") as f:
+                    keys += [line.split(",")[0].strip() for line in f if line.strip()]
+                keys = [key for key in keys if key and key != "key"]  # skip an export's header row
+            if not keys and args.batch is None:
+                parser.error("give keys, --file or --batch")
+            print(f"Revoked {licenses.revoke(db, keys, args.batch)} license keys")
+    finally:
+        db.close()
+
 
 if __name__ == "__main__":
-    generate_key()
+    main()
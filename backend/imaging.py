@@ -0,0 +1,110 @@
+"""Image ingestion for OCR.
+
+Camera uploads are 12 MP JPEGs; decoding them at full resolution only to
+thumbnail them afterwards dominated the CPU cost of a scan. Here the JPEG is
+draft-decoded straight to (roughly) the working size, grayscale/autocontrast
+is computed once and shared by the primary and fallback OCR passes, and
+binarization uses a precomputed lookup table instead of a Python lambda.
+
+Limits (checked before any pixel data is decoded):
+OCR_MAX_BYTES (default 15 MB) and OCR_MAX_PIXELS (default 50 MP).
+"""
+import io
+import os
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps, ImageFilter
+except Exception:
+    Image = ImageOps = ImageFilter = None
+
+OCR_MAX_BYTES = int(os.getenv("OCR_MAX_BYTES", str(15 * 1024 * 1024)))
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", str(50_000_000)))
+OCR_MAX_DIM = int(os.getenv("OCR_MAX_DIM", "1800"))
+UPSCALE_LIMIT = 2000
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def open_image(contents: bytes) -> "Image.Image":
+    """Open an upload lazily, enforcing byte and pixel limits before decoding."""
+    if len(contents) > OCR_MAX_BYTES:
+        raise ImageTooLarge(f"Image too large ({len(contents)} bytes, max {OCR_MAX_BYTES})")
+    try:
+        img = Image.open(io.BytesIO(contents))
+    except Exception as e:
+        raise ValueError(f"Invalid image file: {e}")
+    width, height = img.size
+    if width * height > OCR_MAX_PIXELS:
+        raise ImageTooLarge(f"Image too large ({width}x{height}, max {OCR_MAX_PIXELS} pixels)")
+    return img
+
+
+@lru_cache(maxsize=16)
+def _threshold_lut(threshold: int) -> List[int]:
+    return [255 if p > threshold else 0 for p in range(256)]
+
+
+def binarize(img: "Image.Image", threshold: int) -> "Image.Image":
+    return img.point(_threshold_lut(threshold))
+
+
+class OCRImage:
+    """Decoded upload plus the preprocessed variants each OCR pass needs, built once on demand."""
+
+    def __init__(self, contents: bytes, region: Optional[Tuple[int, int, int, int]] = None, max_dim: int = OCR_MAX_DIM):
+        img = open_image(contents)
+        self.size_before = img.size
+        try:
+            if region is None:
+                # Let libjpeg decode grayscale at 1/2, 1/4 or 1/8 scale, never below the working size
+                width, height = img.size
+                ratio = min(1.0, max_dim / max(width, height))
+                img.draft("L", (max(1, int(width * ratio)), max(1, int(height * ratio))))
+                img = ImageOps.exif_transpose(img)  # correct orientation from camera metadata
+            else:
+                # Region boxes are in full-resolution coordinates, so decode at full size
+                img = ImageOps.exif_transpose(img)
+                x, y, w, h = region
+                img = img.crop((x, y, x + w, y + h))
+            if max(img.size) > max_dim:
+                img.thumbnail((max_dim, max_dim))
+            img.load()
+        except ImageTooLarge:
+            raise
+        except Exception as e:
+            raise ValueError(f"Invalid image file: {e}")
+        self.image = img
+        self._gray = None
+        self._sharpened = None
+
+    @property
+    def gray(self) -> "Image.Image":
+        """Grayscale + autocontrast, shared by every pass."""
+        if self._gray is None:
+            self._gray = ImageOps.autocontrast(self.image.convert("L"))
+        return self._gray
+
+    @property
+    def sharpened(self) -> "Image.Image":
+        if self._sharpened is None:
+            self._sharpened = self.gray.filter(ImageFilter.SHARPEN)
+        return self._sharpened
+
+    def primary(self, threshold: Optional[int]) -> "Image.Image":
+        """Sharpen + binarize pass."""
+        if threshold is None:
+            return self.sharpened
+        return binarize(self.sharpened, threshold)
+
+    def fallback(self, enlarge: float = 1.3) -> "Image.Image":
+        """Softer pass: upscale the shared grayscale, then sharpen, no binarization."""
+        img = self.gray
+        if enlarge != 1.0:
+            new_w = min(int(img.width * enlarge), UPSCALE_LIMIT)
+            new_h = min(int(img.height * enlarge), UPSCALE_LIMIT)
+            img = img.resize((new_w, new_h), resample=getattr(Image, "Resampling", Image).LANCZOS)
+        return img.filter(ImageFilter.SHARPEN)
@@ -0,0 +1,288 @@
+"""Streaming, batched product CSV import.
+
+The upload is spooled to a file under IMPORT_DIR and parsed row by row from
+there, IMPORT_CHUNK rows at a time, so memory doesn't grow with the file.
+Each chunk is one short transaction:
+  1. one ``SELECT id, name ... WHERE name IN (...)`` to find existing products,
+  2. the chunk's category names resolved to ids (categories.ensure),
+  3. one executemany UPDATE for those (price/stock always, category and
+     image_url only when the row has them),
+  4. one multi-row INSERT ... RETURNING for the rest,
+  5. barcode/SKU codes for rows that have them (one owner lookup, one
+     delete and one insert),
+  6. the touched categories' stats, a catalog version stamp and the job's
+     progress counters.
+Re-uploading a price list therefore updates products instead of duplicating
+them. Names aren't unique in existing databases, so matching is a lookup
+rather than ON CONFLICT; every product with the name is updated (codes go to
+the oldest of them, as a code belongs to one product). A name repeated within
+one chunk is upserted once with its last row's values; the rows it replaced
+are counted as ``merged`` and listed in the error CSV.
+
+Jobs run on a small thread pool (IMPORT_WORKERS, default 1) and are recorded
+in the import_jobs table; every rejected row goes to a per-job error CSV
+(row number, reason, original values).
+"""
+import csv
+import datetime
+import logging
+import os
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, select, update
+
+import catalog
+import categories
+import database
+import models
+import product_codes
+
+logger = logging.getLogger("dbiller")
+
+IMPORT_DIR = os.getenv("IMPORT_DIR", "imports")
+IMPORT_CHUNK = int(os.getenv("IMPORT_CHUNK", "1000"))
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "1"))
+
+_executor = ThreadPoolExecutor(max_workers=max(1, IMPORT_WORKERS), thread_name_prefix="import")
+
+# Called after each committed chunk with (id, name, category) rows, to refresh in-process caches
+ProductsChanged = Callable[[List[Tuple[int, str, Optional[str]]]], None]
+
+
+def upload_path(job_id: str) -> str:
+    return os.path.join(IMPORT_DIR, f"{job_id}.csv")
+
+
+def error_path(job_id: str) -> str:
+    return os.path.join(IMPORT_DIR, f"{job_id}-errors.csv")
+
+
+def new_job(db, filename: str, user_id: Optional[int]) -> models.ImportJob:
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    job = models.ImportJob(id=uuid.uuid4().hex, filename=filename, status="queued", created_by=user_id)
+    db.add(job)
+    db.commit()
+    return job
+
+
+def check_header(path: str):
+    """Raise ValueError unless the file starts with a decodable header row."""
+    try:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            header = next(csv.reader(f), None)
+    except UnicodeDecodeError:
+        raise ValueError("Unable to decode CSV. Use UTF-8 encoding.")
+    if not header:
+        raise ValueError("CSV needs a header row with at least name,price,stock.")
+
+
+def parse_row(row: dict, default_category: Optional[str]) -> dict:
+    """One CSV row as product values; raises ValueError with the reason."""
+    name = (row.get("name") or row.get("Name") or "").strip()
+    if not name:
+        raise ValueError("missing name")
+    try:
+        price = float(row.get("price") or row.get("Price") or 0)
+        stock = int(float(row.get("stock") or row.get("Stock") or 0))
+    except Exception:
+        raise ValueError("invalid price/stock")
+    return {
+        "name": name,
+        "price": price,
+        "stock": stock,
+        "category": (row.get("category") or row.get("Category") or default_category or "").strip() or None,
+        "image_url": (row.get("image_url") or row.get("Image_URL") or row.get("image") or "").strip() or None,
+        "codes": _codes(row),
+    }
+
+
+def _codes(row: dict) -> List[str]:
+    raw = " ".join(row.get(col) or "" for col in ("codes", "Codes", "barcode", "Barcode", "sku", "SKU"))
+    try:
+        return product_codes.parse(raw)
+    except ValueError as e:
+        raise ValueError(f"invalid codes: {e}")
+
+
+def _chunks(reader, size: int) -> Iterator[List[Tuple[int, dict]]]:
+    chunk = []
+    for idx, row in enumerate(reader, start=1):
+        chunk.append((idx, row))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def upsert_chunk(db, records: List[dict]) -> Tuple[int, int, List[int], List[Tuple[str, str, int]]]:
+    """Apply one chunk in the caller's transaction.
+
+    Returns (created, updated, touched ids, code conflicts); a conflict is
+    ``(name, code, owner id)`` for a code another product already has, which
+    the row is imported without.
+    """
+    by_name: Dict[str, dict] = {}
+    codes_by_name: Dict[str, List[str]] = {}
+    for record in records:
+        record = dict(record)
+        codes = record.pop("codes", None)
+        by_name[record["name"]] = record  # a name repeated within the chunk: the last row wins
+        codes_by_name.pop(record["name"], None)
+        if codes:
+            codes_by_name[record["name"]] = codes
+    existing: Dict[str, List[int]] = {}
+    touched_categories = set()
+    for product_id, name, category_id in db.execute(
+        select(models.Product.id, models.Product.name, models.Product.category_id)
+        .where(models.Product.name.in_(list(by_name)))
+    ):
+        existing.setdefault(name, []).append(product_id)
+        touched_categories.add(category_id)
+    category_ids = categories.ensure(db, (record["category"] for record in by_name.values()))
+    for record in by_name.values():
+        record["category_id"] = category_ids.get(record["category"])
+    touched_categories.update(category_ids.values())
+
+    products = models.Product.__table__
+    updates = [
+        {"pid": product_id, **{f"new_{k}": v for k, v in by_name[name].items() if k != "name"}}
+        for name, ids in existing.items()
+        for product_id in ids
+    ]
+    if updates:
+        db.execute(
+            update(products)
+            .where(products.c.id == bindparam("pid"))
+            .values(
+                price=bindparam("new_price"),
+                stock=bindparam("new_stock"),
+                category=func.coalesce(bindparam("new_category"), products.c.category),
+                category_id=func.coalesce(bindparam("new_category_id"), products.c.category_id),
+                image_url=func.coalesce(bindparam("new_image_url"), products.c.image_url),
+            ),
+            updates,
+        )
+    rows = [record for name, record in by_name.items() if name not in existing]
+    created_ids = database.insert_returning_ids(db, models.Product, rows) if rows else []
+    touched = created_ids + [u["pid"] for u in updates]
+    conflicts = _assign_codes(db, codes_by_name, existing, dict(zip((r["name"] for r in rows), created_ids)))
+    categories.refresh_stats(db, touched_categories)
+    catalog.touch(db, touched)
+    return len(created_ids), len(updates), touched, conflicts
+
+
+def _assign_codes(db, codes_by_name: Dict[str, List[str]], existing: Dict[str, List[int]],
+                  created: Dict[str, int]) -> List[Tuple[str, str, int]]:
+    owners = product_codes.owners(db, (code for codes in codes_by_name.values() for code in codes))
+    assigned: Dict[int, List[str]] = {}
+    conflicts = []
+    for name, codes in codes_by_name.items():
+        target = min(existing[name]) if name in existing else created[name]
+        kept = []
+        for code in codes:
+            owner = owners.get(code, target)
+            if owner != target:
+                conflicts.append((name, code, owner))
+            else:
+                owners[code] = target  # later rows of this chunk can't claim it either
+                kept.append(code)
+        assigned[target] = kept
+    product_codes.replace_many(db, assigned)
+    return conflicts
+
+
+def run(job_id: str, default_category: Optional[str] = None, on_products: Optional[ProductsChanged] = None):
+    """Process a queued job to completion; never raises (failures are recorded on the job)."""
+    db = database.SessionLocal()
+    try:
+        job = db.get(models.ImportJob, job_id)
+        job.status, job.started_at = "running", datetime.datetime.utcnow()
+        db.commit()
+        with open(upload_path(job_id), newline="", encoding="utf-8-sig") as src, \
+                open(error_path(job_id), "w", newline="", encoding="utf-8") as err_file:
+            reader = csv.DictReader(src)
+            errors = csv.writer(err_file)
+            errors.writerow(["row", "error"] + list(reader.fieldnames or []))
+            for chunk in _chunks(reader, IMPORT_CHUNK):
+                records = []
+                source = {}
+                for idx, row in chunk:
+                    try:
+                        record = parse_row(row, default_category)
+                    except ValueError as e:
+                        errors.writerow([idx, str(e)] + [row.get(col) for col in reader.fieldnames])
+                        job.skipped += 1
+                        job.error_count += 1
+                        continue
+                    earlier = source.get(record["name"])
+                    if earlier is not None:
+                        reason = f"same name as row {idx}, whose values were imported instead"
+                        errors.writerow([earlier[0], reason] + [earlier[1].get(col) for col in reader.fieldnames])
+                        job.merged += 1
+                        job.error_count += 1
+                    records.append(record)
+                    source[record["name"]] = (idx, row)
+                created, updated, touched, conflicts = upsert_chunk(db, records) if records else (0, 0, [], [])
+                for name, code, owner in conflicts:
+                    idx, row = source[name]
+                    reason = f"code {code} already belongs to product {owner}; imported without it"
+                    errors.writerow([idx, reason] + [row.get(col) for col in reader.fieldnames])
+                    job.error_count += 1
+                job.created += created
+                job.updated += updated
+                job.rows_processed += len(chunk)
+                db.commit()
+                if on_products and touched:
+                    rows = db.execute(
+                        select(models.Product.id, models.Product.name, models.Product.category)
+                        .where(models.Product.id.in_(touched))
+                    ).all()
+                    on_products([tuple(r) for r in rows])
+        job.status, job.finished_at = "done", datetime.datetime.utcnow()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.exception("import job %s failed", job_id)
+        job = db.get(models.ImportJob, job_id)
+        if job is not None:
+            message = "Unable to decode CSV. Use UTF-8 encoding." if isinstance(e, UnicodeDecodeError) else str(e)
+            job.status, job.message, job.finished_at = "failed", message[:500], datetime.datetime.utcnow()
+            db.commit()
+    finally:
+        db.close()
+        try:
+            os.remove(upload_path(job_id))
+        except OSError:
+            pass
+
+
+def submit(job_id: str, default_category: Optional[str] = None, on_products: Optional[ProductsChanged] = None) -> Future:
+    return _executor.submit(run, job_id, default_category, on_products)
+
+
+def recover(db):
+    """Jobs cut off by a restart can't resume (their upload is gone); mark them failed."""
+    db.query(models.ImportJob).filter(models.ImportJob.status.in_(["queued", "running"])).update(
+        {"status": "failed", "message": "Interrupted by a server restart; upload the file again."},
+        synchronize_session=False,
+    )
+    db.commit()
+
+
+def first_errors(job_id: str, limit: int = 10) -> List[str]:
+    """The first few error rows in the legacy "Row N: reason" form."""
+    out = []
+    try:
+        with open(error_path(job_id), newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                out.append(f"Row {row[0]}: {row[1]}")
+                if len(out) >= limit:
+                    break
+    except OSError:
+        pass
+    return out
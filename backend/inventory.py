@@ -0,0 +1,135 @@
+"""Race-free stock changes for checkout.
+
+Several POS terminals can sell the same SKU at the same moment, so stock is
+never decremented with an ORM read-modify-write. On PostgreSQL the bill's
+product rows are locked with ``SELECT ... FOR UPDATE`` in ascending id order
+(a fixed lock order, so two bills can't deadlock) and then updated. Elsewhere
+(SQLite) a single conditional ``UPDATE ... SET stock = stock - :qty`` runs for
+all products in id order; SQLite's database-level write lock serializes them.
+
+STOCK_OVERSELL_POLICY decides what happens when a line asks for more than is
+in stock:
+  allow  - sell anyway, stock may go negative (default, previous behaviour)
+  reject - refuse the whole bill with 409
+  clamp  - sell anyway, stock bottoms out at 0
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, case, update
+
+import models
+
+STOCK_OVERSELL_POLICY = os.getenv("STOCK_OVERSELL_POLICY", "allow").lower()
+if STOCK_OVERSELL_POLICY not in ("allow", "reject", "clamp"):
+    print(f"Warning: unknown STOCK_OVERSELL_POLICY={STOCK_OVERSELL_POLICY!r}; using 'allow'")
+    STOCK_OVERSELL_POLICY = "allow"
+
+
+class ProductNotFound(Exception):
+    def __init__(self, product_id: int):
+        super().__init__(f"Product with id {product_id} not found")
+        self.product_id = product_id
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortages: Dict[int, Tuple[int, int]]):
+        # product_id -> (requested, available)
+        self.shortages = shortages
+        super().__init__(
+            "Insufficient stock for "
+            + ", ".join(f"product {pid} (requested {req}, available {avail})" for pid, (req, avail) in sorted(shortages.items()))
+        )
+
+
+def _stock_update(conditional: bool, clamp: bool):
+    products = models.Product.__table__
+    qty = bindparam("qty")
+    if clamp:
+        new_stock = case((products.c.stock >= qty, products.c.stock - qty), else_=0)
+    else:
+        new_stock = products.c.stock - qty
+    stmt = update(products).where(products.c.id == bindparam("pid")).values(stock=new_stock)
+    if conditional:
+        stmt = stmt.where(products.c.stock >= qty)
+    return stmt
+
+
+def _locks_rows(db) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def reserve_stock(
+    db, quantities: Dict[int, int], policy: str = STOCK_OVERSELL_POLICY
+) -> Tuple[Dict[int, "models.Product"], Dict[int, int], Dict[int, Optional[int]]]:
+    """Apply ``quantities`` (product_id -> units sold) atomically inside the caller's transaction.
+
+    Returns ``(products by id, stock after the sale by id, units taken out of
+    stock by id)``; units taken are None where they can't be known without the
+    pre-sale stock (a clamped sale that hit 0 on SQLite). Raises
+    ProductNotFound / InsufficientStock, after which the transaction must be
+    rolled back.
+    """
+    ordered = sorted(quantities)
+    params = [{"pid": pid, "qty": quantities[pid]} for pid in ordered]
+    if not params:
+        return {}, {}, {}
+
+    if _locks_rows(db):
+        rows = (
+            db.query(models.Product)
+            .filter(models.Product.id.in_(ordered))
+            .order_by(models.Product.id)
+            .with_for_update()
+            .all()
+        )
+        products = {p.id: p for p in rows}
+        _check_missing(ordered, products)
+        shortages = {
+            pid: (quantities[pid], products[pid].stock or 0)
+            for pid in ordered
+            if (products[pid].stock or 0) < quantities[pid]
+        }
+        if shortages and policy == "reject":
+            raise InsufficientStock(shortages)
+        db.execute(_stock_update(conditional=False, clamp=policy == "clamp"), params)
+        new_stock, removed = {}, {}
+        for pid in ordered:
+            remaining = (products[pid].stock or 0) - quantities[pid]
+            new_stock[pid] = max(remaining, 0) if policy == "clamp" else remaining
+            # The locked rows still hold the pre-sale stock; NULL stock stays NULL
+            removed[pid] = products[pid].stock - new_stock[pid] if products[pid].stock is not None else 0
+        return products, new_stock, removed
+
+    result = db.execute(_stock_update(conditional=policy == "reject", clamp=policy == "clamp"), params)
+    # Read back after the write: prices for the bill and the post-sale stock
+    products = {
+        p.id: p
+        for p in db.query(models.Product).filter(models.Product.id.in_(ordered)).populate_existing().all()
+    }
+    _check_missing(ordered, products)
+    if policy == "reject" and result.rowcount is not None and 0 <= result.rowcount < len(params):
+        # Some rows failed the WHERE stock >= qty guard; undo the rest and report what is actually available
+        db.rollback()
+        available = dict(db.query(models.Product.id, models.Product.stock).filter(models.Product.id.in_(ordered)).all())
+        raise InsufficientStock({
+            pid: (quantities[pid], available.get(pid) or 0)
+            for pid in ordered
+            if (available.get(pid) or 0) < quantities[pid]
+        })
+    removed = {}
+    for pid in ordered:
+        stock = products[pid].stock
+        if stock is None:
+            removed[pid] = 0
+        elif policy == "clamp" and stock == 0:
+            removed[pid] = None  # clamped: anything up to the quantity (or a negative stock) was there before
+        else:
+            removed[pid] = quantities[pid]
+    return products, {pid: products[pid].stock for pid in ordered}, removed
+
+
+def _check_missing(ordered: List[int], products: Dict[int, "models.Product"]):
+    for pid in ordered:
+        if pid not in products:
+            raise ProductNotFound(pid)
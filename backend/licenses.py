@@ -0,0 +1,154 @@
+"""License keys: bulk issuance, inventory, revocation and the registration claim.
+
+Used by generate_license.py (the CLI) and by /register. Keys are issued in
+batched multi-row INSERTs (LICENSE_INSERT_CHUNK rows per statement) and can
+carry a batch label, e.g. the reseller they went to, so a batch can be
+exported, counted or revoked as a unit. Counts group on the indexed
+is_used / batch columns.
+
+Registration claims a key with one conditional ``UPDATE ... WHERE is_used =
+false AND revoked_at IS NULL RETURNING id``, so two sign-ups racing for the
+same key can't both get it.
+"""
+import csv
+import datetime
+import uuid
+from typing import Iterable, List, Optional, TextIO
+
+from sqlalchemy import func, insert, select, text, update
+
+import models
+
+LICENSE_INSERT_CHUNK = 1000
+STATUSES = ("all", "unused", "used", "revoked")
+
+# Columns and indexes older databases lack; shared by the API startup and the CLI
+OPTIONAL_DDL = [
+    "ALTER TABLE licenses ADD COLUMN batch VARCHAR",
+    "ALTER TABLE licenses ADD COLUMN created_at TIMESTAMP",
+    "ALTER TABLE licenses ADD COLUMN revoked_at TIMESTAMP",
+    "CREATE INDEX IF NOT EXISTS ix_licenses_is_used ON licenses (is_used)",
+    "CREATE INDEX IF NOT EXISTS ix_licenses_batch ON licenses (batch)",
+]
+
+
+def ensure_schema(engine):
+    # One transaction per statement: on PostgreSQL a failed ALTER aborts the whole transaction
+    for statement in OPTIONAL_DDL:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(statement))
+        except Exception:
+            pass  # already there
+
+
+def new_key() -> str:
+    return str(uuid.uuid4())
+
+
+def generate(db, count: int, batch: Optional[str] = None) -> List[str]:
+    """Issue ``count`` new keys and commit; returns them."""
+    table = models.License.__table__
+    now = datetime.datetime.utcnow()
+    keys = [new_key() for _ in range(count)]
+    for start in range(0, len(keys), LICENSE_INSERT_CHUNK):
+        rows = [{"key": key, "is_used": False, "batch": batch, "created_at": now}
+                for key in keys[start:start + LICENSE_INSERT_CHUNK]]
+        db.execute(insert(table), rows)
+    db.commit()
+    return keys
+
+
+def _filtered(query, batch: Optional[str], status: str = "all"):
+    License = models.License
+    if batch is not None:
+        query = query.where(License.batch == batch)
+    if status == "unused":
+        query = query.where(License.is_used == False, License.revoked_at.is_(None))
+    elif status == "used":
+        query = query.where(License.is_used == True)
+    elif status == "revoked":
+        query = query.where(License.revoked_at.isnot(None))
+    return query
+
+
+EXPORT_COLUMNS = ["key", "batch", "status", "used_by_user_id", "created_at", "revoked_at"]
+
+
+def export_keys(out: TextIO, keys: List[str], batch: Optional[str] = None):
+    """Freshly generated keys in the export CSV layout."""
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_COLUMNS)
+    writer.writerows([key, batch or "", "unused", "", "", ""] for key in keys)
+
+
+def export(db, out: TextIO, batch: Optional[str] = None, status: str = "all") -> int:
+    """Write matching keys as CSV (streamed, not loaded at once); returns the row count."""
+    License = models.License
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_COLUMNS)
+    query = _filtered(
+        select(License.key, License.batch, License.is_used, License.used_by_user_id, License.created_at, License.revoked_at),
+        batch, status,
+    ).order_by(License.id)
+    count = 0
+    for key, key_batch, is_used, user_id, created_at, revoked_at in db.execute(query.execution_options(yield_per=1000)):
+        state = "revoked" if revoked_at else ("used" if is_used else "unused")
+        writer.writerow([key, key_batch or "", state, user_id or "", created_at or "", revoked_at or ""])
+        count += 1
+    return count
+
+
+def counts(db, batch: Optional[str] = None) -> dict:
+    """Number of unused / used / revoked keys (a revoked key that was used counts as used)."""
+    License = models.License
+    revoked = License.revoked_at.isnot(None)
+    query = _filtered(select(License.is_used, revoked, func.count()), batch).group_by(License.is_used, revoked)
+    result = {"unused": 0, "used": 0, "revoked": 0}
+    for is_used, is_revoked, n in db.execute(query):
+        result["used" if is_used else ("revoked" if is_revoked else "unused")] += n
+    result["total"] = sum(result.values())
+    return result
+
+
+def revoke(db, keys: Iterable[str] = (), batch: Optional[str] = None) -> int:
+    """Revoke unused keys, given explicitly and/or by batch, and commit; returns how many were revoked.
+
+    Used keys stay as they are: the account that claimed one keeps working.
+    """
+    table = models.License.__table__
+    now = datetime.datetime.utcnow()
+    pending = table.c.is_used == False
+    revoked = 0
+    keys = list(dict.fromkeys(keys))
+    for start in range(0, len(keys), LICENSE_INSERT_CHUNK):
+        chunk = keys[start:start + LICENSE_INSERT_CHUNK]
+        revoked += db.execute(
+            update(table).where(table.c.key.in_(chunk), pending, table.c.revoked_at.is_(None)).values(revoked_at=now)
+        ).rowcount
+    if batch is not None:
+        revoked += db.execute(
+            update(table).where(table.c.batch == batch, pending, table.c.revoked_at.is_(None)).values(revoked_at=now)
+        ).rowcount
+    db.commit()
+    return revoked
+
+
+def is_claimable(db, key: str) -> bool:
+    """Cheap pre-check for /register; only ``claim`` is authoritative."""
+    License = models.License
+    return db.scalar(
+        select(License.id).where(License.key == key, License.is_used == False, License.revoked_at.is_(None))
+    ) is not None
+
+
+def claim(db, key: str, user_id: int) -> bool:
+    """Mark ``key`` used by ``user_id`` in the caller's transaction; False if it is unknown, used or revoked."""
+    table = models.License.__table__
+    claimed = db.scalar(
+        update(table)
+        .where(table.c.key == key, table.c.is_used == False, table.c.revoked_at.is_(None))
+        .values(is_used=True, used_by_user_id=user_id)
+        .returning(table.c.id)
+    )
+    return claimed is not None
@@ -1,68 +1,107 @@
 import os
-import io
-import csv
-import re
+import json
+import shutil
+import asyncio
 import datetime
 import logging
-import difflib
+from contextlib import asynccontextmanager
 from datetime import timedelta
 from typing import List, Optional
-from fastapi import FastAPI, Depends, HTTPException, status, Form, File, UploadFile
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Response, status, Form, File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy import or_, text
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy import or_, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 from database import engine, Base
 import models, schemas, database
 import auth
-
-try:
-    import pytesseract
-    from pytesseract import Output
-    from PIL import Image, ImageOps, ImageFilter
-    # Windows fallback for tesseract path
-    if os.name == 'nt':
-        possible_paths = [
-            r"C:\Program Files\Tesseract-OCR\tesseract.exe",
-            r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe",
-            r"C:\ProgramData\chocolatey\bin\tesseract.exe",
-        ]
-        # Check if tesseract is in PATH first
-        import shutil
-        if not shutil.which("tesseract"):
-            for path in possible_paths:
-                if os.path.exists(path):
-                    pytesseract.pytesseract.tesseract_cmd = path
-                    print(f"Set tesseract cmd to: {path}")
-                    break
-except Exception as e:
-    print(f"Warning: OCR dependencies missing: {e}")
-    pytesseract = None
-    Image = None
+import analytics
+import billing
+import catalog
+import categories
+import devices
+import export
+import imaging
+import importer
+import inventory
+import licenses
+import ocr
+import passwords
+import product_cache
+import product_codes
+import product_search
+import search_index
+import recognition_cache
+import storage
+import uploads
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
 
 
+OPTIONAL_DDL = [
+    "ALTER TABLE products ADD COLUMN category VARCHAR",
+    "ALTER TABLE stores ADD COLUMN dummy_check INTEGER",
+    "ALTER TABLE bills ADD COLUMN idempotency_key VARCHAR",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_bills_idempotency_key ON bills (idempotency_key)",
+    "CREATE INDEX IF NOT EXISTS ix_bills_created_at_id ON bills (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_bill_items_bill_id ON bill_items (bill_id)",
+    "ALTER TABLE products ADD COLUMN version INTEGER DEFAULT 0",
+    "CREATE INDEX IF NOT EXISTS ix_products_version ON products (version)",
+    "ALTER TABLE products ADD COLUMN category_id INTEGER REFERENCES categories(id)",
+    "CREATE INDEX IF NOT EXISTS ix_products_category_id ON products (category_id)",
+    # Older databases may hold duplicate device rows; keep the first before adding the unique index
+    "DELETE FROM user_devices WHERE id NOT IN (SELECT MIN(id) FROM user_devices GROUP BY user_id, device_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_user_devices_user_id_device_id ON user_devices (user_id, device_id)",
+    "ALTER TABLE import_jobs ADD COLUMN merged INTEGER DEFAULT 0",
+]
+
+
 def ensure_optional_columns():
     """Add columns that may be missing on older databases without requiring a full migration tool."""
-    with engine.begin() as conn:
+    # One transaction per statement: on PostgreSQL a failed ALTER aborts the whole transaction
+    for statement in OPTIONAL_DDL:
         try:
-            conn.execute(text("ALTER TABLE products ADD COLUMN category VARCHAR"))
+            with engine.begin() as conn:
+                conn.execute(text(statement))
         except Exception:
             pass  # Column already exists or table missing; safe to ignore for idempotency
-        try:
-            conn.execute(text("ALTER TABLE stores ADD COLUMN dummy_check INTEGER"))
-        except Exception:
-            pass  # table likely exists if this fails; create_all will create if missing
 
 
 ensure_optional_columns()
+licenses.ensure_schema(engine)
+product_search.ensure_schema(engine)
 
-app = FastAPI(title="dBiller API")
-if not os.path.exists("uploads"):
-    os.makedirs("uploads", exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    db = database.SessionLocal()
+    try:
+        catalog.ensure_state(db)
+        categories.backfill(db)
+        importer.recover(db)
+        product_cache.cache.sync(db)  # baseline version, so writes after the index build reach it
+        search_index.ensure_built(db)
+    finally:
+        db.close()
+    storage.init()
+    if not ocr.available():
+        logger.warning("OCR disabled: %s", ocr.unavailable_reason())
+    devices.last_logins.start()
+    yield
+    devices.last_logins.stop()
+    ocr.pool.shutdown()
+    passwords.pool.shutdown()
+    storage.pool.shutdown()
+
+
+app = FastAPI(title="dBiller API", lifespan=lifespan)
+os.makedirs(storage.LOCAL_UPLOAD_DIR, exist_ok=True)
+app.mount("/uploads", StaticFiles(directory=storage.LOCAL_UPLOAD_DIR), name="uploads")
 
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:8001").rstrip("/")
 
@@ -82,6 +121,7 @@ else:
     allow_origins = ["*"]
     origin_regex = r"http://(localhost|127\.0\.0\.1)(:\d+)?"
 
+app.add_middleware(uploads.UploadLimits)  # added first so CORS wraps its 413/415 answers
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allow_origins,
@@ -89,8 +129,48 @@ app.add_middleware(
     allow_credentials=False,  # allow "*" with no credentials requirement
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Query-Count"],  # readable by the Flutter web build
 )
 
+def sync_product_caches(product_id: int, name: str, category: Optional[str]):
+    """Refresh in-process catalog caches after a product row was written."""
+    sync_products_caches([(product_id, name, category)])
+
+
+def sync_products_caches(rows):
+    """Batch form of sync_product_caches for ``(id, name, category)`` rows: one invalidation pass per cache."""
+    tokens = set()
+    for product_id, name, category in rows:
+        search_index.index.upsert(product_id, name, category)
+        tokens.update(search_index.tokenize(name) + search_index.tokenize(category))
+    product_ids = [row[0] for row in rows]
+    product_cache.cache.invalidate(product_ids)
+    recognition_cache.cache.invalidate(product_ids=product_ids, tokens=tokens)
+
+
+def drop_product_caches(product_id: int):
+    search_index.index.remove(product_id)
+    product_cache.cache.invalidate([product_id])
+    recognition_cache.cache.invalidate(product_ids=[product_id])
+
+
+def apply_catalog_changes(db, rows, deleted_ids):
+    """product_cache.sync hook: bring the OCR index and scan cache up to date with other workers' writes."""
+    if rows is None:
+        search_index.rebuild(db)  # the database was reset
+        recognition_cache.cache.clear()
+        return
+    # Stock and price changes stamp the product too; only name/category changes move it in the index
+    renamed = [row for row in rows if not search_index.index.is_current(*row)]
+    if renamed:
+        sync_products_caches(renamed)
+    for product_id in deleted_ids:
+        drop_product_caches(product_id)
+
+
+product_cache.cache.on_sync(apply_catalog_changes)
+
+
 def normalize_product_url(product: models.Product):
     """Pass-through: Validation moved to client-side to support relative local URLs."""
     return product
@@ -100,44 +180,56 @@ def read_root():
     return {"message": "Welcome to dBiller API"}
 
 # Auth Routes
+def hashing_busy(e: passwords.HashBusy) -> HTTPException:
+    return HTTPException(status_code=503, detail=f"Server busy, retry shortly: {e}", headers={"Retry-After": "1"})
+
+
 @app.post("/token", response_model=schemas.Token)
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(), 
     device_id: str = Form(...), # Require device_id
     db: database.SessionLocal = Depends(database.get_db)
 ):
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+    # Database work runs in the threadpool; bcrypt runs in the bounded hashing pool
+    user = await run_in_threadpool(find_user, db, form_data.username)
+    try:
+        ok, new_hash = await passwords.verify_and_update(form_data.password, user.hashed_password if user else None)
+    except passwords.HashBusy as e:
+        raise hashing_busy(e)
+    if not ok or user.is_active is False:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
-    # Device Logic
-    device = db.query(models.UserDevice).filter(models.UserDevice.user_id == user.id, models.UserDevice.device_id == device_id).first()
-    if not device:
-        # Check count
-        device_limit = int(os.getenv("DEVICE_LIMIT", "2"))
-        device_count = db.query(models.UserDevice).filter(models.UserDevice.user_id == user.id).count()
-        
-        if device_limit != -1 and device_count >= device_limit:
-             raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"Device limit reached (Max {device_limit} devices). Contact admin.",
-            )
-        # Register new device
-        new_device = models.UserDevice(user_id=user.id, device_id=device_id)
-        db.add(new_device)
-        db.commit()
-    else:
-        # Update last login
-        device.last_login = datetime.datetime.utcnow()
+    return await run_in_threadpool(issue_token, db, user, device_id, new_hash)
+
+
+def find_user(db, username: str) -> Optional[models.User]:
+    """Load a user detached, ending the transaction so no pooled connection is held while bcrypt runs."""
+    user = db.query(models.User).filter(models.User.username == username).first()
+    if user is not None:
+        db.expunge(user)
+    db.rollback()
+    return user
+
+
+def issue_token(db, user: models.User, device_id: str, new_hash: Optional[str]) -> dict:
+    if new_hash:
+        # BCRYPT_ROUNDS changed since this password was stored
+        db.query(models.User).filter(models.User.id == user.id).update({"hashed_password": new_hash})
         db.commit()
 
+    # Known device: an index lookup, last_login is written behind; new device: one guarded insert
+    if not devices.register(db, user.id, device_id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Device limit reached (Max {devices.DEVICE_LIMIT} devices). Contact admin.",
+        )
+
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=auth.token_claims(user), expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -151,9 +243,11 @@ async def register_user(
     store_logo: UploadFile = File(None),
     db: database.SessionLocal = Depends(database.get_db),
 ):
-    # 1. Verify License
-    license_obj = db.query(models.License).filter(models.License.key == license_key, models.License.is_used == False).first()
-    if not license_obj:
+    if store_logo:
+        uploads.check_image(store_logo)
+
+    # 1. Verify License (cheap early answer; the claim below is what counts)
+    if not licenses.is_claimable(db, license_key):
         raise HTTPException(status_code=400, detail="Invalid or used License Key")
 
     # 2. Verify Username
@@ -161,26 +255,38 @@ async def register_user(
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    hashed_password = auth.get_password_hash(password)
+    db.rollback()  # don't hold a pooled connection while bcrypt runs
+    try:
+        hashed_password = await passwords.hash(password)
+    except passwords.HashBusy as e:
+        raise hashing_busy(e)
+
+    # 3. User, license claim and device in one transaction: a key another sign-up claimed
+    # meanwhile (or a username taken meanwhile) rolls the whole registration back
     db_user = models.User(username=username, hashed_password=hashed_password, role="admin") 
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    
-    # 3. Mark License Used
-    license_obj.is_used = True
-    license_obj.used_by_user_id = db_user.id
-    db.commit()
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Username already registered")
+    if not licenses.claim(db, license_key, db_user.id):
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Invalid or used License Key")
 
     # Register the device they signed up with
-    db_device = models.UserDevice(user_id=db_user.id, device_id=device_id)
-    db.add(db_device)
+    db.add(models.UserDevice(user_id=db_user.id, device_id=device_id))
     db.commit()
+    db.refresh(db_user)
 
     # Optional: create store
     store_logo_url = None
     if store_logo:
-        store_logo_url = await storage.upload_file_to_r2(store_logo, folder="store-logos")
+        try:
+            store_logo_url = await storage.upload_file_to_r2(store_logo, folder="store-logos")
+        except storage.StorageBusy as e:
+            # The account already exists: finish registration without the logo rather than fail it
+            logger.warning("Store logo upload skipped for %s: %s", username, e)
         if store_logo_url and not store_logo_url.startswith("http"):
             store_logo_url = f"{PUBLIC_BASE_URL}{store_logo_url}"
     if store_name or store_logo_url:
@@ -200,14 +306,47 @@ def create_user(user: schemas.UserCreate, db: database.SessionLocal = Depends(da
     db_user = db.query(models.User).filter(models.User.username == user.username).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    hashed_password = auth.get_password_hash(user.password)
+    try:
+        hashed_password = passwords.pool.call(auth.get_password_hash, user.password)
+    except passwords.HashBusy as e:
+        raise hashing_busy(e)
     db_user = models.User(username=user.username, hashed_password=hashed_password, role=user.role)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
     return db_user
 
-import storage
+
+async def save_upload(file: UploadFile, folder: str = "products") -> str:
+    try:
+        return await storage.upload_file_to_r2(file, folder=folder)
+    except storage.StorageBusy as e:
+        raise HTTPException(status_code=503, detail=f"Upload storage busy, retry shortly: {e}", headers={"Retry-After": "2"})
+
+
+def parse_codes(raw: Optional[str]) -> List[str]:
+    try:
+        return product_codes.parse(raw)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid codes: {e}")
+
+
+def assign_codes(db, product_id: int, codes: List[str]):
+    try:
+        product_codes.replace(db, product_id, codes)
+    except product_codes.CodeConflict as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+def commit_codes(db):
+    """Commit a product write; a code claimed concurrently by another product surfaces as 409."""
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Code already assigned to another product")
+
 
 # Product Routes
 @app.post("/products/", response_model=schemas.Product)
@@ -216,14 +355,17 @@ async def create_product(
     price: float = Form(...),
     stock: int = Form(0),
     category: str = Form(None),
+    codes: str = Form(None),
     image: UploadFile = File(None),
     image_url: str = Form(None),
     db: database.SessionLocal = Depends(database.get_db),
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
+    code_list = parse_codes(codes)
     final_image_url = None
     if image:
-        final_image_url = await storage.upload_file_to_r2(image)
+        uploads.check_image(image)
+        final_image_url = await save_upload(image)
     elif image_url:
         final_image_url = image_url
     if category:
@@ -236,25 +378,127 @@ async def create_product(
         image_url=final_image_url,
         category=category,
     )
-    db_product = models.Product(**product_data.dict())
+    db_product = models.Product(**product_data.dict(), category_id=categories.ensure_one(db, category))
     db.add(db_product)
-    db.commit()
+    db.flush()
+    if code_list:
+        assign_codes(db, db_product.id, code_list)
+    categories.refresh_stats(db, [db_product.category_id])
+    catalog.touch(db, [db_product.id])
+    commit_codes(db)
     db.refresh(db_product)
+    sync_product_caches(db_product.id, db_product.name, db_product.category)
     return normalize_product_url(db_product)
 
 @app.get("/products/", response_model=List[schemas.Product])
-def read_products(skip: int = 0, limit: int = 100, db: database.SessionLocal = Depends(database.get_db)):
-    products = db.query(models.Product).offset(skip).limit(limit).all()
-    normalized = [normalize_product_url(p) for p in products]
-    logger.info("read_products", extra={"count": len(normalized)})
-    return normalized
+def read_products(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    category_id: Optional[int] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: database.SessionLocal = Depends(database.get_db)
+):
+    # Any catalog write bumps the version, so (version, page) identifies the exact response body
+    version = product_cache.cache.sync(db)
+    headers = {"ETag": catalog.etag(version, skip, limit, category_id or ""), "X-Catalog-Version": str(version)}
+    if catalog.etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    def load_page():
+        query = db.query(models.Product).options(selectinload(models.Product.code_rows))
+        if category_id is not None:
+            query = query.filter(models.Product.category_id == category_id)  # ix_products_category_id
+        products = query.order_by(models.Product.id).offset(skip).limit(limit).all()
+        logger.info("read_products", extra={"count": len(products)})
+        return [schemas.product_dict(normalize_product_url(p)) for p in products]
+
+    # Pre-serialized per page and version, so repeat reads skip the ORM and pydantic entirely
+    body = product_cache.cache.page(version, skip, limit, load_page, category_id=category_id)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/products/search", response_model=schemas.ProductSearchResult)
+def search_products(
+    q: str = Query(..., min_length=1, max_length=100),
+    category: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    db: database.SessionLocal = Depends(database.get_db)
+):
+    """Type-ahead search: word prefixes first, typo-tolerant matches when nothing matches as typed."""
+    ids, has_more, mode = product_search.search(db, q, category=category, limit=limit, offset=offset)
+    by_id = product_cache.cache.get_many(db, ids) if ids else {}
+    return {"products": [by_id[pid] for pid in ids if pid in by_id], "mode": mode, "has_more": has_more}
+
+@app.get("/products/changes", response_model=schemas.ProductChanges)
+def product_changes(
+    response: Response,
+    since: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=catalog.CHANGES_PAGE_MAX),
+    if_none_match: Optional[str] = Header(None),
+    db: database.SessionLocal = Depends(database.get_db)
+):
+    """Catalog delta since a version; omit `since` for a full snapshot. See catalog.changes."""
+    if since is not None and cursor is None:
+        # Nothing new since the terminal's last sync: a single-row lookup and an empty 304
+        etag = catalog.etag(catalog.current_version(db), "since", since, limit)
+        if catalog.etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+    try:
+        return catalog.changes(db, since, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def export_response(body, kind: str, fmt: str, compress: bool) -> StreamingResponse:
+    media_type = "application/gzip" if compress else export.FORMATS[fmt]
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{export.filename(kind, fmt, compress)}"'},
+    )
+
+@app.get("/products/export")
+def export_products(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    gzip: bool = False,
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """Whole catalog as a streamed CSV/NDJSON download."""
+    return export_response(export.export_products(format, compress=gzip), "products", format, gzip)
+
+BY_CODE_MAX = int(os.getenv("BY_CODE_MAX", "500"))
+
+@app.get("/products/by-code/{code}", response_model=schemas.Product)
+def read_product_by_code(code: str, db: database.SessionLocal = Depends(database.get_db)):
+    """Exact barcode/SKU lookup for scanners: one primary-key query, then the product cache."""
+    product_cache.cache.sync(db)
+    product_id = product_codes.owners(db, [code.strip()]).get(code.strip())
+    product = product_cache.cache.get(db, product_id) if product_id is not None else None
+    if product is None:
+        raise HTTPException(status_code=404, detail="No product with this code")
+    return product
+
+@app.post("/products/by-code", response_model=schemas.ProductCodeMatches)
+def read_products_by_codes(lookup: schemas.ProductCodeLookup, db: database.SessionLocal = Depends(database.get_db)):
+    """Batch form of /products/by-code/{code}: one IN query for all scanned codes."""
+    codes = list(dict.fromkeys(code.strip() for code in lookup.codes if code.strip()))
+    if len(codes) > BY_CODE_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {BY_CODE_MAX} codes per request")
+    product_cache.cache.sync(db)
+    owners = product_codes.owners(db, codes)
+    by_id = product_cache.cache.get_many(db, list(owners.values()))
+    found = {code: by_id[pid] for code, pid in owners.items() if pid in by_id}
+    return {"products": found, "missing": [code for code in codes if code not in found]}
 
 @app.get("/products/{product_id}", response_model=schemas.Product)
 def read_product(product_id: int, db: database.SessionLocal = Depends(database.get_db)):
-    db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    if db_product is None:
+    product_cache.cache.sync(db)
+    product = product_cache.cache.get(db, product_id)
+    if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
-    return normalize_product_url(db_product)
+    return product
 
 @app.put("/products/{product_id}", response_model=schemas.Product)
 async def update_product(
@@ -263,11 +507,15 @@ async def update_product(
     price: float = Form(...),
     stock: int = Form(0),
     category: str = Form(None),
+    codes: str = Form(None),
     image: UploadFile = File(None),
     image_url: str = Form(None),
     db: database.SessionLocal = Depends(database.get_db),
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
+    code_list = parse_codes(codes)  # None keeps the product's codes, "" removes them
+    if image:
+        uploads.check_image(image)
     db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
     if db_product is None:
         raise HTTPException(status_code=404, detail="Product not found")
@@ -275,7 +523,7 @@ async def update_product(
     # Preserve existing image unless a new one is uploaded
     final_image_url = db_product.image_url
     if image:
-        uploaded_url = await storage.upload_file_to_r2(image)
+        uploaded_url = await save_upload(image)
         if uploaded_url:
             final_image_url = uploaded_url if uploaded_url.startswith("http") else f"{PUBLIC_BASE_URL}{uploaded_url}"
         else:
@@ -288,14 +536,22 @@ async def update_product(
     if category:
         category = category.strip()
 
+    old_category_id = db_product.category_id
     db_product.name = name
     db_product.price = price
     db_product.stock = stock
     db_product.category = category
+    db_product.category_id = categories.ensure_one(db, category)
     db_product.image_url = final_image_url
 
-    db.commit()
+    db.flush()
+    if codes is not None:
+        assign_codes(db, db_product.id, code_list)
+    categories.refresh_stats(db, [old_category_id, db_product.category_id])
+    catalog.touch(db, [db_product.id])
+    commit_codes(db)
     db.refresh(db_product)
+    sync_product_caches(db_product.id, db_product.name, db_product.category)
     return normalize_product_url(db_product)
 
 @app.delete("/products/{product_id}")
@@ -303,19 +559,56 @@ def delete_product(product_id: int, db: database.SessionLocal = Depends(database
     db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
     if db_product is None:
         raise HTTPException(status_code=404, detail="Product not found")
+    category_id = db_product.category_id
     db.delete(db_product)
+    db.flush()
+    categories.refresh_stats(db, [category_id])
+    catalog.tombstone(db, "product", product_id)
     db.commit()
+    drop_product_caches(product_id)
     return {"message": "Product deleted successfully"}
 
 
+@app.get("/categories", response_model=List[schemas.Category])
+def read_categories(db: database.SessionLocal = Depends(database.get_db)):
+    """Every category with its product count and stock value (precomputed, see categories.py)."""
+    return db.query(models.Category).order_by(models.Category.name).all()
+
+
 @app.delete("/categories/{category_name}")
 def delete_category(category_name: str, db: database.SessionLocal = Depends(database.get_db), current_user: schemas.User = Depends(auth.get_current_user)):
-    updated = db.query(models.Product).filter(models.Product.category == category_name).update({"category": None})
+    products = models.Product.__table__
+    category = db.query(models.Category).filter(models.Category.name == category_name).first()
+    # Rows linked by id, plus any that still only carry the name
+    in_category = products.c.category == category_name
+    if category is not None:
+        in_category = or_(products.c.category_id == category.id, in_category)
+    cleared = db.scalars(
+        update(products).where(in_category).values(category=None, category_id=None).returning(products.c.id)
+    ).all()
+    updated = len(cleared)
+    if category is not None:
+        db.delete(category)
+        db.flush()
+    catalog.touch(db, cleared)
+    catalog.tombstone(db, "category", category_name)
     db.commit()
+    cleared_ids = search_index.index.clear_category(category_name)
+    product_cache.cache.invalidate(cleared)
+    recognition_cache.cache.invalidate(product_ids=cleared_ids)
     logger.info("category_cleared", extra={"category": category_name, "count": updated})
     return {"cleared": updated}
 
 
+@app.get("/cache/stats")
+def cache_stats(current_user: schemas.User = Depends(auth.get_current_user)):
+    """Hit/miss counters of the in-process caches (per worker process)."""
+    return {
+        "products": product_cache.cache.stats(),
+        "recognition": recognition_cache.cache.stats(),
+    }
+
+
 @app.get("/store", response_model=Optional[schemas.Store])
 def get_store(db: database.SessionLocal = Depends(database.get_db), current_user: schemas.User = Depends(auth.get_current_user)):
     store = db.query(models.Store).filter(models.Store.owner_user_id == current_user.id).first()
@@ -333,6 +626,8 @@ async def update_store(
     db: database.SessionLocal = Depends(database.get_db),
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
+    if logo:
+        uploads.check_image(logo)
     store = db.query(models.Store).filter(models.Store.owner_user_id == current_user.id).first()
     if not store:
         store = models.Store(name=name or f"{current_user.username}'s Store", owner_user_id=current_user.id)
@@ -342,7 +637,7 @@ async def update_store(
     if name:
         store.name = name
     if logo:
-        logo_url = await storage.upload_file_to_r2(logo, folder="store-logos")
+        logo_url = await save_upload(logo, folder="store-logos")
         if logo_url and not logo_url.startswith("http"):
             logo_url = f"{PUBLIC_BASE_URL}{logo_url}"
         store.logo_url = logo_url
@@ -354,131 +649,418 @@ async def update_store(
 
 
 @app.post("/users/change_password")
-def change_password(
+async def change_password(
     old_password: str = Form(...),
     new_password: str = Form(...),
     db: database.SessionLocal = Depends(database.get_db),
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
-    user = db.query(models.User).filter(models.User.id == current_user.id).first()
-    if not auth.verify_password(old_password, user.hashed_password):
-        raise HTTPException(status_code=400, detail="Old password incorrect")
-    user.hashed_password = auth.get_password_hash(new_password)
-    db.commit()
+    user = await run_in_threadpool(find_user, db, current_user.username)
+    try:
+        ok, _ = await passwords.verify_and_update(old_password, user.hashed_password if user else None)
+        if not ok:
+            raise HTTPException(status_code=400, detail="Old password incorrect")
+        new_hash = await passwords.hash(new_password)
+    except passwords.HashBusy as e:
+        raise hashing_busy(e)
+
+    def store():
+        db.query(models.User).filter(models.User.id == user.id).update({"hashed_password": new_hash})
+        db.commit()
+
+    await run_in_threadpool(store)
+    auth.user_cache.invalidate(user.id)
     return {"message": "Password updated"}
 
 
+@app.post("/users/{user_id}/deactivate")
+def deactivate_user(
+    user_id: int,
+    db: database.SessionLocal = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """Close the caller's own account.
+
+    Every self-registered account is an admin and accounts aren't scoped to a
+    store, so the role can't be what allows deactivating someone else.
+    """
+    if user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="You can only deactivate your own account")
+    user = db.get(models.User, user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    user.is_active = False
+    db.commit()
+    auth.user_cache.invalidate(user_id)
+    return {"message": "User deactivated"}
+
+
 @app.post("/subscriptions/cancel")
 def cancel_subscription(db: database.SessionLocal = Depends(database.get_db), current_user: schemas.User = Depends(auth.get_current_user)):
     # Placeholder: mark subscription canceled
     return {"message": "Subscription cancellation requested"}
 
 
+IMPORT_COPY_CHUNK = 1024 * 1024
+
+
 @app.post("/products/bulk_upload")
 async def bulk_upload_products(
+    response: Response,
     file: UploadFile = File(...),
     category: str = Form(None),
+    background: bool = False,
     db: database.SessionLocal = Depends(database.get_db),
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
+    """Upsert products from a CSV (by name). With ?background=true returns 202 and a job to poll."""
     if not file.filename.lower().endswith(".csv"):
         raise HTTPException(status_code=400, detail="Please upload a .csv file.")
-
-    raw = await file.read()
+    if not uploads.is_csv(file):
+        raise HTTPException(status_code=415, detail=f"Expected a CSV file, got {file.content_type}")
+
+    job = importer.new_job(db, file.filename, current_user.id)
+    # Spool to our own file: the upload is closed once this request returns, the job outlives it.
+    # Copied in chunks on a worker thread: never all in memory, never blocking the event loop.
+    def spool():
+        file.file.seek(0)
+        with open(importer.upload_path(job.id), "wb") as out:
+            shutil.copyfileobj(file.file, out, IMPORT_COPY_CHUNK)
+
+    await run_in_threadpool(spool)
     try:
-        decoded = raw.decode("utf-8-sig")
-    except Exception:
-        raise HTTPException(status_code=400, detail="Unable to decode CSV. Use UTF-8 encoding.")
-
-    reader = csv.DictReader(io.StringIO(decoded))
-    if reader.fieldnames is None:
-        raise HTTPException(status_code=400, detail="CSV needs a header row with at least name,price,stock.")
-    created = 0
-    skipped = 0
-    errors = []
-
-    for idx, row in enumerate(reader, start=1):
-        name = (row.get("name") or row.get("Name") or "").strip()
-        if not name:
-            skipped += 1
-            errors.append(f"Row {idx}: missing name")
-            continue
-        try:
-            price_value = row.get("price") or row.get("Price") or 0
-            stock_value = row.get("stock") or row.get("Stock") or 0
-            price = float(price_value)
-            stock = int(float(stock_value))
-        except Exception:
-            skipped += 1
-            errors.append(f"Row {idx}: invalid price/stock")
-            continue
+        importer.check_header(importer.upload_path(job.id))
+    except ValueError as e:
+        os.remove(importer.upload_path(job.id))
+        db.delete(job)
+        db.commit()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    category = category.strip() if category else None
+    future = importer.submit(job.id, category, sync_products_caches)
+    if background:
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {"job_id": job.id, "status": "queued"}
+
+    await asyncio.wrap_future(future)
+    db.expire_all()
+    job = db.get(models.ImportJob, job.id)
+    if job.status == "failed":
+        raise HTTPException(status_code=400, detail=job.message or "Import failed")
+    return {
+        "job_id": job.id,
+        "created": job.created,
+        "updated": job.updated,
+        "skipped": job.skipped,
+        "merged": job.merged,
+        "errors": importer.first_errors(job.id),  # all of them: GET /products/import/{job_id}/errors
+    }
+
+
+@app.get("/products/import/{job_id}", response_model=schemas.ImportJob)
+def import_status(job_id: str, db: database.SessionLocal = Depends(database.get_db), current_user: schemas.User = Depends(auth.get_current_user)):
+    job = db.get(models.ImportJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job
 
-        row_category = (row.get("category") or row.get("Category") or category or "").strip() or None
-        image_url = (row.get("image_url") or row.get("Image_URL") or row.get("image") or "").strip() or None
 
-        product = models.Product(
-            name=name,
-            price=price,
-            stock=stock,
-            category=row_category,
-            image_url=image_url,
+@app.get("/products/import/{job_id}/errors")
+def import_errors(job_id: str, db: database.SessionLocal = Depends(database.get_db), current_user: schemas.User = Depends(auth.get_current_user)):
+    """Every rejected row of an import as CSV: row number, reason, then the original columns."""
+    job = db.get(models.ImportJob, job_id)
+    if job is None or not os.path.exists(importer.error_path(job_id)):
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return FileResponse(importer.error_path(job_id), media_type="text/csv", filename=f"import-{job_id}-errors.csv")
+
+# Billing Routes
+@app.post("/bills/", response_model=schemas.Bill)
+def create_bill(
+    bill: schemas.BillCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
+    db: database.SessionLocal = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    with database.count_queries() as queries:
+        if idempotency_key:
+            # A retried request after a timeout gets the bill that was already created
+            existing = db.query(models.Bill).filter(models.Bill.idempotency_key == idempotency_key).first()
+            if existing is not None:
+                response.headers["X-Idempotent-Replay"] = "true"
+                return existing
+
+        draft = billing.BillDraft(
+            [(item.product_id, item.quantity) for item in bill.items],
+            payment_method=bill.payment_method,
+            idempotency_key=idempotency_key,
         )
-        db.add(product)
-        created += 1
+        # Stock is taken first, atomically and in product-id order, so concurrent terminals can't lose updates
+        try:
+            products, new_stock, removed = inventory.reserve_stock(db, billing.quantities_for([draft]))
+        except inventory.ProductNotFound as e:
+            db.rollback()
+            raise HTTPException(status_code=404, detail=str(e))
+        except inventory.InsufficientStock as e:
+            db.rollback()
+            raise HTTPException(status_code=409, detail=str(e))
+
+        try:
+            # Built from in-memory rows before commit so nothing is expired and re-fetched
+            payload = billing.insert_bills(db, [draft], products, new_stock)[0]
+            analytics.record_bills(db, [payload])
+            categories.record_sale(db, products, removed)  # stock value moved
+            catalog.touch(db, products)  # stock changed; last, so the version lock is held briefly
+            db.commit()
+            product_cache.cache.invalidate(products)
+        except IntegrityError:
+            # Same idempotency key raced in from another request; return the winner
+            db.rollback()
+            if not idempotency_key:
+                raise
+            existing = db.query(models.Bill).filter(models.Bill.idempotency_key == idempotency_key).first()
+            if existing is None:
+                raise
+            response.headers["X-Idempotent-Replay"] = "true"
+            return existing
+
+    response.headers["X-Query-Count"] = str(queries[0])
+    return payload
+
+
+BILL_SYNC_MAX = int(os.getenv("BILL_SYNC_MAX", "1000"))
+BILL_SYNC_BATCH = int(os.getenv("BILL_SYNC_BATCH", "200"))
+
+
+@app.post("/bills/sync", response_model=schemas.BillSyncResponse)
+def sync_bills(
+    payload: schemas.BillSyncRequest,
+    db: database.SessionLocal = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """Ingest bills queued offline by a terminal. Safe to replay: keys already stored come back as duplicates.
+
+    Offline sales have already happened, so stock is always decremented
+    (never rejected); STOCK_OVERSELL_POLICY=clamp still floors it at 0.
+    """
+    if len(payload.bills) > BILL_SYNC_MAX:
+        raise HTTPException(status_code=413, detail=f"Too many bills (max {BILL_SYNC_MAX} per sync)")
+
+    results: dict = {}
+    pending: List[schemas.BillSyncItem] = []
+    for entry in payload.bills:
+        if entry.idempotency_key in results:
+            continue  # repeated within this payload; first copy wins
+        if not entry.items:
+            results[entry.idempotency_key] = {"status": "error", "error": "Bill has no items"}
+            continue
+        results[entry.idempotency_key] = None
+        pending.append(entry)
+
+    policy = "clamp" if inventory.STOCK_OVERSELL_POLICY == "clamp" else "allow"
+    for start in range(0, len(pending), BILL_SYNC_BATCH):
+        batch = pending[start:start + BILL_SYNC_BATCH]
+        for _ in range(2):
+            keys = [entry.idempotency_key for entry in batch]
+            existing = dict(
+                db.query(models.Bill.idempotency_key, models.Bill.id).filter(models.Bill.idempotency_key.in_(keys)).all()
+            )
+            for key, bill_id in existing.items():
+                results[key] = {"status": "duplicate", "bill_id": bill_id}
+            batch = [entry for entry in batch if entry.idempotency_key not in existing]
+            if not batch:
+                break
+
+            product_ids = {item.product_id for entry in batch for item in entry.items}
+            known = {pid for (pid,) in db.query(models.Product.id).filter(models.Product.id.in_(product_ids)).all()}
+            drafts = []
+            for entry in batch:
+                missing = sorted({item.product_id for item in entry.items} - known)
+                if missing:
+                    results[entry.idempotency_key] = {"status": "error", "error": f"Unknown product ids {missing}"}
+                    continue
+                drafts.append(billing.BillDraft(
+                    [(item.product_id, item.quantity) for item in entry.items],
+                    payment_method=entry.payment_method,
+                    created_at=entry.created_at,
+                    idempotency_key=entry.idempotency_key,
+                ))
+            if not drafts:
+                break
+            try:
+                products, _, removed = inventory.reserve_stock(db, billing.quantities_for(drafts), policy=policy)
+                created = billing.insert_bills(db, drafts, products)
+                analytics.record_bills(db, created)
+                categories.record_sale(db, products, removed)
+                catalog.touch(db, products)
+                db.commit()
+                product_cache.cache.invalidate(products)
+            except (IntegrityError, inventory.ProductNotFound):
+                # Another sync stored some of these keys (or a product was deleted) meanwhile; re-check once
+                db.rollback()
+                continue
+            for bill in created:
+                results[bill["idempotency_key"]] = {"status": "created", "bill_id": bill["id"]}
+            break
 
-    db.commit()
     return {
-        "created": created,
-        "skipped": skipped,
-        "errors": errors[:10],  # cap errors to avoid huge payloads
+        "results": [
+            {"idempotency_key": key, **(result or {"status": "error", "error": "Not processed, retry"})}
+            for key, result in results.items()
+        ]
     }
 
-# Billing Routes
-@app.post("/bills/", response_model=schemas.Bill)
-def create_bill(bill: schemas.BillCreate, db: database.SessionLocal = Depends(database.get_db), current_user: schemas.User = Depends(auth.get_current_user)):
-    total_amount = 0.0
-    bill_items = []
-    
-    # Calculate total and verify items
-    for item in bill.items:
-        product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Product with id {item.product_id} not found")
-
-        item_total = product.price * item.quantity
-        total_amount += item_total
-        
-        bill_items.append(models.BillItem(product_id=product.id, quantity=item.quantity, price=product.price))
-        
-        # Update stock
-        product.stock -= item.quantity
-    
-    db_bill = models.Bill(total_amount=total_amount, payment_method=bill.payment_method)
-    db.add(db_bill)
-    db.commit()
-    db.refresh(db_bill)
-    
-    for bill_item in bill_items:
-        bill_item.bill_id = db_bill.id
-        db.add(bill_item)
-    
-    db.commit()
-    db.refresh(db_bill)
-    return db_bill
+# Sales analytics (read from the rollup tables only)
+@app.get("/analytics/revenue", response_model=List[schemas.RevenuePoint])
+def sales_revenue(
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    granularity: str = Query("day", pattern="^(day|hour)$"),
+    db: database.SessionLocal = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    return analytics.revenue(db, start, end, granularity)
+
+@app.get("/analytics/top-products", response_model=List[schemas.ProductSales])
+def sales_top_products(
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    limit: int = Query(10, ge=1, le=100),
+    by: str = Query("revenue", pattern="^(revenue|units)$"),
+    db: database.SessionLocal = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    return analytics.top_products(db, start, end, limit, by)
+
+@app.get("/analytics/categories", response_model=List[schemas.CategorySales])
+def sales_by_category(
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    db: database.SessionLocal = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    return analytics.category_breakdown(db, start, end)
 
 @app.get("/bills/", response_model=List[schemas.Bill])
-def read_bills(skip: int = 0, limit: int = 100, db: database.SessionLocal = Depends(database.get_db), current_user: schemas.User = Depends(auth.get_current_user)):
-    bills = db.query(models.Bill).offset(skip).limit(limit).all()
+def read_bills(
+    response: Response,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    payment_method: Optional[str] = None,
+    db: database.SessionLocal = Depends(database.get_db),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """Bill history, newest first. Pass the X-Next-Cursor header back as ?cursor= for the next page.
+
+    ``skip`` (an offset, as before cursors) still works but gets slower the deeper it goes.
+    """
+    if skip and cursor:
+        raise HTTPException(status_code=400, detail="Use either cursor or skip, not both")
+    with database.count_queries() as queries:
+        try:
+            bills, next_cursor = billing.bill_history(
+                db, limit, cursor=cursor, start=start, end=end, payment_method=payment_method, skip=skip
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    response.headers["X-Query-Count"] = str(queries[0])
     return bills
 
+@app.get("/bills/export")
+def export_bills(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    gzip: bool = False,
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """Bills in [start, end) as a streamed download: CSV has one line per item, NDJSON one object per bill."""
+    return export_response(export.export_bills(format, start, end, compress=gzip), "bills", format, gzip)
+
 @app.get("/bills/{bill_id}", response_model=schemas.Bill)
 def read_bill(bill_id: int, db: database.SessionLocal = Depends(database.get_db), current_user: schemas.User = Depends(auth.get_current_user)):
-    bill = db.query(models.Bill).filter(models.Bill.id == bill_id).first()
+    bill = (
+        db.query(models.Bill)
+        .options(
+            selectinload(models.Bill.items).selectinload(models.BillItem.product).selectinload(models.Product.code_rows)
+        )
+        .filter(models.Bill.id == bill_id)
+        .first()
+    )
     if bill is None:
         raise HTTPException(status_code=404, detail="Bill not found")
     return bill
 
 # Image Recognition via OCR -> Search Products by extracted text
+def prepare_catalog(db):
+    """Blocking catalog catch-up for match_image; run on the threadpool."""
+    product_cache.cache.sync(db)
+    search_index.ensure_built(db)
+
+
+async def match_image(contents: bytes, db, region: Optional[tuple] = None):
+    """OCR one image (or one region of it) and return (matched products, debug info)."""
+    if len(contents) > imaging.OCR_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image too large (max {imaging.OCR_MAX_BYTES} bytes)")
+    # Pick up other workers' product writes before the index or the scan cache answers.
+    # Database work stays off the event loop, which is shared with every other request.
+    await run_in_threadpool(prepare_catalog, db)
+    # Perceptual hash lets repeat scans of the same package skip Tesseract entirely
+    image_key = None
+    if recognition_cache.cache.enabled:
+        image_key = await run_in_threadpool(recognition_cache.image_hash, contents, region)
+    cached, distance = recognition_cache.cache.get(image_key) if image_key is not None else (None, None)
+
+    if cached is not None:
+        text = cached.text
+        tokens = set(cached.tokens)
+        ranked_ids = cached.product_ids
+        debug_info = {"bytes": len(contents), "cache": "hit", "cache_distance": distance, "tokens": list(tokens)}
+    else:
+        # Decode + Tesseract run in the OCR process pool so other requests keep flowing
+        try:
+            result = await ocr.pool.run(ocr.extract_text, contents, region)
+        except ocr.OCRBusy as e:
+            raise HTTPException(status_code=503, detail=f"OCR busy, retry shortly: {e}", headers={"Retry-After": "2"})
+        except imaging.ImageTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except RuntimeError as e:
+            logger.error("OCR failed: %s", e)
+            raise HTTPException(status_code=503, detail=str(e))
+
+        text = result["text"]
+        debug_info = result["debug"]
+        debug_info["ocr_pending"] = ocr.pool.pending
+        debug_info["cache"] = "miss"
+
+        tokens = search_index.extract_tokens(text)
+        debug_info["tokens"] = list(tokens)
+
+        ranked, fuzzy = search_index.index.match(tokens, text)
+        if fuzzy:
+            debug_info["fuzzy_scores"] = ranked
+        ranked_ids = [pid for pid, _ in ranked]
+
+        if image_key is not None and tokens:
+            recognition_cache.cache.put(image_key, tokens, ranked_ids, text)
+
+    products: List[dict] = []
+    if ranked_ids:
+        by_id = await run_in_threadpool(product_cache.cache.get_many, db, ranked_ids)
+        products = [by_id[pid] for pid in ranked_ids if pid in by_id]
+
+    unique_products = list({p["id"]: p for p in products}.values())
+    debug_info["matched_ids"] = [p["id"] for p in unique_products]
+    return unique_products, debug_info
+
+
 @app.post("/recognize/")
 async def recognize_product(
     file: UploadFile = File(...),
@@ -486,147 +1068,99 @@ async def recognize_product(
     db: database.SessionLocal = Depends(database.get_db),
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
-    debug_info = {}
-
-    # Configure Tesseract path if specified in environment
-    tess_cmd = os.getenv("TESSERACT_CMD")
-    if tess_cmd and os.path.exists(tess_cmd):
-        pytesseract.pytesseract.tesseract_cmd = tess_cmd
+    if not ocr.available():
+        raise HTTPException(status_code=503, detail=f"OCR not available: {ocr.unavailable_reason()}")
 
-    if pytesseract is None or Image is None:
-        raise HTTPException(
-            status_code=503,
-            detail="OCR not available. Install pillow+pytesseract and the Tesseract binary on the server.",
-        )
-
-    contents = await file.read()
+    uploads.check_image(file)
+    contents = await file.read()  # bounded: UploadLimits capped the body at OCR_MAX_BYTES
     if not contents:
         raise HTTPException(status_code=400, detail="Empty image payload")
 
-    debug_info["bytes"] = len(contents)
-
-    try:
-        base_image = Image.open(io.BytesIO(contents))
-        base_image = ImageOps.exif_transpose(base_image)  # correct orientation from camera metadata
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid image file: {e}")
-
-    resample_lanczos = getattr(Image, "Resampling", Image).LANCZOS
-
-    def preprocess(img: "Image.Image", threshold: int | None = None, enlarge: float = 1.0) -> "Image.Image":
-        """Grayscale + autocontrast + optional binarize + optional upscale to help Tesseract."""
-        img = img.convert("L")
-        img = ImageOps.autocontrast(img)
-        if enlarge != 1.0:
-            new_w = min(int(img.width * enlarge), 2000)
-            new_h = min(int(img.height * enlarge), 2000)
-            img = img.resize((new_w, new_h), resample=resample_lanczos)
-        img = img.filter(ImageFilter.SHARPEN)
-        if threshold is not None:
-            img = img.point(lambda p: 255 if p > threshold else 0)
-        return img
-
-    def run_ocr(img: "Image.Image", cfg: str, min_conf: float) -> tuple[str, int, float | None]:
-        """Run Tesseract and return text, word count, avg conf."""
-        data = pytesseract.image_to_data(img, lang=lang, config=cfg, output_type=Output.DICT)
-        words: List[str] = []
-        confs: List[float] = []
-        for w_text, conf in zip(data.get("text", []), data.get("conf", [])):
-            try:
-                conf_val = float(conf)
-            except Exception:
-                conf_val = -1.0
-            if conf_val >= min_conf and w_text.strip():
-                words.append(w_text.strip())
-                confs.append(conf_val)
-        avg_conf = sum(confs) / len(confs) if confs else None
-        word_count = len(words)
-        # Always fall back to string extraction so we can still match something
-        text_out = " ".join(words) if words else pytesseract.image_to_string(img, lang=lang, config=cfg)
-        return text_out, word_count, avg_conf
-
-    # Preprocess (limit size first)
-    max_dim = 1800
-    bw, bh = base_image.size
-    debug_info["image_size_before"] = {"w": bw, "h": bh}
-    if max(bw, bh) > max_dim:
-        base_image.thumbnail((max_dim, max_dim))
-    debug_info["image_size_after"] = {"w": base_image.width, "h": base_image.height}
-
-    lang = os.getenv("TESSERACT_LANG", "eng")
-    primary_config = os.getenv("TESSERACT_CONFIG", "--psm 6 --oem 3")
-    fallback_config = os.getenv("TESSERACT_CONFIG_FALLBACK", "--psm 11 --oem 3")
-    min_conf = float(os.getenv("OCR_MIN_CONF", "40"))
-    thresh = int(os.getenv("OCR_THRESHOLD", "160"))
-    debug_info["lang"] = lang
-    debug_info["config"] = primary_config
-    debug_info["fallback_config"] = fallback_config
-    debug_info["tesseract_cmd"] = getattr(pytesseract.pytesseract, "tesseract_cmd", "auto")
-
-    # Pass 1: sharpen + binarize
-    primary_image = preprocess(base_image, threshold=thresh)
-    text, word_count, avg_conf = run_ocr(primary_image, primary_config, min_conf)
-
-    # Pass 2: softer processing + upscale if first pass weak
-    if word_count == 0 or len(text.strip()) < 3:
-        fallback_image = preprocess(base_image, threshold=None, enlarge=1.3)
-        text_fb, wc_fb, conf_fb = run_ocr(fallback_image, fallback_config, min_conf=30)
-        if wc_fb > word_count or (len(text_fb.strip()) > len(text.strip())):
-            text, word_count, avg_conf = text_fb, wc_fb, conf_fb
-            debug_info["used_fallback"] = True
-        else:
-            debug_info["used_fallback"] = False
-    else:
-        debug_info["used_fallback"] = False
-
-    debug_info["ocr_conf_avg"] = avg_conf
-    debug_info["ocr_word_count"] = word_count
-    debug_info["raw_text_preview"] = text[:400]
-
-    # Extract alphanumeric word-like tokens (filter noise)
-    word_tokens = re.findall(r"[A-Za-z0-9]{2,}", text)
-    split_tokens = [t for t in re.split(r"[\s,;\n]+", text) if t and t.strip()]
-    tokens = {
-        t.lower()
-        for t in word_tokens + split_tokens
-        if t and len(t) >= 2 and re.search(r"[A-Za-z0-9]", t)
-    }
-
-    debug_info["tokens"] = list(tokens)
-
-    products_q = db.query(models.Product)
-
-    products: List[models.Product] = []
-    if tokens:
-        filters = []
-        for token in tokens:
-            filters.append(models.Product.name.ilike(f"%{token}%"))
-            filters.append(models.Product.category.ilike(f"%{token}%"))
-        products = products_q.filter(or_(*filters)).limit(10).all()
-
-    # Fuzzy fallback if no matches
-    if not products:
-        all_products = products_q.all()
-        full_text = (text or "").lower()
-        scored: List[tuple[float, models.Product]] = []
-        for p in all_products:
-            hay = f"{p.name} {p.category or ''}".lower()
-            score = difflib.SequenceMatcher(None, full_text, hay).ratio() if full_text else 0
-            if score >= 0.1:
-                scored.append((score, p))
-        scored.sort(key=lambda x: x[0], reverse=True)
-        products = [s[1] for s in scored[:5]]
-        debug_info["fuzzy_scores"] = scored[:5]
-
-    unique_products = {p.id: normalize_product_url(p) for p in products}.values()
-
-    debug_info["matched_ids"] = [p.id for p in unique_products]
+    unique_products, debug_info = await match_image(contents, db)
     logger.info("OCR match", extra={"debug": debug_info})
 
     if debug:
         return {
-            "products": list(unique_products),
+            "products": unique_products,
             "debug": debug_info,
         }
 
-    return list(unique_products)
+    return unique_products
+
+
+OCR_BATCH_MAX = int(os.getenv("OCR_BATCH_MAX", "20"))
+
+
+@app.post("/recognize/batch")
+async def recognize_batch(
+    files: List[UploadFile] = File(...),
+    regions: str = Form(None),
+    debug: bool = False,
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    """Recognize many images, or many ``regions`` of a single shelf photo, in parallel.
+
+    Streams one NDJSON line per image/region as soon as it finishes:
+    ``{"index", "filename", "region", "status", "products" | "error"}``.
+    """
+    if not ocr.available():
+        raise HTTPException(status_code=503, detail=f"OCR not available: {ocr.unavailable_reason()}")
+    try:
+        boxes = ocr.parse_regions(regions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if boxes and len(files) != 1:
+        raise HTTPException(status_code=400, detail="regions can only be used with a single image")
+
+    for upload in files:
+        uploads.check_image(upload)
+    # Images stay in the spooled upload files until their turn: at most one per OCR worker is in memory.
+    # Regions of one shelf photo share a single read.
+    shared = await files[0].read() if boxes else None
+    jobs = []  # (filename, upload, region)
+    for upload in files:
+        if boxes:
+            jobs.extend((upload.filename, upload, box) for box in boxes)
+        else:
+            jobs.append((upload.filename, upload, None))
+    if not jobs:
+        raise HTTPException(status_code=400, detail="No images supplied")
+    if len(jobs) > OCR_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Too many images (max {OCR_BATCH_MAX} per batch)")
+
+    # Keep at most one job per OCR worker in flight so a batch can't fill the shared queue
+    limiter = asyncio.Semaphore(ocr.pool.workers)
+
+    async def run_job(index: int, filename: str, upload: UploadFile, region):
+        line = {"index": index, "filename": filename, "region": list(region) if region else None}
+        async with limiter:
+            contents = shared if shared is not None else await upload.read()
+            if not contents:
+                return {**line, "status": 400, "error": "Empty image payload"}
+            db = database.SessionLocal()
+            try:
+                products, debug_info = await match_image(contents, db, region)
+                line.update(status=200, products=products)
+                if debug:
+                    line["debug"] = debug_info
+            except HTTPException as e:
+                line.update(status=e.status_code, error=e.detail)
+            except Exception as e:
+                # One bad image must not end the stream for the rest of the batch
+                logger.exception("Batch recognition failed for %s", filename)
+                line.update(status=500, error=f"Recognition failed: {type(e).__name__}")
+            finally:
+                db.close()
+        return line
+
+    async def stream():
+        tasks = [asyncio.ensure_future(run_job(i, *job)) for i, job in enumerate(jobs)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                line = await finished
+                yield json.dumps(jsonable_encoder(line)) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime
+from sqlalchemy import Boolean, Column, Date, ForeignKey, Index, Integer, String, Float, DateTime
 from sqlalchemy.orm import relationship
 import datetime
 from database import Base
@@ -34,13 +34,19 @@ class UserDevice(Base):
 
     user = relationship("User", back_populates="devices")
 
+    # One row per terminal; the login check and the last_login flush look rows up by this pair
+    __table_args__ = (Index("ux_user_devices_user_id_device_id", "user_id", "device_id", unique=True),)
+
 class License(Base):
     __tablename__ = "licenses"
 
     id = Column(Integer, primary_key=True, index=True)
     key = Column(String, unique=True, index=True)
-    is_used = Column(Boolean, default=False)
+    is_used = Column(Boolean, default=False, index=True)
     used_by_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    batch = Column(String, nullable=True, index=True)  # label of the issuance run, e.g. a reseller
+    created_at = Column(DateTime, nullable=True, default=datetime.datetime.utcnow)
+    revoked_at = Column(DateTime, nullable=True)  # revoked keys can't be claimed
 
 
 class Product(Base):
@@ -52,6 +58,63 @@ class Product(Base):
     image_url = Column(String, nullable=True)
     stock = Column(Integer, default=0)
     category = Column(String, nullable=True)
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=True, index=True)  # kept in step with category, see categories.py
+    version = Column(Integer, default=0, index=True)  # catalog version of the last change, see catalog.py
+
+    # Lazy: most product queries (checkout, analytics, cache sync) never look at codes. Queries whose
+    # rows are serialized add selectinload(Product.code_rows): one batched SELECT, never one per product
+    code_rows = relationship("ProductCode", order_by="ProductCode.code", cascade="all, delete-orphan")
+
+    @property
+    def codes(self):
+        return [row.code for row in self.code_rows]
+
+class ProductCode(Base):
+    __tablename__ = "product_codes"
+
+    code = Column(String, primary_key=True)  # barcode or SKU, exactly as scanned; see product_codes.py
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
+
+class Category(Base):
+    __tablename__ = "categories"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True, nullable=False)
+    # Precomputed by categories.refresh_stats whenever a product in the category changes
+    product_count = Column(Integer, nullable=False, default=0)
+    stock_value = Column(Float, nullable=False, default=0.0)
+
+class CatalogState(Base):
+    __tablename__ = "catalog_state"
+
+    id = Column(Integer, primary_key=True)  # single row, id=1
+    version = Column(Integer, nullable=False, default=0)
+
+class CatalogTombstone(Base):
+    __tablename__ = "catalog_tombstones"
+
+    kind = Column(String, primary_key=True)  # "product" or "category"
+    key = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, index=True)
+    deleted_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class ImportJob(Base):
+    __tablename__ = "import_jobs"
+
+    id = Column(String, primary_key=True)  # uuid hex, handed to the client
+    filename = Column(String, nullable=True)
+    status = Column(String, default="queued")  # queued, running, done, failed
+    rows_processed = Column(Integer, default=0)
+    created = Column(Integer, default=0)
+    updated = Column(Integer, default=0)
+    skipped = Column(Integer, default=0)
+    merged = Column(Integer, default=0)  # rows replaced by a later row with the same name in their chunk
+    error_count = Column(Integer, default=0)
+    message = Column(String, nullable=True)
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
 
 class Bill(Base):
     __tablename__ = "bills"
@@ -60,14 +123,18 @@ class Bill(Base):
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     total_amount = Column(Float)
     payment_method = Column(String, default="cash")
+    idempotency_key = Column(String, unique=True, index=True, nullable=True)  # client-stamped, dedupes retries/offline sync
     
     items = relationship("BillItem", back_populates="bill")
 
+    # Keyset pagination of bill history walks this index newest-first
+    __table_args__ = (Index("ix_bills_created_at_id", "created_at", "id"),)
+
 class BillItem(Base):
     __tablename__ = "bill_items"
 
     id = Column(Integer, primary_key=True, index=True)
-    bill_id = Column(Integer, ForeignKey("bills.id"))
+    bill_id = Column(Integer, ForeignKey("bills.id"), index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
     quantity = Column(Integer)
     price = Column(Float) # Store snapshot of price at time of billing
@@ -75,6 +142,31 @@ class BillItem(Base):
     bill = relationship("Bill", back_populates="items")
     product = relationship("Product")
 
+# Sales rollups, maintained by analytics.record_bills (buckets are shop-local time)
+class SalesHourly(Base):
+    __tablename__ = "sales_hourly"
+
+    hour = Column(DateTime, primary_key=True)
+    payment_method = Column(String, primary_key=True)
+    bill_count = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+
+class SalesDaily(Base):
+    __tablename__ = "sales_daily"
+
+    day = Column(Date, primary_key=True)
+    payment_method = Column(String, primary_key=True)
+    bill_count = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+
+class ProductSalesDaily(Base):
+    __tablename__ = "product_sales_daily"
+
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, primary_key=True)  # no FK: history outlives deleted products
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
+
 class Subscription(Base):
     __tablename__ = "subscriptions"
 
@@ -0,0 +1,260 @@
+"""OCR pipeline for /recognize/.
+
+Tesseract runs take 1-3 seconds of CPU, so the work is handed to a bounded
+process pool instead of running on the uvicorn event loop.
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+import imaging
+import ocr_engine
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+if imaging.Image is None:
+    print("Warning: OCR dependencies missing: pillow is not installed")
+
+try:
+    import pytesseract
+    # Windows fallback for tesseract path
+    if os.name == 'nt':
+        possible_paths = [
+            r"C:\Program Files\Tesseract-OCR\tesseract.exe",
+            r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe",
+            r"C:\ProgramData\chocolatey\bin\tesseract.exe",
+        ]
+        # Check if tesseract is in PATH first
+        if not shutil.which("tesseract"):
+            for path in possible_paths:
+                if os.path.exists(path):
+                    pytesseract.pytesseract.tesseract_cmd = path
+                    print(f"Set tesseract cmd to: {path}")
+                    break
+except Exception:
+    pytesseract = None
+
+logger = logging.getLogger("dbiller.ocr")
+
+# Pool sizing: OCR_WORKERS processes run Tesseract, at most OCR_MAX_QUEUE more
+# requests wait for a free worker; anything beyond that is rejected right away.
+OCR_WORKERS = max(1, int(os.getenv("OCR_WORKERS", str(min(2, os.cpu_count() or 1)))))
+OCR_MAX_QUEUE = max(0, int(os.getenv("OCR_MAX_QUEUE", "8")))
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "30"))
+
+# Recognition settings, read once per process instead of per scan
+TESSERACT_LANG = os.getenv("TESSERACT_LANG", "eng")
+TESSERACT_CONFIG = os.getenv("TESSERACT_CONFIG", "--psm 6 --oem 3")
+TESSERACT_CONFIG_FALLBACK = os.getenv("TESSERACT_CONFIG_FALLBACK", "--psm 11 --oem 3")
+OCR_MIN_CONF = float(os.getenv("OCR_MIN_CONF", "40"))
+OCR_THRESHOLD = int(os.getenv("OCR_THRESHOLD", "160"))
+
+
+class OCRBusy(Exception):
+    """Raised when the pool is saturated and the request should be retried later."""
+
+
+def _tesseract_cmd() -> str:
+    tess_cmd = os.getenv("TESSERACT_CMD")
+    if tess_cmd and os.path.exists(tess_cmd):
+        return tess_cmd
+    return getattr(pytesseract.pytesseract, "tesseract_cmd", "tesseract")
+
+
+@lru_cache(maxsize=1)
+def unavailable_reason() -> Optional[str]:
+    """Why scans can't run in this deployment, or None; checked once per process."""
+    if imaging.Image is None:
+        return "pillow is not installed"
+    if ocr_engine.tesserocr is not None and os.getenv("OCR_ENGINE", "auto").lower() != "pytesseract":
+        return None
+    if pytesseract is None:
+        return "neither tesserocr nor pytesseract is installed"
+    # pytesseract imports fine without the binary and only fails inside the worker, on every scan
+    cmd = _tesseract_cmd()
+    if shutil.which(cmd) is None:
+        return f"the tesseract binary ({cmd}) was not found; install Tesseract or set TESSERACT_CMD"
+    return None
+
+
+def available() -> bool:
+    return unavailable_reason() is None
+
+
+def _init_worker():
+    # Configure Tesseract path if specified in environment
+    if pytesseract is not None:
+        pytesseract.pytesseract.tesseract_cmd = _tesseract_cmd()
+    # Load the language model once per worker rather than per scan
+    try:
+        ocr_engine.warm_up(TESSERACT_LANG, TESSERACT_CONFIG)
+    except Exception as e:
+        logger.warning("OCR engine warm-up failed: %s", e)
+
+
+def parse_regions(raw: Optional[str]) -> List[Tuple[int, int, int, int]]:
+    """Parse a JSON list of region boxes, ``[x, y, w, h]`` or ``{"x":..,"y":..,"w":..,"h":..}``.
+
+    Raises ValueError on malformed input.
+    """
+    if not raw:
+        return []
+    try:
+        items = json.loads(raw)
+    except ValueError:
+        raise ValueError("regions must be a JSON list of [x, y, w, h] boxes")
+    if not isinstance(items, list):
+        raise ValueError("regions must be a JSON list of [x, y, w, h] boxes")
+    regions = []
+    for item in items:
+        if isinstance(item, dict):
+            item = [item.get("x"), item.get("y"), item.get("w"), item.get("h")]
+        try:
+            x, y, w, h = (int(v) for v in item)
+        except Exception:
+            raise ValueError(f"Invalid region box: {item!r}")
+        if w <= 0 or h <= 0 or x < 0 or y < 0:
+            raise ValueError(f"Invalid region box: {item!r}")
+        regions.append((x, y, w, h))
+    return regions
+
+
+def extract_text(contents: bytes, region: Optional[Tuple[int, int, int, int]] = None) -> dict:
+    """Decode, preprocess and OCR an image. Runs inside a pool worker.
+
+    ``region`` is an optional ``(x, y, w, h)`` box in the orientation-corrected
+    image, used to OCR one item out of a shelf photo.
+
+    Returns a dict with the recognised ``text`` and a ``debug`` dict; raises
+    ValueError if the payload is not a readable image.
+    """
+    debug_info = {"bytes": len(contents)}
+    if region is not None:
+        debug_info["region"] = list(region)
+
+    image = imaging.OCRImage(contents, region)
+
+    engine = ocr_engine.get_engine()
+
+    def run_ocr(img: "Image.Image", cfg: str, min_conf: float) -> tuple[str, int, float | None]:
+        """Run one recognition pass and return text, word count, avg conf."""
+        try:
+            result = engine.recognize(img, lang, cfg)
+        except Exception as e:
+            # Engine exceptions (TesseractNotFoundError, ...) may not unpickle in the parent, which would
+            # then see a broken pool and restart it; a plain RuntimeError reports the error instead
+            raise RuntimeError(f"OCR engine {engine.name} failed: {type(e).__name__}: {e}") from None
+        words, confs = result.filtered(min_conf)
+        avg_conf = sum(confs) / len(confs) if confs else None
+        word_count = len(words)
+        # Fall back to every recognised word (any confidence) so we can still match something
+        text_out = " ".join(words) if words else " ".join(result.words)
+        return text_out, word_count, avg_conf
+
+    bw, bh = image.size_before
+    debug_info["image_size_before"] = {"w": bw, "h": bh}
+    debug_info["image_size_after"] = {"w": image.image.width, "h": image.image.height}
+
+    lang = TESSERACT_LANG
+    primary_config = TESSERACT_CONFIG
+    fallback_config = TESSERACT_CONFIG_FALLBACK
+    min_conf = OCR_MIN_CONF
+    thresh = OCR_THRESHOLD
+    debug_info["lang"] = lang
+    debug_info["config"] = primary_config
+    debug_info["fallback_config"] = fallback_config
+    debug_info["engine"] = engine.name
+    if pytesseract is not None:
+        debug_info["tesseract_cmd"] = getattr(pytesseract.pytesseract, "tesseract_cmd", "auto")
+
+    # Pass 1: sharpen + binarize
+    primary_image = image.primary(threshold=thresh)
+    text, word_count, avg_conf = run_ocr(primary_image, primary_config, min_conf)
+
+    # Pass 2: softer processing + upscale if first pass weak
+    if word_count == 0 or len(text.strip()) < 3:
+        fallback_image = image.fallback(enlarge=1.3)
+        text_fb, wc_fb, conf_fb = run_ocr(fallback_image, fallback_config, min_conf=30)
+        if wc_fb > word_count or (len(text_fb.strip()) > len(text.strip())):
+            text, word_count, avg_conf = text_fb, wc_fb, conf_fb
+            debug_info["used_fallback"] = True
+        else:
+            debug_info["used_fallback"] = False
+    else:
+        debug_info["used_fallback"] = False
+
+    debug_info["ocr_conf_avg"] = avg_conf
+    debug_info["ocr_word_count"] = word_count
+    debug_info["raw_text_preview"] = text[:400]
+
+    return {"text": text, "debug": debug_info}
+
+
+class OCRPool:
+    """Process pool with a hard cap on in-flight + queued jobs."""
+
+    def __init__(self, workers: int = OCR_WORKERS, max_queue: int = OCR_MAX_QUEUE, timeout: float = OCR_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, *args):
+        """Run ``fn(*args)`` in a worker, raising OCRBusy instead of queueing without bound."""
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                raise OCRBusy(f"OCR queue full ({self._pending} pending)")
+            self._pending += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # A timed-out scan keeps its worker busy, so it stays counted until it actually finishes
+        future.add_done_callback(self._release)
+        try:
+            # shield: giving up on the result must not cancel the job and release its slot early
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise OCRBusy(f"OCR timed out after {self.timeout:.0f}s")
+        except BrokenProcessPool:
+            # A worker died (OOM, segfault in tesseract); start a fresh pool for the next request
+            logger.warning("OCR worker pool broken; restarting")
+            self._reset_executor()
+            raise OCRBusy("OCR worker crashed")
+
+    def shutdown(self):
+        self._reset_executor()
+
+
+pool = OCRPool()
@@ -0,0 +1,176 @@
+"""OCR engine backends.
+
+``tesserocr`` keeps a libtesseract handle (and its loaded language model) alive
+for the lifetime of the worker process. ``pytesseract`` shells out to the
+``tesseract`` binary per call and is kept as the fallback when tesserocr is not
+installed. Both return words with confidences from a single recognition pass.
+
+Select with OCR_ENGINE=auto|tesserocr|pytesseract (default auto).
+"""
+import abc
+import os
+import shlex
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+try:
+    import tesserocr
+except Exception:
+    tesserocr = None
+
+try:
+    import pytesseract
+    from pytesseract import Output
+except Exception:
+    pytesseract = None
+
+
+@dataclass
+class OCRResult:
+    words: List[str] = field(default_factory=list)  # all non-empty words, in reading order
+    confs: List[float] = field(default_factory=list)  # confidence per word, -1 when unknown
+
+    def filtered(self, min_conf: float) -> Tuple[List[str], List[float]]:
+        kept = [(w, c) for w, c in zip(self.words, self.confs) if c >= min_conf]
+        return [w for w, _ in kept], [c for _, c in kept]
+
+
+def parse_config(cfg: str) -> Tuple[Optional[int], Optional[int], Dict[str, str]]:
+    """Split a tesseract CLI config string into (psm, oem, -c variables)."""
+    psm = oem = None
+    variables: Dict[str, str] = {}
+    parts = shlex.split(cfg or "")
+    i = 0
+    while i < len(parts):
+        part = parts[i]
+        nxt = parts[i + 1] if i + 1 < len(parts) else None
+        if part == "--psm" and nxt is not None:
+            psm, i = int(nxt), i + 2
+        elif part == "--oem" and nxt is not None:
+            oem, i = int(nxt), i + 2
+        elif part == "-c" and nxt is not None and "=" in nxt:
+            key, value = nxt.split("=", 1)
+            variables[key] = value
+            i += 2
+        else:
+            i += 1
+    return psm, oem, variables
+
+
+class OCREngine(abc.ABC):
+    """An OCR backend; an engine missing ``recognize`` fails when it is built, not on the first scan."""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def recognize(self, img, lang: str, cfg: str) -> OCRResult:
+        """Words and confidences from one pass over ``img`` with tesseract ``lang`` and CLI-style ``cfg``."""
+
+
+class TesserocrEngine(OCREngine):
+    """In-process libtesseract; one API handle per (lang, oem, -c variables), reused across calls.
+
+    SetVariable sticks to a handle, so each distinct set of ``-c`` variables gets
+    its own handle, configured once when it is created. Variables of one config
+    can't leak into passes with another; configs without variables (the defaults)
+    share a handle.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self):
+        self._apis: Dict[Tuple[str, int, FrozenSet[Tuple[str, str]]], "tesserocr.PyTessBaseAPI"] = {}
+        self._lock = threading.Lock()
+        self._tessdata = os.getenv("TESSDATA_PREFIX") or None
+
+    def _api(self, lang: str, oem: Optional[int], variables: Optional[Dict[str, str]] = None):
+        key = (lang, 3 if oem is None else oem, frozenset((variables or {}).items()))
+        api = self._apis.get(key)
+        if api is None:
+            kwargs = {"lang": lang, "oem": tesserocr.OEM(key[1])}
+            if self._tessdata:
+                kwargs["path"] = self._tessdata
+            api = tesserocr.PyTessBaseAPI(**kwargs)
+            for name, value in (variables or {}).items():
+                api.SetVariable(name, value)
+            self._apis[key] = api
+        return api
+
+    def recognize(self, img, lang: str, cfg: str) -> OCRResult:
+        psm, oem, variables = parse_config(cfg)
+        with self._lock:
+            api = self._api(lang, oem, variables)
+            api.SetPageSegMode(tesserocr.PSM(6 if psm is None else psm))
+            api.SetImage(img)
+            api.Recognize()
+            result = OCRResult()
+            level = tesserocr.RIL.WORD
+            iterator = api.GetIterator()
+            if iterator is not None:
+                for word_iter in tesserocr.iterate_level(iterator, level):
+                    word = (word_iter.GetUTF8Text(level) or "").strip()
+                    if word:
+                        result.words.append(word)
+                        result.confs.append(float(word_iter.Confidence(level)))
+            api.Clear()
+        return result
+
+    def close(self):
+        with self._lock:
+            for api in self._apis.values():
+                api.End()
+            self._apis.clear()
+
+
+class PytesseractEngine(OCREngine):
+    """Subprocess-per-call fallback via the tesseract CLI."""
+
+    name = "pytesseract"
+
+    def recognize(self, img, lang: str, cfg: str) -> OCRResult:
+        data = pytesseract.image_to_data(img, lang=lang, config=cfg, output_type=Output.DICT)
+        result = OCRResult()
+        for w_text, conf in zip(data.get("text", []), data.get("conf", [])):
+            if not w_text or not w_text.strip():
+                continue
+            try:
+                conf_val = float(conf)
+            except Exception:
+                conf_val = -1.0
+            result.words.append(w_text.strip())
+            result.confs.append(conf_val)
+        return result
+
+
+_engine: Optional[OCREngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> OCREngine:
+    """Return this process's engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = _create_engine(os.getenv("OCR_ENGINE", "auto").lower())
+    return _engine
+
+
+def _create_engine(choice: str) -> OCREngine:
+    if choice in ("auto", "tesserocr") and tesserocr is not None:
+        return TesserocrEngine()
+    if choice == "tesserocr":
+        print("Warning: OCR_ENGINE=tesserocr but tesserocr is not installed; using pytesseract")
+    if pytesseract is None:
+        raise RuntimeError("No OCR engine available. Install tesserocr or pytesseract.")
+    return PytesseractEngine()
+
+
+def warm_up(lang: str, cfg: str):
+    """Load the language model up front so the first scan in a worker isn't slow."""
+    engine = get_engine()
+    if isinstance(engine, TesserocrEngine):
+        _, oem, variables = parse_config(cfg)
+        with engine._lock:
+            engine._api(lang, oem, variables)
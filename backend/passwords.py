@@ -0,0 +1,131 @@
+"""Password hashing off the event loop, on a small bounded thread pool.
+
+bcrypt costs ~250 ms of CPU per hash or verify at the default cost. Run on
+the event loop it stalls every request; run in Starlette's shared threadpool
+a login burst can take every thread and starve checkout. Here it gets its own
+PASSWORD_HASH_WORKERS threads (bcrypt releases the GIL while hashing), at
+most PASSWORD_HASH_MAX_QUEUE more calls wait for one, and anything beyond
+that is rejected with HashBusy right away (the API answers 503 + Retry-After)
+instead of piling up. The threads also run at a lower CPU priority, so a
+burst of logins slows down logins rather than checkout.
+
+BCRYPT_ROUNDS sets the cost of new hashes. Stored hashes with another cost
+still verify, and ``verify_and_update`` hands back a re-hash at the new cost
+so logins migrate passwords transparently.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Optional, Tuple
+
+import auth
+
+PASSWORD_HASH_WORKERS = max(1, int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2)))))
+PASSWORD_HASH_MAX_QUEUE = max(0, int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "8")))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))
+# Scheduling niceness of the hashing threads (Linux, where it is per thread): request
+# handling threads win the CPU when both are runnable; 0 turns it off
+PASSWORD_HASH_NICE = int(os.getenv("PASSWORD_HASH_NICE", "10"))
+
+
+def _lower_priority():
+    if PASSWORD_HASH_NICE <= 0 or not hasattr(os, "setpriority"):
+        return
+    try:
+        tid = threading.get_native_id()
+        os.setpriority(os.PRIO_PROCESS, tid, os.getpriority(os.PRIO_PROCESS, tid) + PASSWORD_HASH_NICE)
+    except OSError:
+        pass
+
+
+class HashBusy(Exception):
+    """Raised when the hashing pool is saturated and the request should be retried later."""
+
+
+class HashPool:
+    """Thread pool with a hard cap on in-flight + queued hashing calls."""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE,
+                 timeout: float = PASSWORD_HASH_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _admit(self):
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise HashBusy(f"password hashing queue full ({self._pending} pending)")
+            self._pending += 1
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="passwords", initializer=_lower_priority
+                )
+            return self._executor
+
+    def _submit(self, fn, *args):
+        self._admit()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Counted until the work itself finishes, even if the caller stopped waiting
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args):
+        """Await ``fn(*args)`` from async code."""
+        future = self._submit(fn, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise HashBusy(f"password hashing timed out after {self.timeout:.0f}s")
+
+    def call(self, fn, *args):
+        """Blocking form of ``run`` for sync endpoints."""
+        future = self._submit(fn, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HashBusy(f"password hashing timed out after {self.timeout:.0f}s")
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "max_queue": self.max_queue, "pending": self._pending, "rejected": self._rejected}
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+pool = HashPool()
+
+
+async def hash(password: str) -> str:
+    return await pool.run(auth.get_password_hash, password)
+
+
+async def verify_and_update(password: str, hashed: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """``(ok, new_hash)``; new_hash is set when the stored hash should be replaced (cost changed)."""
+    if not hashed:
+        return False, None
+    return await pool.run(auth.pwd_context.verify_and_update, password, hashed)
@@ -0,0 +1,212 @@
+"""Read-through cache of catalog data for the product endpoints and the OCR matcher.
+
+Two layers, both bounded and LRU-evicted:
+  - product dicts by id (schemas.product_dict form), for /products/{id} and
+    /recognize/ results: PRODUCT_CACHE_SIZE entries;
+  - fully serialized JSON bodies of /products/ pages keyed by
+    (catalog version, skip, limit, category_id), served as-is without touching the ORM or
+    pydantic: PRODUCT_LIST_CACHE_BYTES in total.
+
+The write paths in main.py invalidate the ids they touched (and every cached
+page) right after commit. Other worker processes catch up through the catalog
+versions (catalog.py): before serving, ``sync`` compares the
+cached version with catalog_state (one primary-key lookup, at most every
+PRODUCT_CACHE_SYNC_INTERVAL seconds; 0 = every request) and drops exactly the
+ids stamped or tombstoned since.
+
+Other per-process catalog structures (the OCR index, the scan cache) subscribe
+with ``on_sync`` and get the same changed rows, so they catch up with other
+workers' writes at the same point.
+
+A generation counter guards fills, so a read that raced with a write can't
+put the pre-write row back after it was invalidated.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import selectinload
+
+import catalog
+import models
+import schemas
+
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "5000"))
+PRODUCT_LIST_CACHE_BYTES = int(os.getenv("PRODUCT_LIST_CACHE_BYTES", str(8 * 1024 * 1024)))
+PRODUCT_CACHE_SYNC_INTERVAL = float(os.getenv("PRODUCT_CACHE_SYNC_INTERVAL", "0"))
+
+
+class ProductCache:
+    def __init__(self, max_entries: int = PRODUCT_CACHE_SIZE, max_list_bytes: int = PRODUCT_LIST_CACHE_BYTES,
+                 sync_interval: float = PRODUCT_CACHE_SYNC_INTERVAL):
+        self.max_entries = max_entries
+        self.max_list_bytes = max_list_bytes
+        self.sync_interval = sync_interval
+        self._products: "OrderedDict[int, dict]" = OrderedDict()
+        self._pages: "OrderedDict[Tuple[int, int, int, Optional[int]], bytes]" = OrderedDict()
+        self._page_bytes = 0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()  # one sync at a time; separate because listeners call invalidate
+        self._generation = 0
+        self.version: Optional[int] = None
+        self._synced_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.list_hits = 0
+        self.list_misses = 0
+        self.invalidations = 0
+        self._listeners: List[Callable[[object, Optional[List[tuple]], Optional[List[int]]], None]] = []
+
+    def on_sync(self, listener: Callable[[object, Optional[List[tuple]], Optional[List[int]]], None]):
+        """Call ``listener(db, changed_rows, deleted_ids)`` whenever ``sync`` picks up writes.
+
+        ``changed_rows`` are ``(id, name, category)`` of products stamped since the
+        previous sync; both are None when the database was reset and everything
+        derived from the catalog must be rebuilt.
+        """
+        self._listeners.append(listener)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def sync(self, db) -> int:
+        """Catch up with writes made by other processes; returns the catalog version to serve.
+
+        Request threads sync concurrently, so the read-compare-update runs under
+        ``_sync_lock``: a sync that read an older version can't finish after a newer
+        one and take the gap for a database reset, or move ``version`` backwards.
+        """
+        now = time.monotonic()
+        if self.version is not None and now - self._synced_at < self.sync_interval:
+            return self.version
+        with self._sync_lock:
+            if self.version is not None and self._synced_at >= now:
+                return self.version  # another thread synced while this one waited
+            return self._sync(db, now)
+
+    def _sync(self, db, now: float) -> int:
+        current = catalog.current_version(db)
+        changes = None
+        if self.version is None:
+            self.clear()  # first use
+        elif current < self.version:
+            self.clear()  # the database was reset
+            changes = (None, None)
+        elif current > self.version:
+            changed = (
+                db.query(models.Product.id, models.Product.name, models.Product.category)
+                .filter(models.Product.version > self.version)
+                .all()
+            )
+            deleted = [
+                int(key) for (key,) in db.query(models.CatalogTombstone.key)
+                .filter(models.CatalogTombstone.kind == "product", models.CatalogTombstone.version > self.version)
+            ]
+            self.invalidate([row[0] for row in changed] + deleted)
+            changes = ([tuple(row) for row in changed], deleted)
+        if changes is not None:
+            # Before the version moves on, so a failed listener sees the same changes next time
+            for listener in self._listeners:
+                listener(db, *changes)
+        self.version = current
+        self._synced_at = now
+        return current
+
+    def get_many(self, db, product_ids: List[int]) -> Dict[int, dict]:
+        """Product dicts for ``product_ids`` (missing ids are absent), loading misses in one query."""
+        found: Dict[int, dict] = {}
+        with self._lock:
+            generation = self._generation
+            for pid in product_ids:
+                entry = self._products.get(pid)
+                if entry is not None:
+                    self._products.move_to_end(pid)
+                    found[pid] = entry
+            self.hits += len(found)
+            missing = [pid for pid in dict.fromkeys(product_ids) if pid not in found]
+            self.misses += len(missing)
+        if missing:
+            loaded = {
+                p.id: schemas.product_dict(p)
+                for p in db.query(models.Product).options(selectinload(models.Product.code_rows))
+                .filter(models.Product.id.in_(missing)).all()
+            }
+            found.update(loaded)
+            self._fill(loaded, generation)
+        return found
+
+    def get(self, db, product_id: int) -> Optional[dict]:
+        return self.get_many(db, [product_id]).get(product_id)
+
+    def _fill(self, loaded: Dict[int, dict], generation: int):
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return  # invalidated while we were reading; the rows may predate the write
+            for pid, entry in loaded.items():
+                self._products[pid] = entry
+                self._products.move_to_end(pid)
+            while len(self._products) > self.max_entries:
+                self._products.popitem(last=False)
+
+    def page(self, version: int, skip: int, limit: int, loader: Callable[[], Iterable[dict]],
+             category_id: Optional[int] = None) -> bytes:
+        """Serialized JSON body of one /products/ page (optionally of one category) at ``version``."""
+        key = (version, skip, limit, category_id)
+        with self._lock:
+            body = self._pages.get(key)
+            if body is not None:
+                self._pages.move_to_end(key)
+                self.list_hits += 1
+                return body
+            self.list_misses += 1
+            generation = self._generation
+        body = json.dumps(jsonable_encoder(list(loader())), separators=(",", ":")).encode("utf-8")
+        if self.max_list_bytes > 0 and len(body) <= self.max_list_bytes:
+            with self._lock:
+                if generation == self._generation and key not in self._pages:
+                    self._pages[key] = body
+                    self._page_bytes += len(body)
+                    while self._page_bytes > self.max_list_bytes:
+                        _, evicted = self._pages.popitem(last=False)
+                        self._page_bytes -= len(evicted)
+        return body
+
+    def invalidate(self, product_ids: Iterable[int] = ()):
+        """Forget ``product_ids`` and every cached page (any write changes some page)."""
+        with self._lock:
+            self._generation += 1
+            for pid in product_ids:
+                self._products.pop(pid, None)
+            self._pages.clear()
+            self._page_bytes = 0
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._products.clear()
+            self._pages.clear()
+            self._page_bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "products": len(self._products),
+            "hits": self.hits,
+            "misses": self.misses,
+            "pages": len(self._pages),
+            "page_bytes": self._page_bytes,
+            "list_hits": self.list_hits,
+            "list_misses": self.list_misses,
+            "invalidations": self.invalidations,
+            "version": self.version,
+        }
+
+
+cache = ProductCache()
@@ -0,0 +1,79 @@
+"""Barcode / SKU codes: exact product lookups for scanners.
+
+Codes live in product_codes with the code itself as primary key, so a code
+belongs to at most one product, a product can have several (carton and unit
+barcodes, an internal SKU), and a scan is one primary-key lookup. Codes are
+compared exactly as scanned, after trimming whitespace.
+"""
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, insert, select
+
+import models
+
+MAX_CODE_LENGTH = 64
+MAX_CODES_PER_PRODUCT = 20
+
+
+class CodeConflict(Exception):
+    def __init__(self, taken: Dict[str, int]):
+        # code -> id of the product that already has it
+        self.taken = taken
+        super().__init__(
+            "Code already assigned: " + ", ".join(f"{code} (product {pid})" for code, pid in sorted(taken.items()))
+        )
+
+
+def parse(raw: Optional[str]) -> List[str]:
+    """Codes from a form/CSV value: separated by commas, "|" or whitespace; order kept, duplicates dropped."""
+    if not raw:
+        return []
+    codes = []
+    for part in raw.replace("|", " ").replace(",", " ").split():
+        if len(part) > MAX_CODE_LENGTH:
+            raise ValueError(f"code longer than {MAX_CODE_LENGTH} characters")
+        if part not in codes:
+            codes.append(part)
+    if len(codes) > MAX_CODES_PER_PRODUCT:
+        raise ValueError(f"more than {MAX_CODES_PER_PRODUCT} codes")
+    return codes
+
+
+def owners(db, codes: Iterable[str]) -> Dict[str, int]:
+    """code -> product id for the codes that are assigned (one indexed IN query)."""
+    codes = list(dict.fromkeys(codes))
+    if not codes:
+        return {}
+    return dict(db.execute(select(models.ProductCode.code, models.ProductCode.product_id).where(models.ProductCode.code.in_(codes))).all())
+
+
+def codes_of(db, product_ids: Iterable[int]) -> Dict[int, List[str]]:
+    """product id -> its codes in code order, for ``product_ids`` (one indexed IN query)."""
+    ids = list(dict.fromkeys(product_ids))
+    found: Dict[int, List[str]] = {pid: [] for pid in ids}
+    if ids:
+        table = models.ProductCode.__table__
+        for code, pid in db.execute(
+            select(table.c.code, table.c.product_id).where(table.c.product_id.in_(ids)).order_by(table.c.code)
+        ):
+            found[pid].append(code)
+    return found
+
+
+def replace(db, product_id: int, codes: List[str]):
+    """Make ``codes`` exactly the codes of ``product_id``; raises CodeConflict if another product has one."""
+    taken = {code: pid for code, pid in owners(db, codes).items() if pid != product_id}
+    if taken:
+        raise CodeConflict(taken)
+    replace_many(db, {product_id: codes})
+
+
+def replace_many(db, codes_by_product: Dict[int, List[str]]):
+    """Set the codes of several products at once; the caller has checked ownership."""
+    if not codes_by_product:
+        return
+    table = models.ProductCode.__table__
+    db.execute(delete(table).where(table.c.product_id.in_(list(codes_by_product))))
+    rows = [{"code": code, "product_id": pid} for pid, codes in codes_by_product.items() for code in codes]
+    if rows:
+        db.execute(insert(table), rows)
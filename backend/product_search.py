@@ -0,0 +1,217 @@
+"""Database-backed product search for GET /products/search (POS type-ahead).
+
+SQLite: two FTS5 external-content tables over products(name, category):
+  products_fts  - unicode61 words with prefix indexes, for "amu but" -> Amul Butter
+  products_trgm - trigram tokens of the name, for typos ("buttr", "amull")
+AFTER INSERT/DELETE and AFTER UPDATE OF name, category triggers keep both in
+step with every write path (ORM, bulk upload, other processes); updates that
+leave name and category as they were (checkout stock, price-list re-imports)
+don't touch them.
+
+PostgreSQL: a generated, GIN-indexed ``search_vector`` tsvector (name weighted
+above category) for prefix queries, plus a pg_trgm GIN index on name for
+``word_similarity`` typo matching when the extension is available. Being a
+generated column, it needs no sync code at all.
+
+Prefix matches are ranked by bm25 / ts_rank; only when a query has no prefix
+match does it fall back to typo matching. Anything else (another database, or
+SQLite built without FTS5) falls back to the in-memory search_index.
+"""
+import logging
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+import search_index
+
+logger = logging.getLogger("dbiller")
+
+FUZZY_CANDIDATES = 200
+FUZZY_GRAMS_PER_TERM = 3  # rarest trigrams of each term used to gather typo candidates
+FUZZY_MIN_SIMILARITY = 0.3
+NAME_RANK_WEIGHT, CATEGORY_RANK_WEIGHT = 10.0, 2.0
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, category, content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_trgm USING fts5(
+        name, content='products', content_rowid='id', tokenize='trigram')""",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_trgm_vocab USING fts5vocab(products_trgm, 'row')",
+    """CREATE TRIGGER IF NOT EXISTS products_search_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, category) VALUES (new.id, new.name, new.category);
+        INSERT INTO products_trgm(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_search_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, category) VALUES ('delete', old.id, old.name, old.category);
+        INSERT INTO products_trgm(products_trgm, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_search_au AFTER UPDATE OF name, category ON products
+    WHEN old.name IS NOT new.name OR old.category IS NOT new.category BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, category) VALUES ('delete', old.id, old.name, old.category);
+        INSERT INTO products_trgm(products_trgm, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO products_fts(rowid, name, category) VALUES (new.id, new.name, new.category);
+        INSERT INTO products_trgm(rowid, name) VALUES (new.id, new.name);
+    END""",
+]
+
+POSTGRES_DDL = [
+    """ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(category, '')), 'B')) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING gin (search_vector)",
+]
+POSTGRES_TRGM_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING gin (name gin_trgm_ops)",
+]
+
+# Which backend ensure_schema managed to set up: "sqlite", "postgresql" or None (in-memory fallback)
+backend: Optional[str] = None
+fuzzy_in_db = False
+
+
+def _run_ddl(engine, statements) -> bool:
+    try:
+        with engine.begin() as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+        return True
+    except Exception as e:
+        logger.warning("product search DDL failed: %s", e)
+        return False
+
+
+def ensure_schema(engine):
+    """Create the search index structures for the engine's dialect (idempotent)."""
+    global backend, fuzzy_in_db
+    dialect = engine.dialect.name
+    if dialect == "sqlite":
+        with engine.connect() as conn:
+            existed = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'")).first() is not None
+        if _run_ddl(engine, SQLITE_DDL):
+            backend, fuzzy_in_db = "sqlite", True
+            if not existed:
+                # Index rows that predate the triggers
+                _run_ddl(engine, [
+                    "INSERT INTO products_fts(products_fts) VALUES ('rebuild')",
+                    "INSERT INTO products_trgm(products_trgm) VALUES ('rebuild')",
+                ])
+    elif dialect == "postgresql":
+        if _run_ddl(engine, POSTGRES_DDL):
+            backend = "postgresql"
+            fuzzy_in_db = _run_ddl(engine, POSTGRES_TRGM_DDL)
+
+
+def query_terms(q: str) -> List[str]:
+    return search_index.tokenize(q)[:8]
+
+
+def search(db, q: str, category: Optional[str] = None, limit: int = 20, offset: int = 0) -> Tuple[List[int], bool, str]:
+    """Ranked product ids for one page: ``(ids, has_more, mode)`` with mode "prefix" or "fuzzy"."""
+    terms = query_terms(q)
+    if not terms:
+        return [], False, "prefix"
+    ids = _prefix(db, terms, category, limit + 1, offset)
+    mode = "prefix"
+    # Later pages of a fuzzy result have no prefix matches either; an empty page after
+    # prefix matches is just the end of them
+    if not ids and (offset == 0 or not _prefix(db, terms, category, 1, 0)):
+        ids, mode = _fuzzy(db, terms, category, limit + 1, offset), "fuzzy"
+    return ids[:limit], len(ids) > limit, mode
+
+
+def _prefix(db, terms: List[str], category: Optional[str], limit: int, offset: int) -> List[int]:
+    params = {"limit": limit, "offset": offset, "category": category}
+    scope = "AND p.category = :category" if category else ""
+    if backend == "sqlite":
+        params["match"] = " ".join(f'"{t}"*' for t in terms)
+        # The products join is only needed for the category scope
+        source = f"products_fts f JOIN products p ON p.id = f.rowid WHERE products_fts MATCH :match {scope}" if category \
+            else "products_fts f WHERE products_fts MATCH :match"
+        sql = f"""
+            SELECT f.rowid FROM {source}
+            ORDER BY bm25(products_fts, {NAME_RANK_WEIGHT}, {CATEGORY_RANK_WEIGHT}), f.rowid
+            LIMIT :limit OFFSET :offset"""
+    elif backend == "postgresql":
+        params["tsq"] = " & ".join(f"{t}:*" for t in terms)
+        sql = f"""
+            SELECT p.id FROM products p
+            WHERE p.search_vector @@ to_tsquery('simple', :tsq) {scope}
+            ORDER BY ts_rank(p.search_vector, to_tsquery('simple', :tsq)) DESC, p.id
+            LIMIT :limit OFFSET :offset"""
+    else:
+        return _memory(db, terms, category, limit, offset)
+    return [row[0] for row in db.execute(text(sql), params)]
+
+
+def _fuzzy(db, terms: List[str], category: Optional[str], limit: int, offset: int = 0) -> List[int]:
+    long_terms = [t for t in terms if len(t) >= 3]
+    if not long_terms:
+        return []
+    params = {"category": category}
+    scope = "AND p.category = :category" if category else ""
+    if backend == "sqlite":
+        # Candidates share one of each term's rarest trigrams (common grams would pull in half
+        # the catalog); they are re-ranked by full trigram similarity below
+        grams = _rare_grams(db, long_terms)
+        if not grams:
+            return []
+        params["match"] = " OR ".join(f'"{g}"' for g in grams)
+        sql = f"""
+            SELECT p.id, p.name FROM products_trgm f JOIN products p ON p.id = f.rowid
+            WHERE products_trgm MATCH :match {scope}
+            ORDER BY bm25(products_trgm) LIMIT {FUZZY_CANDIDATES}"""
+        candidates = db.execute(text(sql), params).all()
+        scored = []
+        for product_id, name in candidates:
+            score = _similarity(long_terms, name)
+            if score >= FUZZY_MIN_SIMILARITY:
+                scored.append((product_id, score))
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return [pid for pid, _ in scored[offset:offset + limit]]
+    if backend == "postgresql" and fuzzy_in_db:
+        params.update(q=" ".join(long_terms), limit=limit, offset=offset, min_sim=FUZZY_MIN_SIMILARITY)
+        sql = f"""
+            SELECT p.id FROM products p
+            WHERE :q <% p.name AND word_similarity(:q, p.name) >= :min_sim {scope}
+            ORDER BY word_similarity(:q, p.name) DESC, p.id
+            LIMIT :limit OFFSET :offset"""
+        return [row[0] for row in db.execute(text(sql), params)]
+    return _memory(db, long_terms, category, limit, offset)
+
+
+def _rare_grams(db, terms: List[str]) -> List[str]:
+    term_grams = [sorted(search_index.trigrams(t, pad=False)) for t in terms]
+    every = sorted({g for grams in term_grams for g in grams})
+    placeholders = ", ".join(f":g{i}" for i in range(len(every)))
+    counts = dict(db.execute(
+        text(f"SELECT term, doc FROM products_trgm_vocab WHERE term IN ({placeholders})"),
+        {f"g{i}": g for i, g in enumerate(every)},
+    ).all())
+    picked = set()
+    for grams in term_grams:
+        present = sorted((g for g in grams if counts.get(g)), key=lambda g: counts[g])
+        picked.update(present[:FUZZY_GRAMS_PER_TERM])
+    return sorted(picked)
+
+
+def _similarity(terms: List[str], name: Optional[str]) -> float:
+    """Mean over query terms of the best trigram Dice score against any word of ``name``."""
+    words = [search_index.trigrams(w) for w in search_index.tokenize(name)]
+    if not words:
+        return 0.0
+    total = 0.0
+    for term in terms:
+        grams = search_index.trigrams(term)
+        total += max(2.0 * len(grams & w) / (len(grams) + len(w)) for w in words)
+    return total / len(terms)
+
+
+def _memory(db, terms: List[str], category: Optional[str], limit: int, offset: int) -> List[int]:
+    search_index.ensure_built(db)
+    ranked = search_index.index.search(terms, limit=offset + limit if not category else 10_000)
+    ids = [pid for pid, _ in ranked]
+    if category:
+        ids = [pid for pid in ids if search_index.index.category_of(pid) == category]
+    return ids[offset:offset + limit]
@@ -0,0 +1,132 @@
+"""Perceptual-hash cache for /recognize/.
+
+Cashiers scan the same packaged goods over and over. Each scan is reduced to a
+64-bit difference hash of the EXIF-transposed, downscaled image; a later scan
+whose hash is within RECOGNITION_CACHE_MAX_DISTANCE bits reuses the stored OCR
+tokens and matched product ids instead of running Tesseract again.
+
+Settings: RECOGNITION_CACHE_SIZE (entries, 0 disables), RECOGNITION_CACHE_TTL
+(seconds), RECOGNITION_CACHE_MAX_DISTANCE (Hamming bits out of 64).
+
+Entries are dropped when a product they matched, or one whose name shares
+their tokens, is written: by this process's write paths directly, and for
+other workers' writes when ``product_cache.sync`` picks them up.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+import imaging
+from imaging import Image, ImageOps
+
+RECOGNITION_CACHE_SIZE = int(os.getenv("RECOGNITION_CACHE_SIZE", "512"))
+RECOGNITION_CACHE_TTL = float(os.getenv("RECOGNITION_CACHE_TTL", "3600"))
+RECOGNITION_CACHE_MAX_DISTANCE = int(os.getenv("RECOGNITION_CACHE_MAX_DISTANCE", "6"))
+
+HASH_SIZE = 8
+
+
+def image_hash(contents: bytes, region: Optional[Tuple[int, int, int, int]] = None) -> Optional[int]:
+    """64-bit dHash of the image (or of an ``(x, y, w, h)`` region), or None if it can't be decoded."""
+    if Image is None:
+        return None
+    try:
+        img = imaging.open_image(contents)
+        if region is None:
+            # JPEG draft mode decodes at 1/2..1/8 scale, which is plenty for a 9x8 thumbnail
+            img.draft("L", (HASH_SIZE * 16, HASH_SIZE * 16))
+        img = ImageOps.exif_transpose(img)
+        if region is not None:
+            x, y, w, h = region
+            img = img.crop((x, y, x + w, y + h))
+        img = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), getattr(Image, "Resampling", Image).BILINEAR)
+    except Exception:
+        return None
+    pixels = list(img.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    # A flat image has no gradients to hash; every such scan would collide on 0
+    return value or None
+
+
+@dataclass
+class CacheEntry:
+    tokens: List[str]
+    product_ids: List[int]
+    text: str
+    created_at: float
+
+
+class RecognitionCache:
+    def __init__(self, max_entries: int = RECOGNITION_CACHE_SIZE, ttl: float = RECOGNITION_CACHE_TTL,
+                 max_distance: int = RECOGNITION_CACHE_MAX_DISTANCE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._entries: "OrderedDict[int, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: int) -> Tuple[Optional[CacheEntry], Optional[int]]:
+        """Closest live entry within the distance threshold, and its distance."""
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_distance = None, self.max_distance + 1
+            for entry_key, entry in list(self._entries.items()):
+                if now - entry.created_at > self.ttl:
+                    del self._entries[entry_key]
+                    continue
+                distance = (entry_key ^ key).bit_count()
+                if distance < best_distance:
+                    best_key, best_distance = entry_key, distance
+                    if distance == 0:
+                        break
+            if best_key is None:
+                self.misses += 1
+                return None, None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return self._entries[best_key], best_distance
+
+    def put(self, key: int, tokens: Iterable[str], product_ids: Iterable[int], text: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = CacheEntry(list(tokens), list(product_ids), text, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, product_ids: Iterable[int] = (), tokens: Iterable[str] = ()) -> int:
+        """Drop entries that matched any of ``product_ids`` or extracted any of ``tokens``."""
+        ids = set(product_ids)
+        token_set = {t.lower() for t in tokens}
+        with self._lock:
+            stale = [
+                key for key, entry in self._entries.items()
+                if ids.intersection(entry.product_ids) or token_set.intersection(entry.tokens)
+            ]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+cache = RecognitionCache()
@@ -1,6 +1,6 @@
-from typing import List, Optional
+from typing import Dict, List, Optional, Union
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import date, datetime
 
 # User Schemas
 class UserBase(BaseModel):
@@ -30,10 +30,58 @@ class ProductCreate(ProductBase):
 
 class Product(ProductBase):
     id: int
+    category_id: Optional[int] = None
+    codes: List[str] = []
 
     class Config:
         orm_mode = True
 
+class Category(BaseModel):
+    id: int
+    name: str
+    product_count: int
+    stock_value: float
+
+    class Config:
+        orm_mode = True
+
+class ProductCodeLookup(BaseModel):
+    codes: List[str]
+
+class ProductCodeMatches(BaseModel):
+    products: Dict[str, Product]  # by scanned code
+    missing: List[str]
+
+class ProductSearchResult(BaseModel):
+    products: List[Product]
+    mode: str  # "prefix", or "fuzzy" when nothing matched as typed
+    has_more: bool
+
+class ProductChanges(BaseModel):
+    version: int
+    products: List[Product]
+    deleted_products: List[int]
+    deleted_categories: List[str]
+    has_more: bool
+    cursor: Optional[str] = None
+
+
+def product_dict(product, stock: Optional[int] = None, codes: Optional[List[str]] = None) -> dict:
+    """Plain-dict form of Product, for responses built outside response_model.
+
+    Reads ``product.codes`` unless ``codes`` is given, so load code_rows up front.
+    """
+    return {
+        "id": product.id,
+        "name": product.name,
+        "price": product.price,
+        "stock": product.stock if stock is None else stock,
+        "image_url": product.image_url,
+        "category": product.category,
+        "category_id": product.category_id,
+        "codes": product.codes if codes is None else codes,
+    }
+
 
 class Store(BaseModel):
     id: int
@@ -43,6 +91,24 @@ class Store(BaseModel):
     class Config:
         orm_mode = True
 
+class ImportJob(BaseModel):
+    id: str
+    filename: Optional[str] = None
+    status: str
+    rows_processed: int
+    created: int
+    updated: int
+    skipped: int
+    merged: int = 0
+    error_count: int
+    message: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
 # Billing Schemas
 class BillItemBase(BaseModel):
     product_id: int
@@ -65,11 +131,49 @@ class Bill(BaseModel):
     created_at: datetime
     total_amount: float
     payment_method: str
+    idempotency_key: Optional[str] = None
     items: List[BillItem]
 
     class Config:
         orm_mode = True
 
+class BillSyncItem(BillCreate):
+    idempotency_key: str
+    created_at: Optional[datetime] = None  # when the terminal rang it up; defaults to sync time
+
+class BillSyncRequest(BaseModel):
+    bills: List[BillSyncItem]
+
+class BillSyncResult(BaseModel):
+    idempotency_key: str
+    status: str  # created, duplicate, error
+    bill_id: Optional[int] = None
+    error: Optional[str] = None
+
+class BillSyncResponse(BaseModel):
+    results: List[BillSyncResult]
+
+class PaymentMethodSales(BaseModel):
+    revenue: float
+    bill_count: int
+
+class RevenuePoint(BaseModel):
+    bucket: Union[datetime, date]
+    revenue: float
+    bill_count: int
+    payment_methods: Dict[str, PaymentMethodSales]
+
+class ProductSales(BaseModel):
+    product_id: int
+    name: Optional[str] = None  # None once the product is deleted
+    units: int
+    revenue: float
+
+class CategorySales(BaseModel):
+    category: Optional[str] = None
+    units: int
+    revenue: float
+
 # Token Schema
 class Token(BaseModel):
     access_token: str
@@ -77,6 +181,8 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+    user_id: Optional[int] = None
+    role: Optional[str] = None
 
 class UserRegister(BaseModel):
     username: str
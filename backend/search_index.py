@@ -0,0 +1,198 @@
+"""In-memory inverted index used to match OCR text against the product catalog.
+
+Products are indexed by their normalized name/category tokens and by character
+trigrams of those tokens, so lookups touch only the posting lists of the query
+terms instead of scanning the products table with leading-wildcard LIKEs.
+
+The index lives in the API process. It is built at startup and kept current by
+the product write paths in main.py (create, update, delete, category delete and
+bulk upload) via ``upsert``/``remove``; writes made by other worker processes
+reach it through ``product_cache.sync`` (see ``apply_catalog_changes`` in main.py).
+"""
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import models
+
+NAME_WEIGHT = 3.0
+CATEGORY_WEIGHT = 1.5
+NGRAM_WEIGHT = 2.0
+NGRAM_MIN_SIM = 0.5  # share of a query token's trigrams a product must contain
+FUZZY_MIN_SCORE = 0.1
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def extract_tokens(text: Optional[str]) -> Set[str]:
+    """Word-like tokens from OCR output, lowercased, with single characters dropped as noise."""
+    text = text or ""
+    word_tokens = re.findall(r"[A-Za-z0-9]{2,}", text)
+    split_tokens = [t for t in re.split(r"[\s,;\n]+", text) if t and t.strip()]
+    return {
+        t.lower()
+        for t in word_tokens + split_tokens
+        if t and len(t) >= 2 and re.search(r"[A-Za-z0-9]", t)
+    }
+
+
+def trigrams(token: str, pad: bool = True) -> Set[str]:
+    if pad:
+        token = f"  {token} "
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class ProductIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._name_tokens: Dict[str, Set[int]] = defaultdict(set)
+        self._category_tokens: Dict[str, Set[int]] = defaultdict(set)
+        self._grams: Dict[str, Set[int]] = defaultdict(set)
+        # product_id -> (name tokens, category tokens, trigrams, raw category)
+        self._docs: Dict[int, Tuple[Set[str], Set[str], Set[str], Optional[str]]] = {}
+        self.ready = False
+
+    def __len__(self):
+        return len(self._docs)
+
+    def build(self, rows: Iterable[Tuple[int, str, Optional[str]]]):
+        """Replace the index contents with ``(id, name, category)`` rows."""
+        with self._lock:
+            self._name_tokens.clear()
+            self._category_tokens.clear()
+            self._grams.clear()
+            self._docs.clear()
+            for product_id, name, category in rows:
+                self._add(product_id, name, category)
+            self.ready = True
+
+    def upsert(self, product_id: int, name: str, category: Optional[str]):
+        with self._lock:
+            self._remove(product_id)
+            self._add(product_id, name, category)
+
+    def remove(self, product_id: int):
+        with self._lock:
+            self._remove(product_id)
+
+    def clear_category(self, category: str) -> List[int]:
+        """Mirror ``UPDATE products SET category = NULL WHERE category = :category``; returns affected ids."""
+        cleared = []
+        with self._lock:
+            for product_id, doc in list(self._docs.items()):
+                if doc[3] == category:
+                    name_tokens = doc[0]
+                    self._remove(product_id)
+                    self._add(product_id, " ".join(name_tokens), None)
+                    cleared.append(product_id)
+        return cleared
+
+    def is_current(self, product_id: int, name: str, category: Optional[str]) -> bool:
+        """Whether the product is indexed with this name and category (a stock-only change needs nothing)."""
+        doc = self._docs.get(product_id)
+        return doc is not None and doc[0] == set(tokenize(name)) and doc[3] == category
+
+    def category_of(self, product_id: int) -> Optional[str]:
+        doc = self._docs.get(product_id)
+        return doc[3] if doc else None
+
+    def _add(self, product_id: int, name: str, category: Optional[str]):
+        name_tokens = set(tokenize(name))
+        category_tokens = set(tokenize(category))
+        grams: Set[str] = set()
+        for token in name_tokens | category_tokens:
+            grams |= trigrams(token)
+        for token in name_tokens:
+            self._name_tokens[token].add(product_id)
+        for token in category_tokens:
+            self._category_tokens[token].add(product_id)
+        for gram in grams:
+            self._grams[gram].add(product_id)
+        self._docs[product_id] = (name_tokens, category_tokens, grams, category)
+
+    def _remove(self, product_id: int):
+        doc = self._docs.pop(product_id, None)
+        if doc is None:
+            return
+        name_tokens, category_tokens, grams, _ = doc
+        for postings, keys in ((self._name_tokens, name_tokens), (self._category_tokens, category_tokens), (self._grams, grams)):
+            for key in keys:
+                ids = postings.get(key)
+                if ids is not None:
+                    ids.discard(product_id)
+                    if not ids:
+                        del postings[key]
+
+    def search(self, tokens: Iterable[str], limit: int = 10) -> List[Tuple[int, float]]:
+        """Rank products for a bag of OCR tokens: exact token hits first, then trigram overlap."""
+        scores: Dict[int, float] = defaultdict(float)
+        with self._lock:
+            for raw in tokens:
+                for token in tokenize(raw):
+                    if len(token) < 2:
+                        continue
+                    for product_id in self._name_tokens.get(token, ()):
+                        scores[product_id] += NAME_WEIGHT
+                    for product_id in self._category_tokens.get(token, ()):
+                        scores[product_id] += CATEGORY_WEIGHT
+                    if len(token) < 3:
+                        continue
+                    # Substring / typo tolerance: unpadded query grams must mostly appear in the product
+                    query_grams = trigrams(token, pad=False)
+                    overlap: Dict[int, int] = defaultdict(int)
+                    for gram in query_grams:
+                        for product_id in self._grams.get(gram, ()):
+                            overlap[product_id] += 1
+                    for product_id, shared in overlap.items():
+                        sim = shared / len(query_grams)
+                        if sim >= NGRAM_MIN_SIM:
+                            scores[product_id] += NGRAM_WEIGHT * sim
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+    def match(self, tokens: Iterable[str], text: str) -> Tuple[List[Tuple[int, float]], bool]:
+        """Token search, falling back to whole-text fuzzy matching; returns (ranked, used_fuzzy)."""
+        ranked = self.search(tokens, limit=10)
+        if ranked:
+            return ranked, False
+        return self.fuzzy(text or "", limit=5), True
+
+    def fuzzy(self, text: str, limit: int = 5) -> List[Tuple[int, float]]:
+        """Whole-text similarity (Dice coefficient over trigrams) for when no token matched."""
+        query_grams: Set[str] = set()
+        for token in tokenize(text):
+            query_grams |= trigrams(token)
+        if not query_grams:
+            return []
+        shared: Dict[int, int] = defaultdict(int)
+        with self._lock:
+            for gram in query_grams:
+                for product_id in self._grams.get(gram, ()):
+                    shared[product_id] += 1
+            scored = [
+                (product_id, 2.0 * count / (len(query_grams) + len(self._docs[product_id][2])))
+                for product_id, count in shared.items()
+            ]
+        scored = [item for item in scored if item[1] >= FUZZY_MIN_SCORE]
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored[:limit]
+
+
+index = ProductIndex()
+
+
+def ensure_built(db):
+    """Build the index from the database on first use."""
+    if index.ready:
+        return
+    rebuild(db)
+
+
+def rebuild(db):
+    rows = db.query(models.Product.id, models.Product.name, models.Product.category).all()
+    index.build(rows)
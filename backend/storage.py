@@ -1,84 +1,223 @@
-import boto3
+"""Object storage for uploaded images (product photos, store logos).
+
+The backend is chosen once, when the app starts (``init`` in the lifespan):
+STORAGE_BACKEND=s3 or local, or auto (the default), which uses S3 when the
+R2_* credentials are set and files under uploads/ otherwise. R2_ENDPOINT_URL
+can point at any S3-compatible server: Cloudflare R2, MinIO, or
+``moto_server`` for local testing.
+
+The S3 client is built once and shared by every upload (boto3 clients are
+thread-safe and keep their own connection pool), with botocore's retries and
+timeouts taken from STORAGE_RETRIES / STORAGE_CONNECT_TIMEOUT /
+STORAGE_READ_TIMEOUT. Its blocking calls, like local file writes, run on a
+small bounded thread pool instead of the event loop: STORAGE_WORKERS uploads
+at a time, at most STORAGE_MAX_QUEUE more waiting, and anything beyond that
+gets StorageBusy (the API answers 503 + Retry-After).
+"""
+import asyncio
+import logging
 import os
-from botocore.exceptions import NoCredentialsError
-from fastapi import UploadFile
+import shutil
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Optional
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from fastapi import UploadFile
+
+logger = logging.getLogger("dbiller.storage")
 
 # R2 Configuration
 R2_ENDPOINT_URL = os.getenv("R2_ENDPOINT_URL")
 R2_ACCESS_KEY_ID = os.getenv("R2_ACCESS_KEY_ID")
 R2_SECRET_ACCESS_KEY = os.getenv("R2_SECRET_ACCESS_KEY")
 R2_BUCKET_NAME = os.getenv("R2_BUCKET_NAME", "dbiller-images")
+R2_PUBLIC_URL_BASE = os.getenv("R2_PUBLIC_URL_BASE", "").rstrip("/")  # e.g. https://pub-xyz.r2.dev
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:8001")
 
-def get_s3_client():
-    if not R2_ENDPOINT_URL or not R2_ACCESS_KEY_ID or not R2_SECRET_ACCESS_KEY:
-        print("R2 Credentials not set. Falling back to local storage.")
-        return None
-        
-    return boto3.client(
-        's3',
-        endpoint_url=R2_ENDPOINT_URL,
-        aws_access_key_id=R2_ACCESS_KEY_ID,
-        aws_secret_access_key=R2_SECRET_ACCESS_KEY
-    )
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "auto").lower()  # auto | s3 | local
+LOCAL_UPLOAD_DIR = "uploads"
 
-async def upload_file_to_r2(file: UploadFile, folder: str = "products") -> str:
-    s3 = get_s3_client()
-    # Enable reading file content
-    file_content = await file.read()
-    
-    # Generate unique filename
-    file_extension = file.filename.split(".")[-1]
-    filename = f"{folder}/{uuid.uuid4()}.{file_extension}"
+STORAGE_WORKERS = max(1, int(os.getenv("STORAGE_WORKERS", "4")))
+STORAGE_MAX_QUEUE = max(0, int(os.getenv("STORAGE_MAX_QUEUE", "16")))
+STORAGE_TIMEOUT = float(os.getenv("STORAGE_TIMEOUT", "60"))  # whole upload, retries included
+STORAGE_CONNECT_TIMEOUT = float(os.getenv("STORAGE_CONNECT_TIMEOUT", "5"))
+STORAGE_READ_TIMEOUT = float(os.getenv("STORAGE_READ_TIMEOUT", "30"))
+STORAGE_RETRIES = max(1, int(os.getenv("STORAGE_RETRIES", "3")))  # attempts per request
 
-    def _save_locally() -> str:
-        os.makedirs("uploads", exist_ok=True)
-        local_path = os.path.join("uploads", filename)
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
-        with open(local_path, "wb") as f:
-            f.write(file_content)
-        print(f"[upload_debug] saved local file at {local_path} ({len(file_content)} bytes)")
-        # Return relative URL so frontend can resolve it against its own API base
-        return f"/uploads/{filename}"
+COPY_CHUNK = 1024 * 1024
 
-    # Local fallback
-    if not s3:
-        return _save_locally()
 
-    try:
-        s3.put_object(
-            Bucket=R2_BUCKET_NAME,
-            Key=filename,
-            Body=file_content,
-            ContentType=file.content_type
-            # ACL='public-read' # R2 buckets are usually private or public via domain. 
-            # If public bucket, we don't need ACL usually or it's not supported identically.
+class StorageBusy(Exception):
+    """Raised when the upload pool is saturated (or an upload timed out) and the request should be retried later."""
+
+
+class LocalBackend:
+    """Files under LOCAL_UPLOAD_DIR, served by the app at /uploads."""
+
+    name = "local"
+
+    def __init__(self, root: str = LOCAL_UPLOAD_DIR):
+        self.root = root
+
+    def put(self, key: str, fileobj: BinaryIO, content_type: Optional[str] = None) -> str:
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as out:
+            shutil.copyfileobj(fileobj, out, COPY_CHUNK)
+        # Relative URL so the frontend can resolve it against its own API base
+        return f"/uploads/{key}"
+
+    def describe(self) -> str:
+        return f"local ({os.path.abspath(self.root)})"
+
+
+class _KeepOpen:
+    """File proxy whose close() is a no-op: the transfer manager closes what it uploads,
+    but the caller still needs the file (to fall back, or to close it itself)."""
+
+    def __init__(self, fileobj: BinaryIO):
+        self._fileobj = fileobj
+
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
+
+    def close(self):
+        pass
+
+
+class S3Backend:
+    """An S3-compatible bucket through one long-lived boto3 client."""
+
+    name = "s3"
+
+    def __init__(self, bucket: str = R2_BUCKET_NAME, endpoint_url: Optional[str] = R2_ENDPOINT_URL,
+                 access_key_id: Optional[str] = R2_ACCESS_KEY_ID, secret_access_key: Optional[str] = R2_SECRET_ACCESS_KEY,
+                 public_url_base: str = R2_PUBLIC_URL_BASE, workers: int = STORAGE_WORKERS):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.public_url_base = public_url_base
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            config=Config(
+                max_pool_connections=workers,
+                connect_timeout=STORAGE_CONNECT_TIMEOUT,
+                read_timeout=STORAGE_READ_TIMEOUT,
+                retries={"max_attempts": STORAGE_RETRIES, "mode": "standard"},
+            ),
         )
-        
-        # Reset file pointer if needed downstream? Usually not if we consumed it.
-        # But we return the URL.
-        
-        # Assuming R2 bucket is connected to a public domain or we construct the R2 dev URL
-        # For pure R2, URL is often: https://<account>.r2.cloudflarestorage.com/<bucket>/<key>
-        # Or better: https://custom.domain.com/<key>
-        # We will return a constructable URL or just the Key if user configures a public domain.
-        # For now, let's assume a public domain variable or return the direct R2 URL format 
-        # (which requires auth usually unless public access is on). 
-        # User didn't specify public domain, so we'll assume standard public access enabled on bucket.
-        
-        # We will rely on user setting a PUBLIC_URL_BASE env var, or return a placeholder relative path.
-        # Let's return the full URL if we can guess it, otherwise just the key.
-        
-        # Best practice for R2: If pub access enabled (dev mode), use the R2.dev subdomain if enabled or custom domain.
-        # I'll use a placeholder variable for the base URL.
-        
-        public_url_base = os.getenv("R2_PUBLIC_URL_BASE", "") # e.g., https://pub-xyz.r2.dev
-        if public_url_base:
-            return f"{public_url_base}/{filename}"
-        
-        return filename 
-        
+        # Parts go up one after another on the calling pool thread, not on extra transfer threads
+        self.transfer_config = TransferConfig(use_threads=False)
+
+    def put(self, key: str, fileobj: BinaryIO, content_type: Optional[str] = None) -> str:
+        extra = {"ContentType": content_type} if content_type else None
+        self.client.upload_fileobj(_KeepOpen(fileobj), self.bucket, key, ExtraArgs=extra, Config=self.transfer_config)
+        # Without a public domain configured, hand back the key
+        return f"{self.public_url_base}/{key}" if self.public_url_base else key
+
+    def describe(self) -> str:
+        return f"s3 (bucket {self.bucket} at {self.endpoint_url or 'AWS'})"
+
+
+def select_backend():
+    """The backend STORAGE_BACKEND and the R2_* settings ask for."""
+    if STORAGE_BACKEND not in ("auto", "s3", "local"):
+        raise ValueError(f"STORAGE_BACKEND must be auto, s3 or local, not {STORAGE_BACKEND!r}")
+    if STORAGE_BACKEND == "s3":
+        return S3Backend()  # missing R2_* values fall back to boto3's own credential lookup
+    if STORAGE_BACKEND == "auto" and R2_ENDPOINT_URL and R2_ACCESS_KEY_ID and R2_SECRET_ACCESS_KEY:
+        return S3Backend()
+    return LocalBackend()
+
+
+class UploadPool:
+    """Thread pool with a hard cap on in-flight + queued uploads."""
+
+    def __init__(self, workers: int = STORAGE_WORKERS, max_queue: int = STORAGE_MAX_QUEUE, timeout: float = STORAGE_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="storage")
+            return self._executor
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, *args):
+        """Await ``fn(*args)`` on the pool, raising StorageBusy instead of queueing without bound."""
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                raise StorageBusy(f"upload queue full ({self._pending} pending)")
+            self._pending += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Counted until the upload itself finishes, even if the caller stopped waiting
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise StorageBusy(f"upload timed out after {self.timeout:.0f}s")
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+pool = UploadPool()
+backend = None
+
+
+def init():
+    """Pick the backend for this process; called once at startup."""
+    global backend
+    backend = select_backend()
+    logger.info("Upload storage: %s", backend.describe())
+    return backend
+
+
+def get_backend():
+    return backend if backend is not None else init()
+
+
+def _put(target, key: str, fileobj: BinaryIO, content_type: Optional[str]) -> str:
+    try:
+        return target.put(key, fileobj, content_type)
     except Exception as e:
-        print(f"Upload Error: {e}. Falling back to local storage.")
-        return _save_locally()
+        if isinstance(target, LocalBackend):
+            raise
+        logger.warning("Upload to %s failed: %s. Falling back to local storage.", target.describe(), e)
+        fileobj.seek(0)
+        return LocalBackend().put(key, fileobj, content_type)
+
+
+async def upload_file_to_r2(file: UploadFile, folder: str = "products") -> str:
+    """Store an upload with the configured backend and return its URL (or key)."""
+    # Generate unique filename
+    file_extension = file.filename.split(".")[-1]
+    filename = f"{folder}/{uuid.uuid4()}.{file_extension}"
+    # The multipart parser already spooled the body; the pool thread reads it from there
+    file.file.seek(0)
+    return await pool.run(_put, get_backend(), filename, file.file, file.content_type)
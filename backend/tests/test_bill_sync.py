@@ -0,0 +1,62 @@
+import uuid
+
+import database
+import models
+
+
+def add_product(client, headers, stock=20):
+    response = client.post("/products/", data={"name": f"item {uuid.uuid4().hex[:8]}", "price": 5, "stock": stock}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def stock_of(client, product_id):
+    return client.get(f"/products/{product_id}").json()["stock"]
+
+
+def test_sync_is_idempotent(client, admin_headers):
+    product_id = add_product(client, admin_headers)
+    keys = [uuid.uuid4().hex for _ in range(4)]
+    bills = [
+        {"idempotency_key": keys[0], "created_at": "2026-03-01T10:00:00+05:30", "items": [{"product_id": product_id, "quantity": 2}]},
+        {"idempotency_key": keys[1], "items": [{"product_id": product_id, "quantity": 3}], "payment_method": "upi"},
+        {"idempotency_key": keys[0], "items": [{"product_id": product_id, "quantity": 9}]},  # repeated in the payload
+        {"idempotency_key": keys[2], "items": [{"product_id": 10**9, "quantity": 1}]},
+        {"idempotency_key": keys[3], "items": []},
+    ]
+
+    first = client.post("/bills/sync", json={"bills": bills}, headers=admin_headers).json()["results"]
+    assert [r["status"] for r in first] == ["created", "created", "error", "error"]
+    assert stock_of(client, product_id) == 20 - 2 - 3
+
+    again = client.post("/bills/sync", json={"bills": bills}, headers=admin_headers).json()["results"]
+    assert [r["status"] for r in again] == ["duplicate", "duplicate", "error", "error"]
+    assert [r["bill_id"] for r in again[:2]] == [r["bill_id"] for r in first[:2]]
+    assert stock_of(client, product_id) == 15
+
+    db = database.SessionLocal()
+    try:
+        offline = db.get(models.Bill, first[0]["bill_id"])
+        assert offline.created_at.isoformat() == "2026-03-01T04:30:00"  # stored as naive UTC
+        assert offline.total_amount == 10
+        assert db.get(models.Bill, first[1]["bill_id"]).payment_method == "upi"
+    finally:
+        db.close()
+
+
+def test_create_bill_replays_an_idempotency_key(client, admin_headers):
+    product_id = add_product(client, admin_headers)
+    headers = {**admin_headers, "Idempotency-Key": uuid.uuid4().hex}
+    bill = {"items": [{"product_id": product_id, "quantity": 4}]}
+
+    first = client.post("/bills/", json=bill, headers=headers)
+    replay = client.post("/bills/", json=bill, headers=headers)
+    assert first.status_code == replay.status_code == 200
+    assert replay.headers.get("X-Idempotent-Replay") == "true"
+    assert replay.json()["id"] == first.json()["id"]
+    assert stock_of(client, product_id) == 16
+
+    synced = client.post(
+        "/bills/sync", json={"bills": [{"idempotency_key": headers["Idempotency-Key"], **bill}]}, headers=admin_headers
+    ).json()["results"]
+    assert synced == [{"idempotency_key": headers["Idempotency-Key"], "status": "duplicate", "bill_id": first.json()["id"], "error": None}]
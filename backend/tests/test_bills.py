@@ -0,0 +1,45 @@
+import datetime
+import uuid
+
+
+def add_product(client, headers):
+    response = client.post(
+        "/products/", data={"name": f"item {uuid.uuid4().hex[:8]}", "price": 3, "stock": 100, "codes": uuid.uuid4().hex[:10]},
+        headers=headers,
+    )
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def test_bill_history_pages_take_four_queries(client, admin_headers):
+    product_ids = [add_product(client, admin_headers) for _ in range(3)]
+    started = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+    for i in range(6):
+        lines = [{"product_id": pid, "quantity": 1} for pid in product_ids[: i % 3 + 1]]
+        assert client.post("/bills/", json={"items": lines}, headers=admin_headers).status_code == 200
+
+    # Only this test's bills, whatever else the database holds
+    window = {"start": started.isoformat(), "end": (datetime.datetime.utcnow() + datetime.timedelta(seconds=1)).isoformat()}
+    first = client.get("/bills/", params={"limit": 2, **window}, headers=admin_headers)
+    second = client.get(
+        "/bills/", params={"limit": 4, "cursor": first.headers["X-Next-Cursor"], **window}, headers=admin_headers
+    )
+    for page in (first, second):
+        assert page.status_code == 200
+        assert page.headers["X-Query-Count"] == "4"  # bills, items, products, codes
+        assert all(item["product"]["codes"] for bill in page.json() for item in bill["items"])
+    first_ids = [bill["id"] for bill in first.json()]
+    assert first_ids == sorted(first_ids, reverse=True)
+    assert len(set(first_ids) | {bill["id"] for bill in second.json()}) == 6
+
+
+def test_skip_and_cursor_together_are_rejected(client, admin_headers):
+    product_id = add_product(client, admin_headers)
+    for _ in range(2):
+        client.post("/bills/", json={"items": [{"product_id": product_id, "quantity": 1}]}, headers=admin_headers)
+    cursor = client.get("/bills/", params={"limit": 1}, headers=admin_headers).headers["X-Next-Cursor"]
+
+    response = client.get("/bills/", params={"skip": 1, "cursor": cursor}, headers=admin_headers)
+    assert response.status_code == 400
+    skipped = client.get("/bills/", params={"skip": 1, "limit": 1}, headers=admin_headers).json()
+    assert skipped == client.get("/bills/", params={"cursor": cursor, "limit": 1}, headers=admin_headers).json()
@@ -0,0 +1,69 @@
+import uuid
+
+
+def add_product(client, headers, category=None):
+    data = {"name": f"item {uuid.uuid4().hex[:8]}", "price": 5, "stock": 10}
+    if category:
+        data["category"] = category
+    response = client.post("/products/", data=data, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def catalog_version(client):
+    return client.get("/products/changes", params={"since": 0, "limit": 1}).json()["version"]
+
+
+def test_changes_since_a_version_include_tombstones(client, admin_headers):
+    since = catalog_version(client)
+    category = f"cat {uuid.uuid4().hex[:8]}"
+    kept, gone, renamed = (add_product(client, admin_headers, category) for _ in range(3))
+    updated = client.put(f"/products/{renamed}", data={"name": "renamed", "price": 6, "category": category}, headers=admin_headers)
+    assert updated.status_code == 200, updated.text
+    assert client.delete(f"/products/{gone}", headers=admin_headers).status_code == 200
+    assert client.delete(f"/categories/{category}", headers=admin_headers).json() == {"cleared": 2}
+
+    changes = client.get("/products/changes", params={"since": since}).json()
+    assert changes["version"] == catalog_version(client)
+    assert not changes["has_more"] and changes["cursor"] is None
+    assert sorted(p["id"] for p in changes["products"]) == sorted([kept, renamed])
+    assert all(p["category"] is None for p in changes["products"])
+    assert {p["id"]: p["name"] for p in changes["products"]}[renamed] == "renamed"
+    assert changes["deleted_products"] == [gone]
+    assert changes["deleted_categories"] == [category]
+
+    caught_up = client.get("/products/changes", params={"since": changes["version"]}).json()
+    assert caught_up["products"] == caught_up["deleted_products"] == caught_up["deleted_categories"] == []
+
+
+def test_changes_page_with_a_cursor(client, admin_headers):
+    since = catalog_version(client)
+    product_ids = [add_product(client, admin_headers) for _ in range(5)]
+    deleted = add_product(client, admin_headers)
+    client.delete(f"/products/{deleted}", headers=admin_headers)
+
+    pages = [client.get("/products/changes", params={"since": since, "limit": 2}).json()]
+    while pages[-1]["has_more"]:
+        pages.append(client.get("/products/changes", params={"since": since, "limit": 2, "cursor": pages[-1]["cursor"]}).json())
+        assert pages[-1]["deleted_products"] == []  # tombstones come with the first page only
+    assert [p["id"] for page in pages for p in page["products"]] == product_ids
+    assert pages[0]["deleted_products"] == [deleted]
+    assert len({page["version"] for page in pages}) == 1
+
+    assert client.get("/products/changes", params={"since": since, "cursor": "nonsense"}).status_code == 400
+
+
+def test_unchanged_catalog_answers_304(client, admin_headers):
+    since = catalog_version(client)
+    first = client.get("/products/changes", params={"since": since})
+    assert first.status_code == 200
+    repeat = client.get("/products/changes", params={"since": since}, headers={"If-None-Match": first.headers["ETag"]})
+    assert repeat.status_code == 304 and repeat.content == b""
+
+    page = client.get("/products/", params={"limit": 1})
+    assert client.get("/products/", params={"limit": 1}, headers={"If-None-Match": page.headers["ETag"]}).status_code == 304
+
+    add_product(client, admin_headers)
+    changed = client.get("/products/changes", params={"since": since}, headers={"If-None-Match": first.headers["ETag"]})
+    assert changed.status_code == 200 and changed.headers["ETag"] != first.headers["ETag"]
+    assert client.get("/products/", params={"limit": 1}, headers={"If-None-Match": page.headers["ETag"]}).status_code == 200
@@ -0,0 +1,75 @@
+import uuid
+
+import pytest
+from sqlalchemy import func
+
+import billing
+import categories
+import database
+import inventory
+import models
+
+
+def category_stats(name):
+    """(stored product_count, stored stock_value, recomputed stock_value) for one category."""
+    db = database.SessionLocal()
+    try:
+        category = db.query(models.Category).filter(models.Category.name == name).one()
+        actual = db.query(func.coalesce(func.sum(models.Product.price * models.Product.stock), 0.0)) \
+            .filter(models.Product.category_id == category.id).scalar()
+        return category.product_count, category.stock_value, actual
+    finally:
+        db.close()
+
+
+def add_products(client, headers, category, specs):
+    ids = []
+    for price, stock in specs:
+        response = client.post(
+            "/products/",
+            data={"name": f"item {uuid.uuid4().hex[:8]}", "price": price, "stock": stock, "category": category},
+            headers=headers,
+        )
+        assert response.status_code == 200, response.text
+        ids.append(response.json()["id"])
+    return ids
+
+
+def test_checkouts_keep_stock_value(client, admin_headers):
+    category = f"cat-{uuid.uuid4().hex[:8]}"
+    ids = add_products(client, admin_headers, category, [(2.5, 10), (4.0, 3), (1.25, 50)])
+    assert category_stats(category)[1:] == (pytest.approx(25 + 12 + 62.5),) * 2
+
+    response = client.post("/bills/", json={"items": [{"product_id": ids[0], "quantity": 4}, {"product_id": ids[2], "quantity": 6}]},
+                           headers=admin_headers)
+    assert response.status_code == 200, response.text
+    bills = [
+        {"idempotency_key": uuid.uuid4().hex, "items": [{"product_id": ids[1], "quantity": 5}, {"product_id": ids[0], "quantity": 1}]},
+        {"idempotency_key": uuid.uuid4().hex, "items": [{"product_id": ids[2], "quantity": 2}]},
+    ]
+    response = client.post("/bills/sync", json={"bills": bills}, headers=admin_headers)
+    assert [r["status"] for r in response.json()["results"]] == ["created", "created"]
+
+    count, stored, actual = category_stats(category)
+    assert count == 3
+    # 4.0 * 3 - 5 sells into negative stock under the default "allow" policy
+    assert stored == pytest.approx(actual) == pytest.approx(2.5 * 5 + 4.0 * -2 + 1.25 * 42)
+
+
+def test_clamped_sale_keeps_stock_value(client, admin_headers):
+    category = f"cat-{uuid.uuid4().hex[:8]}"
+    ids = add_products(client, admin_headers, category, [(3.0, 2), (5.0, 10)])
+
+    db = database.SessionLocal()
+    try:
+        quantities = {ids[0]: 7, ids[1]: 4}  # the first line runs out and is clamped to 0
+        products, new_stock, removed = inventory.reserve_stock(db, quantities, policy="clamp")
+        assert new_stock == {ids[0]: 0, ids[1]: 6}
+        billing.insert_bills(db, [billing.BillDraft(quantities.items())], products, new_stock)
+        categories.record_sale(db, products, removed)
+        db.commit()
+    finally:
+        db.close()
+
+    _, stored, actual = category_stats(category)
+    assert stored == pytest.approx(actual) == pytest.approx(5.0 * 6)
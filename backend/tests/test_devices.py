@@ -0,0 +1,49 @@
+import threading
+import uuid
+
+import database
+import devices
+import models
+from conftest import make_user, user_id_of
+
+
+def test_concurrent_new_devices_respect_the_limit():
+    user_id = user_id_of(make_user())
+    threads_count, limit = 12, 2
+    start = threading.Barrier(threads_count)
+    results, errors = [], []
+
+    def login(device_id):
+        db = database.SessionLocal()
+        try:
+            start.wait()
+            results.append(devices.register(db, user_id, device_id, limit=limit))
+        except Exception as e:  # surfaced below; a thread can't fail the test itself
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=login, args=(f"device-{uuid.uuid4().hex[:8]}",)) for _ in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert results.count(True) == limit
+    db = database.SessionLocal()
+    try:
+        assert db.query(models.UserDevice).filter(models.UserDevice.user_id == user_id).count() == limit
+    finally:
+        db.close()
+
+
+def test_known_device_logs_in_past_the_limit():
+    user_id = user_id_of(make_user())
+    db = database.SessionLocal()
+    try:
+        assert devices.register(db, user_id, "till-1", limit=1)
+        assert not devices.register(db, user_id, "till-2", limit=1)
+        assert devices.register(db, user_id, "till-1", limit=1)
+    finally:
+        db.close()
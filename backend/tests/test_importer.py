@@ -0,0 +1,57 @@
+import csv
+import io
+import time
+import uuid
+
+
+def upload(client, headers, text, **params):
+    files = {"file": ("prices.csv", text.encode(), "text/csv")}
+    return client.post("/products/bulk_upload", files=files, params=params, headers=headers)
+
+
+def products_named(client, names):
+    found = {}
+    for name in names:
+        results = client.get("/products/search", params={"q": name}).json()["products"]
+        found.update((p["name"], p) for p in results if p["name"] == name)
+    return found
+
+
+def test_import_counts_and_duplicate_names(client, admin_headers):
+    tag = uuid.uuid4().hex[:8]
+    a, b = f"Atta {tag}", f"Bread {tag}"
+    text = f"name,price,stock\n{a},1,1\n{b},2,2\n{a},3,5\n,4,4\n"
+
+    response = upload(client, admin_headers, text)
+    assert response.status_code == 200, response.text
+    result = response.json()
+    assert (result["created"], result["updated"], result["skipped"], result["merged"]) == (2, 0, 1, 1)
+    assert any("Row 1: same name as row 3" in error for error in result["errors"])
+    found = products_named(client, {a, b})
+    assert (found[a]["price"], found[a]["stock"]) == (3.0, 5)  # the later row wins
+
+    job = client.get(f"/products/import/{result['job_id']}", headers=admin_headers).json()
+    assert job["status"] == "done"
+    assert (job["rows_processed"], job["merged"], job["error_count"]) == (4, 1, 2)
+    report = client.get(f"/products/import/{result['job_id']}/errors", headers=admin_headers).text
+    assert sorted(row["row"] for row in csv.DictReader(io.StringIO(report))) == ["1", "4"]
+
+    again = upload(client, admin_headers, f"name,price,stock\n{a},7,1\n{b},8,1\n").json()
+    assert (again["created"], again["updated"], again["merged"]) == (0, 2, 0)
+    assert products_named(client, {a})[a]["price"] == 7.0
+
+
+def test_background_import_reports_progress(client, admin_headers):
+    tag = uuid.uuid4().hex[:8]
+    text = "name,price,stock\n" + "".join(f"Item {tag} {i},1,1\n" for i in range(5))
+
+    response = upload(client, admin_headers, text, background="true")
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    for _ in range(100):
+        job = client.get(f"/products/import/{job_id}", headers=admin_headers).json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "done"
+    assert (job["created"], job["updated"], job["skipped"], job["merged"]) == (5, 0, 0, 0)
@@ -0,0 +1,90 @@
+import threading
+import uuid
+
+import pytest
+
+import database
+import inventory
+import models
+
+THREADS = 8
+SALES_PER_THREAD = 5
+
+
+def new_product(stock: int) -> int:
+    db = database.SessionLocal()
+    try:
+        product = models.Product(name=f"item {uuid.uuid4().hex[:8]}", price=1, stock=stock)
+        db.add(product)
+        db.commit()
+        return product.id
+    finally:
+        db.close()
+
+
+def stock_of(product_id: int) -> int:
+    db = database.SessionLocal()
+    try:
+        return db.get(models.Product, product_id).stock
+    finally:
+        db.close()
+
+
+def sell_concurrently(product_id: int, policy: str):
+    """THREADS terminals each selling one unit SALES_PER_THREAD times; returns (sold, refused)."""
+    start = threading.Barrier(THREADS)
+    sold, refused, errors = [], [], []
+
+    def terminal():
+        db = database.SessionLocal()
+        try:
+            start.wait()
+            for _ in range(SALES_PER_THREAD):
+                try:
+                    inventory.reserve_stock(db, {product_id: 1}, policy=policy)
+                    db.commit()
+                    sold.append(1)
+                except inventory.InsufficientStock:
+                    db.rollback()
+                    refused.append(1)
+        except Exception as e:  # surfaced below; a thread can't fail the test itself
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=terminal) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    return len(sold), len(refused)
+
+
+@pytest.mark.parametrize("policy, start, final", [
+    ("allow", 10, 10 - THREADS * SALES_PER_THREAD),
+    ("clamp", 10, 0),
+    ("reject", 10, 0),
+    ("reject", 100, 100 - THREADS * SALES_PER_THREAD),
+])
+def test_concurrent_sales_lose_no_updates(policy, start, final):
+    product_id = new_product(start)
+    sold, refused = sell_concurrently(product_id, policy)
+    assert stock_of(product_id) == final
+    if policy == "reject":
+        assert sold == start - final and refused == THREADS * SALES_PER_THREAD - sold
+    else:
+        assert sold == THREADS * SALES_PER_THREAD and refused == 0
+
+
+def test_reject_refuses_the_whole_bill():
+    plenty, scarce = new_product(10), new_product(1)
+    db = database.SessionLocal()
+    try:
+        with pytest.raises(inventory.InsufficientStock) as raised:
+            inventory.reserve_stock(db, {plenty: 2, scarce: 3}, policy="reject")
+        db.rollback()
+    finally:
+        db.close()
+    assert raised.value.shortages == {scarce: (3, 1)}
+    assert (stock_of(plenty), stock_of(scarce)) == (10, 1)
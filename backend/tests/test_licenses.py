@@ -0,0 +1,54 @@
+import csv
+import io
+import uuid
+
+import database
+import licenses
+
+
+def register(client, key):
+    return client.post(
+        "/register",
+        data={"username": f"shop-{uuid.uuid4().hex[:8]}", "password": "pw", "device_id": uuid.uuid4().hex, "license_key": key},
+    )
+
+
+def test_batch_issue_claim_and_revoke(client, monkeypatch):
+    monkeypatch.setattr(licenses, "LICENSE_INSERT_CHUNK", 2)  # spread the batch over two INSERTs
+    batch = f"reseller-{uuid.uuid4().hex[:8]}"
+    db = database.SessionLocal()
+    try:
+        keys = licenses.generate(db, 3, batch)
+        assert len(set(keys)) == 3
+        assert licenses.counts(db, batch) == {"unused": 3, "used": 0, "revoked": 0, "total": 3}
+
+        assert register(client, keys[0]).status_code == 200
+        reused = register(client, keys[0])
+        assert reused.status_code == 400 and reused.json()["detail"] == "Invalid or used License Key"
+
+        db.rollback()  # see the registration's commit
+        assert licenses.revoke(db, [keys[1]]) == 1
+        assert licenses.revoke(db, batch=batch) == 1  # the used and the already revoked key are left alone
+        assert register(client, keys[2]).status_code == 400
+        assert licenses.counts(db, batch) == {"unused": 0, "used": 1, "revoked": 2, "total": 3}
+
+        out = io.StringIO()
+        assert licenses.export(db, out, batch, "revoked") == 2
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        assert sorted(row["key"] for row in rows) == sorted(keys[1:])
+        assert {row["status"] for row in rows} == {"revoked"}
+    finally:
+        db.close()
+
+
+def test_claim_is_single_use(client):
+    db = database.SessionLocal()
+    try:
+        [key] = licenses.generate(db, 1)
+        user_id = register(client, licenses.generate(db, 1)[0]).json()["id"]
+        assert licenses.claim(db, key, user_id)
+        assert not licenses.claim(db, key, user_id)
+        assert not licenses.claim(db, "no-such-key", user_id)
+        db.rollback()
+    finally:
+        db.close()
@@ -0,0 +1,18 @@
+import pytest
+
+import ocr_engine
+
+
+def test_engine_without_recognize_fails_when_built():
+    class Unfinished(ocr_engine.OCREngine):
+        name = "unfinished"
+
+    with pytest.raises(TypeError):
+        Unfinished()
+
+
+def test_parse_config():
+    assert ocr_engine.parse_config("--oem 1 --psm 6 -c tessedit_char_whitelist=ABC -c preserve_interword_spaces=1") == (
+        6, 1, {"tessedit_char_whitelist": "ABC", "preserve_interword_spaces": "1"},
+    )
+    assert ocr_engine.parse_config("") == (None, None, {})
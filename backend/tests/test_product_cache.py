@@ -0,0 +1,71 @@
+import threading
+import time
+import uuid
+
+import catalog
+import database
+import models
+import product_cache
+
+
+def stamp_new_product():
+    """Write a product the way another worker would: row, version stamp, commit."""
+    db = database.SessionLocal()
+    try:
+        product = models.Product(name=f"item {uuid.uuid4().hex[:8]}", price=1, stock=1)
+        db.add(product)
+        db.flush()
+        catalog.touch(db, [product.id])
+        db.commit()
+        return product.id
+    finally:
+        db.close()
+
+
+def test_concurrent_syncs_never_go_backwards(monkeypatch):
+    cache = product_cache.ProductCache()
+    calls = []
+    cache.on_sync(lambda db, rows, deleted: calls.append(rows))
+    db = database.SessionLocal()
+    try:
+        cache.sync(db)
+    finally:
+        db.close()
+
+    read_version = catalog.current_version
+    slow_read = threading.Event()
+
+    def current_version(db):
+        version = read_version(db)
+        if threading.current_thread().name == "slow":
+            slow_read.set()
+            time.sleep(0.3)  # a newer sync starts and finishes meanwhile without the lock
+        return version
+
+    monkeypatch.setattr(product_cache.catalog, "current_version", current_version)
+
+    def sync():
+        db = database.SessionLocal()
+        try:
+            cache.sync(db)
+        finally:
+            db.close()
+
+    first = stamp_new_product()
+    slow = threading.Thread(target=sync, name="slow")
+    slow.start()
+    slow_read.wait(5)
+    second = stamp_new_product()
+    fast = threading.Thread(target=sync, name="fast")
+    fast.start()
+    slow.join()
+    fast.join()
+
+    db = database.SessionLocal()
+    try:
+        assert cache.version == read_version(db)
+    finally:
+        db.close()
+    assert None not in calls  # no sync mistook an older read for a database reset
+    seen = {row[0] for rows in calls for row in rows}
+    assert {first, second} <= seen
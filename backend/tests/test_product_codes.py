@@ -0,0 +1,73 @@
+import uuid
+
+from sqlalchemy import inspect
+
+import database
+import inventory
+
+
+def new_code() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def add_product(client, headers, codes=""):
+    response = client.post(
+        "/products/", data={"name": f"item {uuid.uuid4().hex[:8]}", "price": 2, "stock": 10, "codes": codes}, headers=headers
+    )
+    return response
+
+
+def test_lookup_by_code(client, admin_headers):
+    carton, unit = new_code(), new_code()
+    product = add_product(client, admin_headers, f"{carton}, {unit}").json()
+    assert product["codes"] == sorted([carton, unit])
+
+    response = client.get(f"/products/by-code/{unit}")
+    assert response.status_code == 200 and response.json()["id"] == product["id"]
+    assert client.get(f"/products/by-code/{new_code()}").status_code == 404
+
+    missing = new_code()
+    response = client.post("/products/by-code", json={"codes": [carton, missing]})
+    assert response.status_code == 200
+    assert response.json()["products"][carton]["id"] == product["id"]
+    assert response.json()["missing"] == [missing]
+
+
+def test_duplicate_codes_are_rejected(client, admin_headers):
+    code = new_code()
+    first = add_product(client, admin_headers, code).json()
+    assert add_product(client, admin_headers, code).status_code == 409
+
+    second = add_product(client, admin_headers, new_code()).json()
+    response = client.put(
+        f"/products/{second['id']}",
+        data={"name": second["name"], "price": 2, "stock": 10, "codes": code},
+        headers=admin_headers,
+    )
+    assert response.status_code == 409
+    assert client.get(f"/products/by-code/{code}").json()["id"] == first["id"]
+
+
+def test_checkout_loads_codes_once_per_bill(client, admin_headers):
+    products = [add_product(client, admin_headers, f"{new_code()} {new_code()}").json() for _ in range(3)]
+
+    counts = []
+    for lines in (products[:1], products):
+        response = client.post(
+            "/bills/", json={"items": [{"product_id": p["id"], "quantity": 1} for p in lines]}, headers=admin_headers
+        )
+        assert response.status_code == 200, response.text
+        assert [item["product"]["codes"] for item in response.json()["items"]] == [p["codes"] for p in lines]
+        counts.append(int(response.headers["X-Query-Count"]))
+    assert counts[0] == counts[1]
+
+
+def test_stock_reservation_leaves_codes_unloaded(client, admin_headers):
+    product = add_product(client, admin_headers, new_code()).json()
+    db = database.SessionLocal()
+    try:
+        products, _, _ = inventory.reserve_stock(db, {product["id"]: 1})
+        assert "code_rows" in inspect(products[product["id"]]).unloaded
+        db.rollback()
+    finally:
+        db.close()
@@ -0,0 +1,62 @@
+import random
+import string
+
+
+def unique_word() -> str:
+    # Letters only, so the search tokenizer keeps it whole and nothing else in a shared database matches
+    return "zq" + "".join(random.choice(string.ascii_lowercase) for _ in range(6))
+
+
+def add_products(client, headers, names):
+    for name in names:
+        response = client.post("/products/", data={"name": name, "price": 1, "stock": 1}, headers=headers)
+        assert response.status_code == 200, response.text
+
+
+def search(client, q, **params):
+    response = client.get("/products/search", params={"q": q, **params})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_prefix_pages(client, admin_headers):
+    word = unique_word()
+    add_products(client, admin_headers, [f"{word} Butter", f"{word} Buttermilk", f"{word} Butter Cookies"])
+
+    first = search(client, word, limit=2)
+    second = search(client, word, limit=2, offset=2)
+    assert first["mode"] == second["mode"] == "prefix"
+    assert len(first["products"]) == 2 and first["has_more"]
+    assert len(second["products"]) == 1 and not second["has_more"]
+    names = {p["name"] for p in first["products"] + second["products"]}
+    assert len(names) == 3
+
+
+def test_fuzzy_second_page(client, admin_headers):
+    word = unique_word()
+    add_products(client, admin_headers, [f"Amul {word}", f"Amul {word}milk", f"Britannia {word} Cookies"])
+    typo = word[:4] + word[5:]  # one letter dropped: no prefix match, trigrams still close
+
+    first = search(client, typo, limit=1)
+    assert first["mode"] == "fuzzy"
+    assert len(first["products"]) == 1 and first["has_more"]
+
+    seen = [p["id"] for p in first["products"]]
+    offset = 1
+    while True:
+        page = search(client, typo, limit=1, offset=offset)
+        assert page["mode"] == "fuzzy"
+        seen += [p["id"] for p in page["products"]]
+        if not page["has_more"]:
+            break
+        assert page["products"], "has_more promised a page that came back empty"
+        offset += 1
+    assert len(seen) == len(set(seen)) >= 2
+
+
+def test_empty_page_after_prefix_matches_is_not_fuzzy(client, admin_headers):
+    word = unique_word()
+    add_products(client, admin_headers, [f"{word} Tea"])
+
+    page = search(client, word, limit=5, offset=5)
+    assert page == {"products": [], "mode": "prefix", "has_more": False}
@@ -0,0 +1,68 @@
+import asyncio
+import io
+import threading
+
+import pytest
+from botocore.stub import Stubber
+
+import storage
+
+
+def s3_backend(**kwargs):
+    return storage.S3Backend(
+        bucket="shop-images", endpoint_url="https://s3.test", access_key_id="key", secret_access_key="secret", **kwargs
+    )
+
+
+def test_local_backend_round_trips(tmp_path):
+    backend = storage.LocalBackend(root=str(tmp_path))
+    body = b"\x89PNG" + bytes(range(256)) * 8
+    assert backend.put("products/a.png", io.BytesIO(body), "image/png") == "/uploads/products/a.png"
+    assert (tmp_path / "products" / "a.png").read_bytes() == body
+
+
+def test_s3_backend_uploads_through_the_shared_client():
+    backend = s3_backend(public_url_base="https://cdn.test")
+    fileobj = io.BytesIO(b"logo bytes")
+    sent = []
+    backend.client.meta.events.register("before-parameter-build.s3.PutObject", lambda params, **_: sent.append(dict(params)))
+    with Stubber(backend.client) as stub:
+        stub.add_response("put_object", {})
+        assert backend.put("store-logos/x.png", fileobj, "image/png") == "https://cdn.test/store-logos/x.png"
+        stub.assert_no_pending_responses()
+    assert [(p["Bucket"], p["Key"], p["ContentType"]) for p in sent] == [("shop-images", "store-logos/x.png", "image/png")]
+    assert not fileobj.closed  # _KeepOpen: the caller still owns the file
+
+
+def test_failed_s3_upload_falls_back_to_local(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    backend = s3_backend()
+    fileobj = io.BytesIO(b"photo")
+    with Stubber(backend.client) as stub:
+        stub.add_client_error("put_object", service_error_code="SlowDown", http_status_code=503)
+        assert storage._put(backend, "products/p.jpg", fileobj, "image/jpeg") == "/uploads/products/p.jpg"
+    assert (tmp_path / "uploads" / "products" / "p.jpg").read_bytes() == b"photo"
+
+    # A local write that fails has nothing to fall back to
+    (tmp_path / "not-a-dir").write_text("")
+    with pytest.raises(OSError):
+        storage._put(storage.LocalBackend(root=str(tmp_path / "not-a-dir")), "products/p.jpg", io.BytesIO(b""), None)
+
+
+def test_full_pool_raises_storage_busy():
+    pool = storage.UploadPool(workers=1, max_queue=0, timeout=5)
+    release = threading.Event()
+
+    async def scenario():
+        first = asyncio.ensure_future(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+        with pytest.raises(storage.StorageBusy):
+            await pool.run(release.wait)
+        release.set()
+        assert await first is True
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        pool.shutdown()
+    assert pool.pending == 0
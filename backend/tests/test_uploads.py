@@ -0,0 +1,55 @@
+import re
+import uuid
+
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+import uploads
+
+
+def small_app(max_bytes=1024):
+    app = FastAPI()
+
+    @app.post("/photo")
+    async def photo(file: UploadFile = File(...)):
+        uploads.check_image(file)
+        return {"size": len(await file.read())}
+
+    limit = uploads.Limit("POST", re.compile(r"/photo"), max_bytes, (uploads.MULTIPART,), "image")
+    app.add_middleware(uploads.UploadLimits, limits=[limit])
+    return TestClient(app)
+
+
+def test_declared_length_over_the_limit_is_413():
+    client = small_app()
+    response = client.post("/photo", files={"file": ("a.png", b"x" * 2048, "image/png")})
+    assert response.status_code == 413
+    assert response.json()["detail"] == "Upload too large: image over 1 KB"
+    assert client.post("/photo", files={"file": ("a.png", b"x" * 100, "image/png")}).json() == {"size": 100}
+
+
+def test_streamed_body_is_cut_off_at_the_limit():
+    client = small_app()
+    boundary = uuid.uuid4().hex
+    head = f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="a.png"\r\nContent-Type: image/png\r\n\r\n'
+
+    def chunks():  # no Content-Length: sent chunked
+        yield head.encode()
+        for _ in range(8):
+            yield b"x" * 512
+        yield f"\r\n--{boundary}--\r\n".encode()
+
+    response = client.post("/photo", content=chunks(), headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    assert response.status_code == 413
+
+
+def test_wrong_body_and_file_types_are_415(client, admin_headers):
+    response = client.post("/products/", json={"name": "x", "price": 1}, headers=admin_headers)
+    assert response.status_code == 415
+
+    pdf = client.post(
+        "/products/", data={"name": f"item {uuid.uuid4().hex[:8]}", "price": 1},
+        files={"image": ("menu.pdf", b"%PDF-1.4", "application/pdf")}, headers=admin_headers,
+    )
+    assert pdf.status_code == 415 and "menu.pdf is not an image" in pdf.json()["detail"]
+    assert small_app().post("/photo", files={"file": ("scan.pdf", b"%PDF", "application/octet-stream")}).status_code == 415
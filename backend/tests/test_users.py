@@ -0,0 +1,38 @@
+import auth
+from conftest import login, make_user, user_id_of
+
+
+def test_only_the_account_itself_can_deactivate_it(client):
+    owner, other = make_user(), make_user()
+    owner_headers, other_headers = login(client, owner), login(client, other)
+
+    response = client.post(f"/users/{user_id_of(owner)}/deactivate", headers=other_headers)
+    assert response.status_code == 403
+    assert client.get("/bills/", headers=owner_headers).status_code == 200
+
+
+def test_deactivate_drops_the_cached_user(client):
+    username = make_user()
+    user_id = user_id_of(username)
+    headers = login(client, username)
+    assert client.get("/bills/", headers=headers).status_code == 200
+    assert auth.user_cache.get(user_id) is not None
+
+    assert client.post(f"/users/{user_id}/deactivate", headers=headers).status_code == 200
+    assert auth.user_cache.get(user_id) is None
+    assert client.get("/bills/", headers=headers).status_code == 401
+    response = client.post("/token", data={"username": username, "password": "pw", "device_id": "tests"})
+    assert response.status_code == 401
+
+
+def test_password_change_drops_the_cached_user(client):
+    username = make_user()
+    user_id = user_id_of(username)
+    headers = login(client, username)
+    assert client.get("/bills/", headers=headers).status_code == 200
+    assert auth.user_cache.get(user_id) is not None
+
+    response = client.post("/users/change_password", data={"old_password": "pw", "new_password": "pw2"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert auth.user_cache.get(user_id) is None
+    login(client, username, password="pw2")
@@ -0,0 +1,138 @@
+"""Size and type limits for upload routes, enforced while the body streams in.
+
+FastAPI parses the whole multipart form (spooling files to temporary files)
+before a handler runs, so a size check in the handler only happens after
+the entire upload was received. UploadLimits, an ASGI middleware, applies
+each upload route's limit to the request body itself:
+
+- a Content-Length over the limit gets 413 before any of the body is read;
+- otherwise bytes are counted as they arrive and the request fails with 413
+  as soon as it passes the limit (chunked bodies, wrong Content-Length);
+- a body that isn't one of the route's form encodings gets 415, unread.
+
+Files of the wrong kind (a PDF as a product photo, an image as a price list)
+are rejected with ``is_image`` / ``is_csv`` before a handler reads, uploads
+or OCRs them. Clients that send no specific type (application/octet-stream,
+as the Flutter app's MultipartFile does) are judged by the file extension.
+"""
+import os
+import re
+from typing import Iterable, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+import imaging
+
+MB = 1024 * 1024
+UPLOAD_IMAGE_MAX_BYTES = int(os.getenv("UPLOAD_IMAGE_MAX_BYTES", str(10 * MB)))  # product photos, store logos
+RECOGNIZE_BATCH_MAX_BYTES = int(os.getenv("RECOGNIZE_BATCH_MAX_BYTES", str(64 * MB)))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(50 * MB)))
+FORM_OVERHEAD = 64 * 1024  # multipart boundaries, part headers and the plain form fields
+
+MULTIPART = "multipart/form-data"
+URLENCODED = "application/x-www-form-urlencoded"
+
+IMAGE_EXTENSIONS = {"jpg", "jpeg", "png", "webp", "gif", "bmp", "tif", "tiff", "heic", "heif"}
+CSV_TYPES = {"text/csv", "application/csv", "application/vnd.ms-excel", "text/plain"}
+UNTYPED = {"", "application/octet-stream", "binary/octet-stream"}
+
+
+class Limit(NamedTuple):
+    method: str
+    path: "re.Pattern"
+    max_bytes: int
+    body_types: Tuple[str, ...]
+    what: str
+
+
+LIMITS = [
+    Limit("POST", re.compile(r"/recognize/?"), imaging.OCR_MAX_BYTES + FORM_OVERHEAD, (MULTIPART,), "image"),
+    Limit("POST", re.compile(r"/recognize/batch"), RECOGNIZE_BATCH_MAX_BYTES, (MULTIPART,), "batch"),
+    Limit("POST", re.compile(r"/products/bulk_upload"), IMPORT_MAX_BYTES, (MULTIPART,), "CSV file"),
+    Limit("POST", re.compile(r"/products/?"), UPLOAD_IMAGE_MAX_BYTES + FORM_OVERHEAD, (MULTIPART, URLENCODED), "image"),
+    Limit("PUT", re.compile(r"/products/\d+"), UPLOAD_IMAGE_MAX_BYTES + FORM_OVERHEAD, (MULTIPART, URLENCODED), "image"),
+    Limit("PUT", re.compile(r"/store"), UPLOAD_IMAGE_MAX_BYTES + FORM_OVERHEAD, (MULTIPART, URLENCODED), "logo"),
+    Limit("POST", re.compile(r"/register"), UPLOAD_IMAGE_MAX_BYTES + FORM_OVERHEAD, (MULTIPART, URLENCODED), "logo"),
+]
+
+
+def limit_for(method: str, path: str, limits: Iterable[Limit] = LIMITS) -> Optional[Limit]:
+    for limit in limits:
+        if limit.method == method and limit.path.fullmatch(path):
+            return limit
+    return None
+
+
+def too_large(limit: Limit) -> str:
+    return f"Upload too large: {limit.what} over {limit.max_bytes // 1024} KB"
+
+
+class UploadLimits:
+    """ASGI middleware applying LIMITS to request bodies as they stream in."""
+
+    def __init__(self, app, limits: Iterable[Limit] = LIMITS):
+        self.app = app
+        self.limits = list(limits)
+
+    async def __call__(self, scope, receive, send):
+        limit = limit_for(scope["method"], scope["path"], self.limits) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        body_type = headers.get("content-type", "").split(";")[0].strip().lower()
+        if body_type and body_type not in limit.body_types:
+            response = JSONResponse({"detail": f"Expected {' or '.join(limit.body_types)}, got {body_type}"}, status_code=415)
+            await response(scope, receive, send)
+            return
+        declared = headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > limit.max_bytes:
+            await JSONResponse({"detail": too_large(limit)}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def counted_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit.max_bytes:
+                    # Raised inside the form parser; FastAPI passes HTTPExceptions from it through
+                    raise HTTPException(status_code=413, detail=too_large(limit))
+            return message
+
+        await self.app(scope, counted_receive, send)
+
+
+def _declared_type(file: UploadFile) -> str:
+    return (file.content_type or "").split(";")[0].strip().lower()
+
+
+def _extension(file: UploadFile) -> str:
+    name = file.filename or ""
+    return name.rsplit(".", 1)[-1].lower() if "." in name else ""
+
+
+def is_image(file: UploadFile) -> bool:
+    declared = _declared_type(file)
+    if declared in UNTYPED:
+        return _extension(file) in IMAGE_EXTENSIONS
+    return declared.startswith("image/") and declared != "image/svg+xml"  # SVG can carry script
+
+
+def is_csv(file: UploadFile) -> bool:
+    declared = _declared_type(file)
+    return _extension(file) == "csv" and (declared in UNTYPED or declared in CSV_TYPES)
+
+
+def check_image(file: UploadFile):
+    """415 unless ``file`` is an image; call before reading it."""
+    if not is_image(file):
+        raise HTTPException(
+            status_code=415,
+            detail=f"{file.filename or 'Upload'} is not an image ({file.content_type or 'no content type'})",
+        )